@@ -1,10 +1,57 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from routes import account, messaging, profile
+from avatars import avatar_gc_loop
+from backplane import backplane
+from constants import JWT_SECRET_KEY, MESSAGE_RETENTION_DAYS
+from deletions import deletion_job_loop, deletion_runner
+from event_log import event_log_compaction_loop, warm_event_sequence
+from images import image_pool
+from metrics import MetricsMiddleware
+from migrations import migrate
+from presence import presence
+from read_cursors import read_tracker
+from routes import account, conversations, messaging, metrics, profile
+from typing_indicator import typing_tracker
+from writer import db_writer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Checked here rather than in constants, so tools and tests can import without it
+    if not JWT_SECRET_KEY:
+        raise ValueError("JWT secret key empty")
+
+    await asyncio.to_thread(migrate)
+    await backplane.start()
+    await messaging.warm_hot_history()
+    await warm_event_sequence()
+    presence.start()
+    background = [
+        asyncio.create_task(avatar_gc_loop()),
+        asyncio.create_task(event_log_compaction_loop()),
+        asyncio.create_task(deletion_job_loop())
+    ]
+    if MESSAGE_RETENTION_DAYS > 0:
+        from retention import retention_loop
+        background.append(asyncio.create_task(retention_loop()))
+    yield
+    for task in background:
+        task.cancel()
+    await typing_tracker.stop()
+    # These flush pending state, so they go before the writer stops
+    await deletion_runner.stop()
+    await presence.stop()
+    await read_tracker.stop()
+    await db_writer.stop()
+    await backplane.stop()
+    image_pool.shutdown()
+
 
 # Инициализация FastAPI
-app = FastAPI(title="PixelChat")
+app = FastAPI(title="PixelChat", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -15,7 +62,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps everything, CORS preflights included
+app.add_middleware(MetricsMiddleware)
+
 # Routes
 app.include_router(account.router)
+app.include_router(conversations.router)
 app.include_router(messaging.router)
+app.include_router(metrics.router)
 app.include_router(profile.router)
\ No newline at end of file
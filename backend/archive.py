@@ -0,0 +1,201 @@
+"""
+Cold storage for messages moved out of the `message` table by retention.
+
+Messages are kept serialized, as history pages return them, in one segment
+per month: `YYYY-MM.ndjson.gz`, gzip-compressed NDJSON in (timestamp, id)
+order. Segments are append-only, every archive run adds a gzip member.
+`index.json` lists the segments with their key ranges, committed length
+and the profile pictures their messages show, and records the newest
+archived key, `archived_through`. Bytes
+past a segment's committed length are from a run that didn't finish and
+are cut off by the next append.
+
+Retention archives oldest first, so everything up to `archived_through`
+is in the archive; a message still in the table at or below it was
+archived by a run that stopped before deleting it.
+
+Segments hold every conversation. Pages of one conversation filter them,
+so a quiet conversation may read several segments for one page.
+"""
+import gzip
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from constants import ARCHIVE_CACHE_SEGMENTS, ARCHIVE_DIR, PUBLIC_CONVERSATION_ID
+from history_cache import Key, message_key
+
+
+def _encode_key(key: Key) -> list:
+    return [key[0].isoformat(), key[1]]
+
+
+def _decode_key(key: list | None) -> Key | None:
+    return (datetime.fromisoformat(key[0]), key[1]) if key else None
+
+
+def _profile_pictures(messages: list[dict]) -> set[str]:
+    pictures = set()
+    for message in messages:
+        for shown in (message, message.get("reply_to")):
+            if shown and shown.get("profile_picture"):
+                pictures.add(shown["profile_picture"])
+    return pictures
+
+
+class MessageArchive:
+    def __init__(self, directory: str | Path = ARCHIVE_DIR, cache_segments: int = ARCHIVE_CACHE_SEGMENTS) -> None:
+        self.directory = Path(directory)
+        self.index_path = self.directory / "index.json"
+        self.cache_segments = cache_segments
+        self._index: dict = {"segments": {}, "archived_through": None}
+        self._index_mtime: int | None = None
+        # (segment, message count) -> messages, so appends invalidate it
+        self._segments: OrderedDict[tuple[str, int], tuple[dict[int, list[Key]], dict[int, list[dict]]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> dict:
+        # Retention may run in another worker, pick up its index writes
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return self._index
+        if mtime != self._index_mtime:
+            with open(self.index_path, encoding="utf-8") as file:
+                self._index = json.load(file)
+            self._index_mtime = mtime
+        return self._index
+
+    @property
+    def archived_through(self) -> Key | None:
+        return _decode_key(self.index["archived_through"])
+
+    def count(self) -> int:
+        return sum(segment["count"] for segment in self.index["segments"].values())
+
+    def append(self, messages: list[dict]):
+        """
+        Add messages newer than anything archived so far, in key order.
+        Segments are synced before the index points at them.
+        """
+        index = json.loads(json.dumps(self.index))
+        os.makedirs(self.directory, exist_ok=True)
+
+        by_month: dict[str, list[dict]] = {}
+        for message in messages:
+            by_month.setdefault(message["timestamp"][:7], []).append(message)
+
+        for month, batch in by_month.items():
+            segment = index["segments"].setdefault(month, {
+                "file": f"{month}.ndjson.gz", "bytes": 0, "count": 0, "first": None, "last": None, "profile_pictures": []
+            })
+            lines = "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in batch)
+            with open(self.directory / segment["file"], "ab") as file:
+                file.truncate(segment["bytes"])
+                file.write(gzip.compress(lines.encode("utf-8")))
+                file.flush()
+                os.fsync(file.fileno())
+                segment["bytes"] = file.tell()
+
+            segment["count"] += len(batch)
+            segment["first"] = segment["first"] or _encode_key(message_key(batch[0]))
+            segment["last"] = _encode_key(message_key(batch[-1]))
+            if "profile_pictures" in segment:
+                segment["profile_pictures"] = sorted(set(segment["profile_pictures"]) | _profile_pictures(batch))
+
+        index["archived_through"] = _encode_key(message_key(messages[-1]))
+        index["segments"] = dict(sorted(index["segments"].items()))
+
+        temporary = self.index_path.with_suffix(".tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.index_path)
+
+    def profile_pictures(self) -> set[str]:
+        """
+        Profile picture URLs shown by archived messages, their files have to stay.
+        """
+        pictures = set()
+        for month, segment in self.index["segments"].items():
+            if "profile_pictures" in segment:
+                pictures.update(segment["profile_pictures"])
+                continue
+            # Segments written before the index listed them
+            _, messages = self._load(month, segment)
+            for conversation_messages in messages.values():
+                pictures |= _profile_pictures(conversation_messages)
+        return pictures
+
+    def before(self, key: Key | None, count: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> list[dict]:
+        """
+        Up to `count` archived messages of the conversation older than `key`, ascending.
+        """
+        result = []
+        segments = self.index["segments"]
+        for month in reversed(segments):
+            segment = segments[month]
+            if key and _decode_key(segment["first"]) >= key:
+                continue
+            keys, messages = self._read(month, segment, conversation_id)
+            end = bisect_left(keys, key) if key else len(keys)
+            result = messages[max(0, end - (count - len(result))):end] + result
+            if len(result) >= count:
+                break
+        return result
+
+    def after(self, key: Key, count: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> list[dict]:
+        """
+        Up to `count` archived messages of the conversation newer than `key`, ascending.
+        """
+        result = []
+        for month, segment in self.index["segments"].items():
+            if _decode_key(segment["last"]) <= key:
+                continue
+            keys, messages = self._read(month, segment, conversation_id)
+            start = bisect_right(keys, key)
+            result += messages[start:start + count - len(result)]
+            if len(result) >= count:
+                break
+        return result
+
+    def _read(self, month: str, segment: dict, conversation_id: int) -> tuple[list[Key], list[dict]]:
+        keys, messages = self._load(month, segment)
+        if conversation_id not in messages:
+            return [], []
+        return keys[conversation_id], messages[conversation_id]
+
+    def _load(self, month: str, segment: dict) -> tuple[dict[int, list[Key]], dict[int, list[dict]]]:
+        cache_key = (month, segment["count"])
+        with self._lock:
+            cached = self._segments.get(cache_key)
+            if cached:
+                self._segments.move_to_end(cache_key)
+                return cached
+
+        with open(self.directory / segment["file"], "rb") as file:
+            data = file.read(segment["bytes"])
+        # Split by conversation, messages archived before there were any are in the public room
+        keys: dict[int, list[Key]] = {}
+        messages: dict[int, list[dict]] = {}
+        for line in gzip.decompress(data).decode("utf-8").splitlines():
+            message = json.loads(line)
+            conversation_id = message.get("conversation_id", PUBLIC_CONVERSATION_ID)
+            keys.setdefault(conversation_id, []).append(message_key(message))
+            messages.setdefault(conversation_id, []).append(message)
+        entry = (keys, messages)
+
+        with self._lock:
+            self._segments[cache_key] = entry
+            while len(self._segments) > self.cache_segments:
+                self._segments.popitem(last=False)
+        return entry
+
+
+message_archive = MessageArchive()
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from archive import message_archive
+from constants import AVATAR_CACHE_BYTES, AVATAR_GC_GRACE, AVATAR_GC_INTERVAL
+from db import run_in_db
+from images import PROFILE_PICTURE_FORMATS, PROFILE_PICTURE_SIZES, rendition_filename
+
+logger = logging.getLogger("uvicorn.error")
+
+PROFILE_PICTURES_DIR = Path("data/uploads/pfp")
+
+# Avatar files are named after their content and never change once written
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+AVATAR_FILENAME = re.compile(r"/profile-picture/([\w-]+\.jpg)")
+
+os.makedirs(PROFILE_PICTURES_DIR, exist_ok=True)
+
+
+def avatar_etag(filename: str) -> str:
+    # The rendition name already identifies the bytes, no need to hash them
+    return f'"{filename}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class AvatarCache:
+    """
+    LRU of the most requested avatar files, bounded by total bytes.
+    """
+
+    def __init__(self, max_bytes: int = AVATAR_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+
+    def get(self, filename: str) -> tuple[bytes, str] | None:
+        entry = self._entries.get(filename)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(filename)
+        self.hits += 1
+        return entry
+
+    def put(self, filename: str, data: bytes, media_type: str):
+        if len(data) > self.max_bytes:
+            return
+
+        self.discard(filename)
+        self._entries[filename] = (data, media_type)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, filename: str):
+        entry = self._entries.pop(filename, None)
+        if entry:
+            self.size -= len(entry[0])
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+avatar_cache = AvatarCache()
+
+
+def referenced_avatars(db: Session) -> set[str]:
+    """
+    Users' current pictures, and older ones in logged events that clients
+    may still get replayed.
+    """
+    urls = db.execute(text("SELECT profile_picture FROM user WHERE profile_picture IS NOT NULL")).scalars()
+    referenced = {url.rsplit("/", 1)[-1] for url in urls}
+
+    payloads = db.execute(text("SELECT payload FROM event_log WHERE payload LIKE '%/profile-picture/%'")).scalars()
+    for payload in payloads:
+        referenced.update(AVATAR_FILENAME.findall(payload))
+    return referenced
+
+
+def collect_avatar_garbage(referenced: set[str], directory: Path = PROFILE_PICTURES_DIR, grace: float = AVATAR_GC_GRACE) -> list[str]:
+    """
+    Delete every file that isn't a rendition of a referenced avatar. Files
+    younger than `grace` are kept: an upload writes its files before the
+    user row points at them.
+    """
+    keep = {
+        rendition_filename(filename, size, format)
+        for filename in referenced
+        for size in PROFILE_PICTURE_SIZES
+        for format in PROFILE_PICTURE_FORMATS
+    }
+    cutoff = time.time() - grace
+
+    removed = []
+    for entry in os.scandir(directory):
+        if entry.name in keep or not entry.is_file():
+            continue
+        try:
+            if entry.stat().st_mtime > cutoff:
+                continue
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            continue  # Another worker got there first
+        removed.append(entry.name)
+
+    return removed
+
+
+async def collect_avatars():
+    referenced = await run_in_db(referenced_avatars)
+    # Archived messages keep the picture they were posted with
+    archived = await asyncio.to_thread(message_archive.profile_pictures)
+    referenced |= {url.rsplit("/", 1)[-1] for url in archived}
+    removed = await asyncio.to_thread(collect_avatar_garbage, referenced)
+    for filename in removed:
+        avatar_cache.discard(filename)
+    if removed:
+        logger.info(f"Removed {len(removed)} unreferenced avatar files")
+
+
+async def avatar_gc_loop(interval: float = AVATAR_GC_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await collect_avatars()
+        except Exception:
+            logger.exception("Avatar garbage collection failed")
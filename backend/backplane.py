@@ -0,0 +1,214 @@
+import asyncio
+import fcntl
+import inspect
+import json
+import logging
+import os
+import struct
+from collections import defaultdict
+from typing import Any, Callable
+
+from constants import BACKPLANE, BACKPLANE_PEER_BUFFER_BYTES, BACKPLANE_SOCKET_PATH
+
+logger = logging.getLogger("uvicorn.error")
+
+BROADCAST_CHANNEL = "broadcast"
+USER_DELETED_CHANNEL = "userDeleted"
+PROFILE_UPDATED_CHANNEL = "profileUpdated"
+PRESENCE_CHANNEL = "presence"
+TYPING_CHANNEL = "typing"
+MEMBERSHIP_CHANNEL = "membership"
+
+Handler = Callable[[Any], Any]
+
+
+class Backplane:
+    """
+    Fan-out bus between workers. Everything published is delivered to the
+    subscribers of every worker, including the one that published it.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: dict[str, list[Handler]] = defaultdict(list)
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers[channel].append(handler)
+
+    async def publish(self, channel: str, payload: Any):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _dispatch(self, channel: str, payload: Any):
+        for handler in self._handlers.get(channel, []):
+            try:
+                result = handler(payload)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception(f"Backplane handler for {channel} failed")
+
+
+class InProcessBackplane(Backplane):
+    """Single worker: publishing is just a local dispatch."""
+
+    async def publish(self, channel: str, payload: Any):
+        await self._dispatch(channel, payload)
+
+
+def _pack(frame: dict) -> bytes:
+    data = json.dumps(frame, separators=(",", ":")).encode("utf-8")
+    return struct.pack("!I", len(data)) + data
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (length,) = struct.unpack("!I", await reader.readexactly(4))
+    return await reader.readexactly(length)
+
+
+class UnixSocketBackplane(Backplane):
+    """
+    Workers on one host share a broker listening on a Unix socket. Whichever
+    worker grabs the lock file hosts the broker, every worker (that one
+    included) connects to it as a client. If the broker's worker dies the
+    lock is released and the remaining workers elect a new one.
+
+    The broker drops a worker whose unsent frames pass `peer_buffer_limit`
+    bytes, that worker reconnects and carries on from there.
+    """
+
+    def __init__(self, path: str, reconnect_delay: float = 0.5, peer_buffer_limit: int = BACKPLANE_PEER_BUFFER_BYTES) -> None:
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.peer_buffer_limit = peer_buffer_limit
+        self._lock_fd: int | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._writer: asyncio.StreamWriter | None = None
+        self._connected = asyncio.Event()
+        self._client_task: asyncio.Task | None = None
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._client_task = asyncio.create_task(self._client_loop())
+        try:
+            await asyncio.wait_for(self._connected.wait(), 5)
+        except asyncio.TimeoutError:
+            logger.warning("Backplane broker is not reachable yet, delivering locally until it is")
+
+    async def stop(self):
+        if self._client_task:
+            self._client_task.cancel()
+            try:
+                await self._client_task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def publish(self, channel: str, payload: Any):
+        if not self._connected.is_set():
+            await self._dispatch(channel, payload)
+            return
+
+        try:
+            self._writer.write(_pack({"channel": channel, "payload": payload}))
+            await self._writer.drain()
+        except ConnectionError:
+            # The client loop reconnects, this worker's subscribers still get it
+            logger.warning(f"Backplane broker went away while publishing to {channel}, delivering locally")
+            await self._dispatch(channel, payload)
+
+    @property
+    def is_broker(self) -> bool:
+        return self._server is not None
+
+    async def _try_become_broker(self):
+        if self._server:
+            return
+
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+
+        self._lock_fd = fd
+        # Any socket file left here belongs to a dead broker
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, self.path)
+        logger.info(f"Backplane broker listening on {self.path}")
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                packed = struct.pack("!I", len(frame)) + frame
+                for peer in list(self._peers):
+                    if peer.is_closing():
+                        self._peers.discard(peer)
+                    elif peer.transport.get_write_buffer_size() > self.peer_buffer_limit:
+                        # A stalled worker would make the broker buffer without bound
+                        logger.warning("Dropping a backplane peer that stopped reading")
+                        self._peers.discard(peer)
+                        peer.transport.abort()
+                    else:
+                        peer.write(packed)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _client_loop(self):
+        while True:
+            try:
+                await self._try_become_broker()
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionError):
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._connected.set()
+            try:
+                while True:
+                    frame = json.loads(await _read_frame(reader))
+                    await self._dispatch(frame["channel"], frame["payload"])
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost connection to the backplane broker, reconnecting")
+            except Exception:
+                # A frame that can't be decoded leaves the stream in an unknown state
+                logger.exception("Bad frame from the backplane broker, reconnecting")
+            finally:
+                self._connected.clear()
+                self._writer.close()
+                self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+
+
+def create_backplane(kind: str = BACKPLANE) -> Backplane:
+    if kind == "local":
+        return InProcessBackplane()
+    if kind == "unix":
+        return UnixSocketBackplane(BACKPLANE_SOCKET_PATH)
+    raise ValueError(f"Unknown backplane: {kind}")
+
+
+backplane = create_backplane()
@@ -0,0 +1,401 @@
+"""
+Load test for the REST and WebSocket paths.
+
+Run from the backend directory:
+
+    python -m benchmarks.load --clients 100 --output results/main.json
+    python -m benchmarks.load --server uvicorn --workers 2 --compare results/main.json
+
+Seeds a fresh SQLite database in a temporary directory, serves the app with
+uvicorn (in this process, or as a separate process with --server uvicorn)
+and measures, one scenario after the other:
+
+- login: concurrent POST /login
+- getMessages newest/deep: GET /get_messages for the newest page and for
+  pages far back in history
+- fan-out: senders post sendMessage frames while every WebSocket client
+  records when the matching newMessage arrives
+- avatar upload: concurrent POST /upload-profile-picture
+
+Every scenario reports throughput and p50/p95/p99/max latency. --output
+saves the run as JSON and --compare prints the change against a saved run.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchmark"
+SEED_START = datetime(2024, 1, 1)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def summarize(samples: list[float], elapsed: float, errors: int = 0) -> dict:
+    if not samples:
+        return {"count": 0, "errors": errors}
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "throughput_per_s": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2)
+    }
+
+
+def seed(users: int, messages: int, batch: int = 50_000):
+    """
+    Writes straight to SQLite; all users share one password hash.
+    """
+    from db import engine
+    from utils import get_password_hash
+    from migrations import migrate
+
+    migrate(engine)
+
+    rng = random.Random(42)
+    words = [f"word{i}" for i in range(2000)]
+    password_hash = get_password_hash(PASSWORD)
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("BEGIN")
+        cursor.executemany(
+            "INSERT INTO user (username, password_hash, last_seen, created_at) VALUES (?, ?, ?, ?)",
+            [(f"bench{i}", password_hash, SEED_START, SEED_START) for i in range(users)]
+        )
+        cursor.execute("COMMIT")
+
+        for offset in range(0, messages, batch):
+            rows = [
+                (" ".join(rng.choices(words, k=rng.randint(3, 20))), SEED_START + timedelta(seconds=i), rng.randint(1, users))
+                for i in range(offset, min(offset + batch, messages))
+            ]
+            cursor.execute("BEGIN")
+            cursor.executemany("INSERT INTO message (content, timestamp, user_id) VALUES (?, ?, ?)", rows)
+            cursor.execute("COMMIT")
+    finally:
+        connection.close()
+
+
+class Server:
+    """
+    uvicorn on a free port, in this process or in a child process.
+    """
+
+    def __init__(self, mode: str, workers: int) -> None:
+        self.mode = mode
+        self.workers = workers
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = None
+        self._task = None
+        self._process = None
+
+    async def __aenter__(self) -> "Server":
+        if self.mode == "inprocess":
+            import uvicorn
+            from main import app
+
+            config = uvicorn.Config(app, port=self.port, log_level="warning", ws="websocket_protocol:ChatWebSocketProtocol")
+            self._server = uvicorn.Server(config)
+            self._task = asyncio.create_task(self._server.serve())
+        else:
+            env = dict(os.environ, BACKPLANE="unix" if self.workers > 1 else os.getenv("BACKPLANE", "local"))
+            self._process = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "main:app",
+                    "--app-dir", BACKEND_DIR,
+                    "--port", str(self.port),
+                    "--workers", str(self.workers),
+                    "--ws", "websocket_protocol:ChatWebSocketProtocol",
+                    "--log-level", "warning"
+                ],
+                env=env
+            )
+        await self._wait_ready()
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._server:
+            self._server.should_exit = True
+            await self._task
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+
+    async def _wait_ready(self, timeout: float = 30):
+        import httpx
+
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.url) as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get("/get_messages?limit=1")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise RuntimeError("Server did not start")
+
+
+async def timed_calls(calls: list, concurrency: int) -> dict:
+    """
+    Run the `calls` (coroutine factories returning True on success) with at
+    most `concurrency` in flight.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    samples: list[float] = []
+    errors = 0
+
+    async def run(call):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await call()
+            except Exception:
+                ok = False
+            if ok:
+                samples.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    return summarize(samples, time.perf_counter() - started, errors)
+
+
+async def bench_login(client, args) -> dict:
+    async def login(i: int):
+        response = await client.post("/login", json={"username": f"bench{i % args.users}", "password": PASSWORD})
+        return response.status_code == 200
+
+    return await timed_calls([lambda i=i: login(i) for i in range(args.logins)], args.concurrency)
+
+
+async def bench_get_messages(client, args, deep: bool) -> dict:
+    from routes.messaging import encode_cursor
+
+    rng = random.Random(7)
+
+    async def page():
+        params = {"limit": 50}
+        if deep:
+            # Seeded message n has id n and timestamp SEED_START + n - 1 seconds
+            message_id = rng.randint(100, max(101, args.messages // 2))
+            params["before"] = encode_cursor(SEED_START + timedelta(seconds=message_id - 1), message_id)
+        response = await client.get("/get_messages", params=params)
+        return response.status_code == 200
+
+    return await timed_calls([page] * args.requests, args.concurrency)
+
+
+async def bench_fan_out(server: Server, tokens: list[str], args) -> dict:
+    import websockets
+    from protocol import MSGPACK_SUBPROTOCOL, MsgpackCodec
+
+    codec = MsgpackCodec()
+    ws_url = server.url.replace("http", "ws") + "/chat/ws"
+    sent_at: dict[str, float] = {}
+    samples: list[float] = []
+    expected = args.senders * args.sends
+    done = asyncio.Event()
+    received = [0] * args.clients
+
+    def decode(frame) -> list[dict]:
+        return codec.decode(frame) if args.msgpack else [json.loads(frame)]
+
+    def encode(event: dict):
+        return codec.encode_request(event) if args.msgpack else json.dumps(event)
+
+    async def reader(index: int, websocket, acks: asyncio.Queue):
+        async for frame in websocket:
+            now = time.perf_counter()
+            for event in decode(frame):
+                if event["type"] == "newMessage" and event["data"]["content"] in sent_at:
+                    samples.append(now - sent_at[event["data"]["content"]])
+                    received[index] += 1
+                    if all(count >= expected for count in received):
+                        done.set()
+                elif event["type"] == "sendMessage":
+                    acks.put_nowait(event)
+
+    subprotocols = [MSGPACK_SUBPROTOCOL] if args.msgpack else None
+    sockets = []
+    tasks = []
+    queues = []
+    try:
+        for i in range(args.clients):
+            websocket = await websockets.connect(f"{ws_url}?token={tokens[i % len(tokens)]}", subprotocols=subprotocols, max_queue=None)
+            acks: asyncio.Queue = asyncio.Queue()
+            sockets.append(websocket)
+            queues.append(acks)
+            tasks.append(asyncio.create_task(reader(i, websocket, acks)))
+
+        async def sender(index: int):
+            for n in range(args.sends):
+                content = f"bench:{index}:{n}"
+                sent_at[content] = time.perf_counter()
+                await sockets[index].send(encode({"type": "sendMessage", "data": {"content": content}}))
+                await queues[index].get()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(i) for i in range(args.senders)))
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+    finally:
+        for task in tasks:
+            task.cancel()
+        for websocket in sockets:
+            await websocket.close()
+
+    result = summarize(samples, elapsed, errors=expected * args.clients - len(samples))
+    result["messages"] = expected
+    result["receivers"] = args.clients
+    return result
+
+
+def make_avatar(seed: int) -> bytes:
+    from PIL import Image
+
+    # Noise, so every upload has distinct content and is really processed
+    image = Image.frombytes("RGB", (800, 600), random.Random(seed).randbytes(800 * 600 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def bench_upload(client, tokens: list[str], args) -> dict:
+    images = [make_avatar(i) for i in range(args.uploads)]
+
+    async def upload(i: int):
+        response = await client.post(
+            "/upload-profile-picture",
+            files={"profile_picture": ("avatar.jpg", images[i], "image/jpeg")},
+            headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        )
+        return response.status_code == 200
+
+    return await timed_calls([lambda i=i: upload(i) for i in range(args.uploads)], args.concurrency)
+
+
+async def run(args) -> dict:
+    import httpx
+
+    async with Server(args.server, args.workers) as server:
+        async with httpx.AsyncClient(base_url=server.url, timeout=args.timeout) as client:
+            tokens = []
+            for i in range(min(args.users, args.clients)):
+                response = await client.post("/login", json={"username": f"bench{i}", "password": PASSWORD})
+                tokens.append(response.json()["token"])
+
+            results = {}
+            for name, scenario in [
+                ("login", lambda: bench_login(client, args)),
+                ("getMessages newest", lambda: bench_get_messages(client, args, deep=False)),
+                ("getMessages deep", lambda: bench_get_messages(client, args, deep=True)),
+                ("fan-out", lambda: bench_fan_out(server, tokens, args)),
+                ("avatar upload", lambda: bench_upload(client, tokens, args)),
+            ]:
+                results[name] = await scenario()
+                print(f"{name}: {results[name]}", file=sys.stderr)
+            return results
+
+
+def compare(results: dict, baseline: dict):
+    print(f"== compared with {baseline.get('label') or baseline['started_at']}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before or not result.get("count") or not before.get("count"):
+            continue
+        changes = [
+            f"{key} {before[key]} -> {result[key]} ({(result[key] - before[key]) / before[key]:+.0%})"
+            for key in ("throughput_per_s", "p50_ms", "p99_ms")
+            if before.get(key)
+        ]
+        print(f"{name}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers, with --server uvicorn")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100_000, help="messages seeded before the run")
+    parser.add_argument("--clients", type=int, default=50, help="WebSocket clients receiving the fan-out")
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--sends", type=int, default=20, help="messages per sender")
+    parser.add_argument("--requests", type=int, default=500, help="getMessages requests per scenario")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20, help="REST calls in flight")
+    parser.add_argument("--msgpack", action="store_true", help="WebSocket clients speak MessagePack")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--label", help="name saved with the results")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    args = parser.parse_args()
+    args.senders = min(args.senders, args.clients)
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    # Work in a throwaway data directory, a uvicorn child process inherits it
+    os.chdir(tempfile.mkdtemp(prefix="fromchat-bench-"))
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-not-for-production")
+    # Measure the server, not the rate limits; set these to measure with them
+    for name in ("RATE_LIMIT_SEND_RATE", "RATE_LIMIT_SEND_BURST", "RATE_LIMIT_FRAME_RATE", "RATE_LIMIT_FRAME_BURST"):
+        os.environ.setdefault(name, "1000000")
+    sys.path.insert(0, BACKEND_DIR)
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    seed_started = time.perf_counter()
+    seed(args.users, args.messages)
+    print(f"seeded {args.users} users and {args.messages} messages in {time.perf_counter() - seed_started:.1f}s", file=sys.stderr)
+
+    report = {
+        "label": args.label,
+        "started_at": started_at,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "label")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": asyncio.run(run(args))
+    }
+    print(json.dumps(report["results"], indent=2))
+
+    if output:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    if baseline_path:
+        with open(baseline_path) as file:
+            compare(report["results"], json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures how long the event loop stalls while many clients write messages.
+
+Run from the backend directory:
+
+    python -m benchmarks.loop_stall --clients 50 --messages 20
+
+A probe task sleeps for 1 ms in a loop and records how late it wakes up.
+With blocking DB calls on the loop the lateness grows with every commit;
+with the DB thread pool it should stay near zero.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def probe(stalls: list[float], stop: asyncio.Event, interval: float = 0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - start - interval)
+
+
+async def run(clients: int, messages: int) -> dict:
+    import httpx
+    from main import app
+    from migrations import migrate
+
+    # ASGITransport doesn't run the lifespan
+    migrate()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"username": "denis0001-dev", "password": "benchmark", "confirm_password": "benchmark"}
+        await client.post("/register", json=credentials)
+        response = await client.post("/login", json=credentials)
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        statuses: Counter[int] = Counter()
+
+        async def writer(index: int):
+            for i in range(messages):
+                response = await client.post("/send_message", json={"content": f"{index}:{i}"}, headers=headers)
+                statuses[response.status_code] += 1
+
+        stalls: list[float] = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(stalls, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(i) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+
+    stalls.sort()
+    return {
+        "writes": statuses.pop(200, 0),
+        # Rejected writes never reach the database, a run with any is not comparable
+        "rejected": dict(statuses) or None,
+        "elapsed_s": round(elapsed, 3),
+        "stall_p50_ms": round(statistics.median(stalls) * 1000, 3),
+        "stall_p99_ms": round(stalls[int(len(stalls) * 0.99)] * 1000, 3),
+        "stall_max_ms": round(stalls[-1] * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    # Work in a throwaway data directory
+    os.chdir(tempfile.mkdtemp(prefix="fromchat-bench-"))
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-not-for-production")
+    # Every writer is the same user, measure the loop rather than the rate limits
+    for name in ("RATE_LIMIT_SEND_RATE", "RATE_LIMIT_SEND_BURST"):
+        os.environ.setdefault(name, "1000000")
+    sys.path.insert(0, BACKEND_DIR)
+
+    for key, value in asyncio.run(run(args.clients, args.messages)).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
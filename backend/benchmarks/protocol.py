@@ -0,0 +1,126 @@
+"""
+Bytes on the wire and encode time of the /chat/ws encodings.
+
+Run from the backend directory:
+
+    python -m benchmarks.protocol --events 2000
+
+Compares JSON text frames with tagged MessagePack frames (one event per
+frame and batched) for history pages and newMessage broadcasts, raw and
+through permessage-deflate with context takeover at several settings.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (window bits, memLevel, level); uvicorn's own settings first
+DEFLATE_SETTINGS = {
+    "uvicorn 12/5/6": (12, 5, 6),
+    "13/6/6": (13, 6, 6),
+    "15/5/6": (15, 5, 6),
+    "15/8/6": (15, 8, 6),
+    "15/5/1": (15, 5, 1),
+}
+
+
+def make_messages(count: int, seed: int = 42) -> list[dict]:
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(2000)]
+    users = [(f"user{i}", f"/api/profile-picture/{rng.getrandbits(128):032x}.jpg" if i % 3 else None) for i in range(50)]
+    start = datetime(2025, 1, 1)
+
+    messages = []
+    for i in range(count):
+        username, picture = rng.choice(users)
+        message = {
+            "id": i + 1,
+            "content": " ".join(rng.choices(words, k=rng.randint(2, 25))),
+            "timestamp": (start + timedelta(seconds=i * 7, microseconds=rng.randint(0, 999999))).isoformat(),
+            "is_edited": rng.random() < 0.05,
+            "username": username,
+            "profile_picture": picture,
+            "reply_to": None
+        }
+        if messages and rng.random() < 0.2:
+            message["reply_to"] = {**rng.choice(messages[-50:]), "reply_to": None}
+        messages.append(message)
+    return messages
+
+
+def frame_size(payload: int) -> int:
+    # Server frames are unmasked: 2 byte header, longer lengths add 2 or 8
+    return payload + (2 if payload < 126 else 4 if payload < 65536 else 10)
+
+
+def deflated_sizes(frames: list[bytes], window_bits: int, mem_level: int, level: int) -> int:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+    total = 0
+    for frame in frames:
+        data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        total += frame_size(len(data) - 4)  # permessage-deflate drops the 00 00 ff ff tail
+    return total
+
+
+def measure(codec, batches: list[list[dict]]) -> dict:
+    started = time.perf_counter()
+    frames = [frame for batch in batches for frame in codec.encode(batch)]
+    elapsed = time.perf_counter() - started
+
+    frames = [frame.encode("utf-8") if isinstance(frame, str) else frame for frame in frames]
+    result = {
+        "frames": len(frames),
+        "raw_bytes": sum(frame_size(len(frame)) for frame in frames),
+        "encode_ms": round(elapsed * 1000, 2)
+    }
+    for name, settings in DEFLATE_SETTINGS.items():
+        result[f"deflate {name}"] = deflated_sizes(frames, *settings)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=8, help="events per batched MessagePack frame")
+    args = parser.parse_args()
+
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-not-for-production")
+    sys.path.insert(0, BACKEND_DIR)
+    from protocol import JsonCodec, MsgpackCodec
+
+    messages = make_messages(args.events)
+    pages = [
+        {"type": "getMessages", "data": {"status": "success", "messages": messages[i:i + args.page_size], "has_more": True, "prev_cursor": "MjAyNS0wMS0wMVQwMDowMDowMHwx", "next_cursor": None}}
+        for i in range(0, len(messages), args.page_size)
+    ]
+    broadcasts = [{"type": "newMessage", "data": message} for message in messages]
+
+    scenarios = {
+        "history pages": {
+            "json": (JsonCodec(), [[page] for page in pages]),
+            "msgpack": (MsgpackCodec(), [[page] for page in pages]),
+        },
+        "broadcasts": {
+            "json": (JsonCodec(), [[event] for event in broadcasts]),
+            "msgpack": (MsgpackCodec(), [[event] for event in broadcasts]),
+            f"msgpack x{args.batch}": (MsgpackCodec(), [broadcasts[i:i + args.batch] for i in range(0, len(broadcasts), args.batch)]),
+        }
+    }
+
+    for scenario, encodings in scenarios.items():
+        print(f"== {scenario} ({args.events} messages)")
+        baseline = None
+        for name, (codec, batches) in encodings.items():
+            result = measure(codec, batches)
+            baseline = baseline or result["raw_bytes"]
+            print(f"{name:>12}: {result} ({result['raw_bytes'] / baseline:.0%} of JSON raw)")
+
+
+if __name__ == "__main__":
+    main()
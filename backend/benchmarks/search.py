@@ -0,0 +1,108 @@
+"""
+Full-text search benchmark over a synthetic message table.
+
+Run from the backend directory:
+
+    python -m benchmarks.search --messages 3000000
+
+Seeds the table through the FTS triggers (so the insert rate includes index
+maintenance), then times search pages for common, rare, multi-word and
+prefix queries.
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = {
+    "common word": "word0",
+    "rare word": "word4999",
+    "two words": "word1 word2",
+    "prefix": "word12",
+}
+
+
+def seed(engine, messages: int, batch: int = 50_000) -> float:
+    rng = random.Random(42)
+    # Zipf-like vocabulary, like real chat text
+    vocabulary = [f"word{i}" for i in range(5000)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocabulary))))
+    start_time = datetime(2024, 1, 1)
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO user (username, password_hash) VALUES ('benchmark', '-')")
+        user_id = cursor.lastrowid
+
+        started = time.perf_counter()
+        for offset in range(0, messages, batch):
+            rows = []
+            for i in range(offset, min(offset + batch, messages)):
+                content = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(3, 20)))
+                rows.append((content, start_time + timedelta(seconds=i), user_id))
+            cursor.execute("BEGIN")
+            cursor.executemany("INSERT INTO message (content, timestamp, user_id) VALUES (?, ?, ?)", rows)
+            cursor.execute("COMMIT")
+            print(f"seeded {offset + len(rows)}/{messages}", end="\r", file=sys.stderr)
+        return time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def time_query(query: str, runs: int) -> dict:
+    from db import SessionLocal
+    from routes.messaging import search_messages_page
+
+    samples = []
+    with SessionLocal() as db:
+        for _ in range(runs):
+            started = time.perf_counter()
+            page = search_messages_page(db, query, None, 20)
+            samples.append(time.perf_counter() - started)
+
+        # Second page through the keyset cursor
+        started = time.perf_counter()
+        search_messages_page(db, query, page["next_cursor"], 20)
+        next_page = time.perf_counter() - started
+
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95)] * 1000, 2),
+        "next_page_ms": round(next_page * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=3_000_000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="fromchat-bench-"))
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-not-for-production")
+    sys.path.insert(0, BACKEND_DIR)
+
+    from db import engine
+    from migrations import migrate
+
+    migrate(engine)
+
+    elapsed = seed(engine, args.messages)
+    print(f"insert: {args.messages / elapsed:.0f} messages/s with FTS triggers")
+    print(f"database size: {os.path.getsize('data/database.db') / 1024 / 1024:.1f} MiB")
+
+    for name, query in QUERIES.items():
+        print(f"{name} ({query!r}): {time_query(query, args.runs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Cold start and per-worker memory.
+
+Run from the backend directory:
+
+    python -m benchmarks.startup --runs 5
+
+Every run is a fresh interpreter, as a newly started uvicorn worker would
+be, in a throwaway data directory. It measures:
+
+- import: `import main`, the time before a worker can serve anything
+- startup (new db): the lifespan startup against an empty database, which
+  runs every migration
+- startup (migrated db): the lifespan startup of a later worker, which
+  finds the schema up to date
+- RSS after import and after startup, and which heavy modules got loaded
+
+Prints the median over all runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that are expensive to import and aren't needed to serve requests
+HEAVY_MODULES = ("PIL.Image", "bcrypt", "gzip", "retention")
+
+
+def rss_mib() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child():
+    import asyncio
+
+    sys.path.insert(0, BACKEND_DIR)
+    result = {}
+
+    start = time.perf_counter()
+    from main import app
+    result["import_ms"] = (time.perf_counter() - start) * 1000
+    result["rss_import_mib"] = rss_mib()
+
+    async def startup() -> float:
+        start = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            elapsed = time.perf_counter() - start
+        return elapsed
+
+    result["startup_new_db_ms"] = asyncio.run(startup()) * 1000
+    result["rss_startup_mib"] = rss_mib()
+    result["startup_migrated_db_ms"] = asyncio.run(startup()) * 1000
+    result["loaded"] = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    print(json.dumps(result))
+
+
+def run() -> dict:
+    env = dict(os.environ, JWT_SECRET=os.getenv("JWT_SECRET", "benchmark-secret-not-for-production"))
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=tempfile.mkdtemp(prefix="fromchat-bench-"),
+        env=dict(env, PYTHONPATH=BACKEND_DIR),
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    results = [run() for _ in range(args.runs)]
+    for key in results[0]:
+        if key == "loaded":
+            print(f"heavy modules loaded: {', '.join(results[-1]['loaded']) or 'none'}")
+        else:
+            print(f"{key}: {statistics.median(result[key] for result in results):.1f}")
+
+
+if __name__ == "__main__":
+    main()
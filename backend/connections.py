@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from collections import deque
+from fastapi import WebSocket
+
+from constants import PUBLIC_CONVERSATION_ID, RATE_LIMITS, WS_BATCH_MAX_SIZE, WS_BATCH_WINDOW_MS, WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT, WS_SLOW_CONSUMER_POLICY
+from dependencies import UserSnapshot
+from protocol import DEFAULT_CODEC, Codec, PreparedEvent
+from rate_limit import TokenBucket
+
+logger = logging.getLogger("uvicorn.error")
+
+# What to do when a client can't keep up with its outbound queue
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DISCONNECT = "disconnect"
+
+
+class SocketConnection:
+    """
+    A WebSocket with a bounded outbound queue drained by its own writer task,
+    so sending to it never blocks the caller. With a batching codec the
+    writer waits `batch_window` seconds after the first queued event and
+    sends everything queued by then in one frame.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        codec: Codec = DEFAULT_CODEC,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SLOW_CONSUMER_POLICY,
+        batch_window: float = WS_BATCH_WINDOW_MS / 1000
+    ) -> None:
+        if policy not in (POLICY_DROP_OLDEST, POLICY_DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+
+        self.websocket = websocket
+        self.codec = codec
+        self.policy = policy
+        self.batch_window = batch_window
+        self.queue: asyncio.Queue[PreparedEvent] = asyncio.Queue(maxsize=queue_size)
+        self.user: UserSnapshot | None = None
+        self.token: str | None = None
+        # Conversations whose events this connection gets
+        self.subscriptions: set[int] = {PUBLIC_CONVERSATION_ID}
+        self.sent = 0
+        self.frames = 0
+        self.dropped = 0
+        self.closed = False
+        self.frame_bucket = TokenBucket(*RATE_LIMITS["frame"])
+        self._writer: asyncio.Task | None = None
+        self._close_task: asyncio.Task | None = None
+        self._held: deque[PreparedEvent] | None = None
+
+    @property
+    def username(self) -> str | None:
+        return self.user.username if self.user else None
+
+    def bind(self, user: UserSnapshot, token: str):
+        self.user = user
+        self.token = token
+
+    def unbind(self):
+        self.user = None
+        self.token = None
+
+    async def receive(self) -> dict:
+        return await self.codec.receive(self.websocket)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, message: dict | PreparedEvent) -> bool:
+        """
+        Enqueue a message. Returns False if the message was not queued.
+        """
+        if self.closed:
+            return False
+
+        if not isinstance(message, PreparedEvent):
+            message = PreparedEvent(message)
+
+        # Held events count against the same limit as the queue
+        held = self._held is not None
+        if held:
+            full = 0 < self.queue.maxsize <= len(self._held)
+        else:
+            full = self.queue.full()
+        if full:
+            if self.policy == POLICY_DISCONNECT:
+                logger.warning(f"Disconnecting slow WebSocket consumer {self.username or 'anonymous'}")
+                self.evict()
+                return False
+
+            if held:
+                self._held.popleft()
+            else:
+                self.queue.get_nowait()
+            self.dropped += 1
+
+        if held:
+            self._held.append(message)
+        else:
+            self.queue.put_nowait(message)
+        return True
+
+    def hold(self):
+        """
+        Keep live events back while missed ones are replayed.
+        """
+        self._held = deque()
+
+    def release(self, first: list[dict], after_seq: int):
+        """
+        Send `first`, then the held events, skipping sequenced events that
+        `first` already covered up to `after_seq`.
+        """
+        held, self._held = self._held or (), None
+        for message in first:
+            self.send(message)
+        for message in held:
+            seq = message.event.get("seq")
+            if seq is None or seq > after_seq:
+                self.send(message)
+
+    def evict(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        if self._writer:
+            self._writer.cancel()
+        # Keep a reference, the loop only holds tasks weakly
+        self._close_task = asyncio.create_task(self._close(1013, "Too slow"))
+
+    async def stop(self):
+        self.closed = True
+        if self._writer:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "username": self.username,
+            "protocol": self.codec.name,
+            "subscriptions": len(self.subscriptions),
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "sent": self.sent,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "closed": self.closed
+        }
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.codec.batching:
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)
+                while len(batch) < WS_BATCH_MAX_SIZE and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+
+            try:
+                await asyncio.wait_for(self.codec.send(self.websocket, batch), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"WebSocket send timed out for {self.username or 'anonymous'}")
+                self.closed = True
+                await self._close(1013, "Too slow")
+                return
+            except Exception:
+                # The reader side notices the disconnect and cleans up
+                self.closed = True
+                return
+            self.sent += len(batch)
+            self.frames += 1
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
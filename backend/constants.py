@@ -5,7 +5,69 @@ DATABASE_URL = "sqlite:///./data/database.db"
 JWT_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 OWNER_USERNAME = "denis0001-dev"
-JWT_SECRET_KEY = os.getenv("JWT_SECRET")
-
-if not JWT_SECRET_KEY:
-    raise ValueError("JWT secret key empty")
\ No newline at end of file
+MESSAGES_PAGE_SIZE = 100
+MESSAGES_PAGE_MAX_SIZE = 500
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX_SIZE = 100
+PUBLIC_CONVERSATION_ID = 1  # The room every user is in, created by the migrations
+CONVERSATION_MAX_MEMBERS = int(os.getenv("CONVERSATION_MAX_MEMBERS", "1000"))
+SUBSCRIPTIONS_MAX = int(os.getenv("SUBSCRIPTIONS_MAX", "200"))
+HOT_HISTORY_SIZE = int(os.getenv("HOT_HISTORY_SIZE", "500"))
+MESSAGE_PAYLOAD_CACHE_SIZE = int(os.getenv("MESSAGE_PAYLOAD_CACHE_SIZE", "2000"))
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")  # drop_oldest | disconnect
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))
+WS_BATCH_MAX_SIZE = int(os.getenv("WS_BATCH_MAX_SIZE", "64"))
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "15"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+# action -> (tokens per second, burst)
+RATE_LIMITS = {
+    "send": (float(os.getenv("RATE_LIMIT_SEND_RATE", "5")), float(os.getenv("RATE_LIMIT_SEND_BURST", "10"))),
+    "edit": (2.0, 5.0),
+    "delete": (2.0, 5.0),
+    "search": (2.0, 5.0),
+    "conversation": (1.0, 5.0),
+    "frame": (float(os.getenv("RATE_LIMIT_FRAME_RATE", "20")), float(os.getenv("RATE_LIMIT_FRAME_BURST", "40"))),
+}
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+WRITE_BACKLOG_LIMIT = int(os.getenv("WRITE_BACKLOG_LIMIT", "2000"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "wal")  # default | wal
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "2"))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", "256"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PROFILE_PICTURE_MAX_BYTES = 5 * 1024 * 1024
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", "8"))
+AVATAR_CACHE_BYTES = int(os.getenv("AVATAR_CACHE_BYTES", str(32 * 1024 * 1024)))
+AVATAR_GC_INTERVAL = float(os.getenv("AVATAR_GC_INTERVAL", "3600"))
+AVATAR_GC_GRACE = float(os.getenv("AVATAR_GC_GRACE", "3600"))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+PRESENCE_QUERY_MAX_SIZE = 500
+EVENT_LOG_SIZE = int(os.getenv("EVENT_LOG_SIZE", "10000"))
+EVENT_LOG_COMPACT_INTERVAL = float(os.getenv("EVENT_LOG_COMPACT_INTERVAL", "60"))
+EVENT_REPLAY_MAX = int(os.getenv("EVENT_REPLAY_MAX", "1000"))
+DELETION_CHUNK_SIZE = int(os.getenv("DELETION_CHUNK_SIZE", "500"))
+DELETION_CHUNK_PAUSE_MS = float(os.getenv("DELETION_CHUNK_PAUSE_MS", "50"))
+DELETION_JOB_STALE_AFTER = float(os.getenv("DELETION_JOB_STALE_AFTER", "60"))
+BULK_DELETE_MAX_SIZE = 10000
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "0"))  # 0 keeps every message in the table
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "1000"))
+RETENTION_VACUUM = os.getenv("RETENTION_VACUUM", "incremental")  # incremental | full | off
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ARCHIVE_CACHE_SEGMENTS = int(os.getenv("ARCHIVE_CACHE_SEGMENTS", "4"))
+READ_RECEIPT_DELAY = float(os.getenv("READ_RECEIPT_DELAY", "1"))
+TYPING_THROTTLE = float(os.getenv("TYPING_THROTTLE", "2"))
+TYPING_COALESCE_WINDOW = float(os.getenv("TYPING_COALESCE_WINDOW", "0.5"))
+TYPING_TIMEOUT = float(os.getenv("TYPING_TIMEOUT", "6"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+BACKPLANE = os.getenv("BACKPLANE", "local")  # local | unix
+BACKPLANE_SOCKET_PATH = os.getenv("BACKPLANE_SOCKET_PATH", "data/backplane.sock")
+BACKPLANE_PEER_BUFFER_BYTES = int(os.getenv("BACKPLANE_PEER_BUFFER_BYTES", str(8 * 1024 * 1024)))  # a worker further behind is dropped
+JWT_SECRET_KEY = os.getenv("JWT_SECRET")  # required, checked on startup
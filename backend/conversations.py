@@ -0,0 +1,198 @@
+"""
+Conversations: the public room, private rooms and direct conversations.
+
+Every message belongs to one conversation. The public room has no member
+rows, every user can read and post there, anonymous clients can read it.
+Rooms and direct conversations are for their members only.
+
+Membership changes are published on MEMBERSHIP_CHANNEL, so every worker
+tells the user's connections, unsubscribes removed members and tells the
+other members.
+"""
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from constants import CONVERSATION_MAX_MEMBERS, PUBLIC_CONVERSATION_ID
+from models import Conversation, ConversationMember, User
+
+
+def convert_conversation(conversation: Conversation, members: list[str] | None = None) -> dict:
+    return {
+        "id": conversation.id,
+        "kind": conversation.kind,
+        "title": conversation.title,
+        "members": members,
+        "created_at": conversation.created_at.isoformat()
+    }
+
+
+def load_member_names(db: Session, conversation_id: int) -> list[str]:
+    rows = db.query(User.username).join(ConversationMember, ConversationMember.user_id == User.id).filter(
+        ConversationMember.conversation_id == conversation_id
+    ).order_by(User.username)
+    return [username for username, in rows]
+
+
+def is_member(db: Session, conversation_id: int, user_id: int) -> bool:
+    return db.query(ConversationMember.user_id).filter(
+        ConversationMember.conversation_id == conversation_id,
+        ConversationMember.user_id == user_id
+    ).first() is not None
+
+
+def require_access(db: Session, conversation_id: int, user_id: int | None):
+    """
+    404 for conversations that don't exist, 401/403 for users who can't read them.
+    The public room is checked without touching the database.
+    """
+    if conversation_id == PUBLIC_CONVERSATION_ID:
+        return
+
+    if not db.get(Conversation, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not is_member(db, conversation_id, user_id):
+        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
+
+def accessible_conversations(db: Session, conversation_ids: list[int], user_id: int) -> set[int]:
+    ids = set(conversation_ids)
+    rows = db.query(ConversationMember.conversation_id).filter(
+        ConversationMember.user_id == user_id,
+        ConversationMember.conversation_id.in_(ids - {PUBLIC_CONVERSATION_ID})
+    )
+    return {conversation_id for conversation_id, in rows} | (ids & {PUBLIC_CONVERSATION_ID})
+
+
+def load_conversations(db: Session, user_id: int) -> list[dict]:
+    """
+    The public room and every conversation the user is a member of.
+    """
+    conversations = db.query(Conversation).outerjoin(
+        ConversationMember,
+        (ConversationMember.conversation_id == Conversation.id) & (ConversationMember.user_id == user_id)
+    ).filter(
+        (Conversation.id == PUBLIC_CONVERSATION_ID) | (ConversationMember.user_id == user_id)
+    ).order_by(Conversation.id).all()
+
+    return [
+        convert_conversation(conversation, None if conversation.kind == "public" else load_member_names(db, conversation.id))
+        for conversation in conversations
+    ]
+
+
+def load_conversation(db: Session, conversation_id: int, user_id: int) -> dict:
+    require_access(db, conversation_id, user_id)
+    conversation = db.get(Conversation, conversation_id)
+    return convert_conversation(conversation, None if conversation.kind == "public" else load_member_names(db, conversation_id))
+
+
+def find_users(db: Session, usernames: list[str]) -> list[User]:
+    users = db.query(User).filter(User.username.in_(set(usernames))).all()
+    missing = set(usernames) - {user.username for user in users}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"User not found: {sorted(missing)[0]}")
+    return users
+
+
+# Write helpers, run inside GroupCommitWriter. They return the conversation
+# and the membership changes to publish.
+
+def create_room(db: Session, user_id: int, title: str, usernames: list[str]) -> tuple[dict, list[dict]]:
+    title = title.strip()
+    if not title or len(title) > 100:
+        raise HTTPException(status_code=400, detail="Title must be 1-100 characters")
+
+    user_ids = {user.id: user.username for user in find_users(db, usernames)}
+    user_ids[user_id] = db.get(User, user_id).username
+    if len(user_ids) > CONVERSATION_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"At most {CONVERSATION_MAX_MEMBERS} members")
+
+    conversation = Conversation(kind="room", title=title, created_by=user_id)
+    db.add(conversation)
+    db.flush()
+    db.add_all(ConversationMember(conversation_id=conversation.id, user_id=id) for id in user_ids)
+    db.flush()
+
+    result = convert_conversation(conversation, sorted(user_ids.values()))
+    return result, [membership_change(result, id, username, True) for id, username in user_ids.items()]
+
+
+def open_direct_conversation(db: Session, user_id: int, username: str) -> tuple[dict, list[dict]]:
+    """
+    The direct conversation with `username`, created on first use.
+    """
+    other, = find_users(db, [username])
+    if other.id == user_id:
+        raise HTTPException(status_code=400, detail="Cannot start a conversation with yourself")
+
+    key = f"{min(user_id, other.id)}:{max(user_id, other.id)}"
+    conversation = db.query(Conversation).filter(Conversation.direct_key == key).first()
+    if conversation:
+        return load_conversation(db, conversation.id, user_id), []
+
+    conversation = Conversation(kind="direct", direct_key=key, created_by=user_id)
+    db.add(conversation)
+    db.flush()
+    db.add_all([
+        ConversationMember(conversation_id=conversation.id, user_id=user_id),
+        ConversationMember(conversation_id=conversation.id, user_id=other.id)
+    ])
+    db.flush()
+
+    members = {user_id: db.get(User, user_id).username, other.id: other.username}
+    result = convert_conversation(conversation, sorted(members.values()))
+    return result, [membership_change(result, id, username, True) for id, username in members.items()]
+
+
+def add_member(db: Session, conversation_id: int, user_id: int, username: str) -> tuple[dict, list[dict]]:
+    conversation = _load_room(db, conversation_id, user_id)
+    user, = find_users(db, [username])
+    if is_member(db, conversation_id, user.id):
+        return load_conversation(db, conversation_id, user_id), []
+
+    count = db.query(ConversationMember).filter(ConversationMember.conversation_id == conversation_id).count()
+    if count >= CONVERSATION_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"At most {CONVERSATION_MAX_MEMBERS} members")
+
+    db.add(ConversationMember(conversation_id=conversation_id, user_id=user.id))
+    db.flush()
+
+    result = convert_conversation(conversation, load_member_names(db, conversation_id))
+    return result, [membership_change(result, user.id, user.username, True)]
+
+
+def remove_member(db: Session, conversation_id: int, user_id: int, username: str, is_owner: bool = False) -> tuple[dict, list[dict]]:
+    """
+    Members can leave, only the room's creator (or the owner) removes others.
+    """
+    conversation = _load_room(db, conversation_id, user_id, is_owner)
+    user, = find_users(db, [username])
+    if user.id != user_id and conversation.created_by != user_id and not is_owner:
+        raise HTTPException(status_code=403, detail="Only the room's creator can remove members")
+
+    removed = db.query(ConversationMember).filter(
+        ConversationMember.conversation_id == conversation_id,
+        ConversationMember.user_id == user.id
+    ).delete()
+    if not removed:
+        raise HTTPException(status_code=404, detail="User is not a member of this conversation")
+
+    result = convert_conversation(conversation, load_member_names(db, conversation_id))
+    return result, [membership_change(result, user.id, user.username, False)]
+
+
+def membership_change(conversation: dict, user_id: int, username: str, member: bool) -> dict:
+    return {"conversation": conversation, "user_id": user_id, "username": username, "member": member}
+
+
+def _load_room(db: Session, conversation_id: int, user_id: int, is_owner: bool = False) -> Conversation:
+    conversation = db.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.kind != "room":
+        raise HTTPException(status_code=400, detail="Only rooms have members to change")
+    if not is_owner and not is_member(db, conversation_id, user_id):
+        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+    return conversation
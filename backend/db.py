@@ -1,10 +1,94 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from constants import DATABASE_URL
+from sqlalchemy import create_engine, event
+from constants import DATABASE_URL, DB_POOL_SIZE, STORAGE_PROFILE
+from metrics import sql_errors, sql_statement_seconds, sql_statements, statement_verb
 
 # Ensure data directory exists
 os.makedirs("data", exist_ok=True)
 
+STORAGE_PROFILES = {
+    # SQLite defaults: rollback journal, fsync on every commit
+    "default": {},
+    # Readers don't block the writer, and commits only fsync at checkpoints
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000
+    }
+}
+
+if STORAGE_PROFILE not in STORAGE_PROFILES:
+    raise ValueError(f"Unknown storage profile: {STORAGE_PROFILE}")
+
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+
+
+@event.listens_for(engine, "connect")
+def on_connect(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself, otherwise pysqlite breaks SAVEPOINT
+    dbapi_connection.isolation_level = None
+
+    cursor = dbapi_connection.cursor()
+    for pragma, value in STORAGE_PROFILES[STORAGE_PROFILE].items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+@event.listens_for(engine, "begin")
+def on_begin(connection):
+    # A deferred transaction that reads before it writes can't wait for the
+    # write lock held by another process, it fails with "database is locked"
+    # right away. Writers take the lock up front so busy_timeout applies.
+    if connection.get_execution_options().get("immediate"):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        connection.exec_driver_sql("BEGIN")
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info["statement_started"].pop()
+    verb = statement_verb(statement)
+    sql_statements.inc(verb)
+    sql_statement_seconds.observe(elapsed, verb)
+
+
+@event.listens_for(engine, "handle_error")
+def handle_error(context):
+    started = context.connection.info.get("statement_started") if context.connection is not None else None
+    if started:
+        started.pop()
+    sql_errors.inc(statement_verb(context.statement or ""))
+
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine.execution_options(immediate=True))
+
+T = TypeVar("T")
+
+# SQLite calls block, so async code runs them here instead of on the event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_in_db(fn: Callable[..., T], *args) -> T:
+    """
+    Run `fn(db, *args)` on the DB thread pool with its own short-lived session.
+    """
+    def call() -> T:
+        with SessionLocal() as db:
+            return fn(db, *args)
+
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
@@ -0,0 +1,250 @@
+"""
+Bulk deletions as background jobs.
+
+Purging a user or a pile of messages in one statement holds the write lock
+long enough to stall every sender. A job instead deletes DELETION_CHUNK_SIZE
+messages per writer transaction and pauses in between, so regular writes
+get through. Each chunk:
+
+- clears `reply_to_id` on replies to the deleted messages
+- logs a messageDeleted per message and broadcasts them as one
+  `messagesDeleted {message_ids}` event per conversation
+- records its progress and a heartbeat on the job row
+
+A user purge deletes the user, with their read cursors and memberships,
+in the transaction that finds no messages left. Jobs whose worker stops
+heartbeating are taken over by another one.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from backplane import BROADCAST_CHANNEL, USER_DELETED_CHANNEL, backplane
+from constants import DELETION_CHUNK_PAUSE_MS, DELETION_CHUNK_SIZE, DELETION_JOB_STALE_AFTER, OWNER_USERNAME
+from event_log import record_deletions
+from models import ConversationMember, DeletionJob, Message, ReadCursor, User
+from writer import db_writer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def convert_job(job: DeletionJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "user_id": job.user_id,
+        "status": job.status,
+        "total": job.total,
+        "deleted": job.deleted,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def load_job(db: Session, job_id: int) -> dict | None:
+    job = db.get(DeletionJob, job_id)
+    return convert_job(job) if job else None
+
+
+# Write helpers, run inside GroupCommitWriter
+
+def create_user_purge(db: Session, user_id: int, requested_by: int, worker: str) -> dict:
+    user = db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Prevent deleting the owner account via API
+    if user.username == OWNER_USERNAME:
+        raise HTTPException(status_code=400, detail="Cannot delete owner account")
+
+    running = db.query(DeletionJob).filter(
+        DeletionJob.kind == "user",
+        DeletionJob.user_id == user_id,
+        DeletionJob.status == "running"
+    ).first()
+    if running:
+        return convert_job(running)
+
+    job = DeletionJob(
+        kind="user",
+        user_id=user_id,
+        requested_by=requested_by,
+        total=db.query(Message).filter(Message.user_id == user_id).count(),
+        worker=worker
+    )
+    db.add(job)
+    db.flush()
+
+    return convert_job(job)
+
+
+def create_message_deletion(db: Session, message_ids: list[int], requested_by: int, worker: str) -> dict:
+    message_ids = sorted(set(message_ids))
+    job = DeletionJob(
+        kind="messages",
+        message_ids=json.dumps(message_ids),
+        requested_by=requested_by,
+        total=len(message_ids),
+        worker=worker
+    )
+    db.add(job)
+    db.flush()
+
+    return convert_job(job)
+
+
+def delete_messages(db: Session, messages: list[tuple[int, int]]) -> list[dict]:
+    """
+    Deletes (message id, conversation id) pairs, returns an event per conversation.
+    """
+    if not messages:
+        return []
+
+    message_ids = [message_id for message_id, _ in messages]
+    db.query(Message).filter(Message.reply_to_id.in_(message_ids)).update(
+        {Message.reply_to_id: None}, synchronize_session=False
+    )
+    db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+
+    by_conversation: dict[int, list[int]] = {}
+    for message_id, conversation_id in messages:
+        by_conversation.setdefault(conversation_id, []).append(message_id)
+    return [record_deletions(db, ids, conversation_id) for conversation_id, ids in by_conversation.items()]
+
+
+def delete_chunk(db: Session, job_id: int, worker: str, size: int) -> tuple[list[dict], dict | None, bool]:
+    """
+    Deletes the job's next chunk. Returns the events to broadcast, the
+    deleted user once a purge finished, and whether there is more to do.
+    """
+    job = db.get(DeletionJob, job_id)
+    if job.status != "running" or job.worker != worker:
+        # Finished, or another worker took it over
+        return [], None, False
+
+    deleted_user = None
+    if job.kind == "user":
+        messages = db.query(Message.id, Message.conversation_id).filter(Message.user_id == job.user_id).order_by(Message.id).limit(size).all()
+        finished = len(messages) < size
+    else:
+        chunk = json.loads(job.message_ids)[job.position:job.position + size]
+        messages = db.query(Message.id, Message.conversation_id).filter(Message.id.in_(chunk)).order_by(Message.id).all()
+        job.position += len(chunk)
+        finished = job.position >= job.total
+
+    events = delete_messages(db, messages)
+    job.deleted += len(messages)
+    job.heartbeat_at = datetime.now()
+
+    if finished and job.kind == "user":
+        user = db.get(User, job.user_id)
+        if user:
+            db.query(ReadCursor).filter(ReadCursor.user_id == user.id).delete()
+            db.query(ConversationMember).filter(ConversationMember.user_id == user.id).delete()
+            deleted_user = {"id": user.id, "username": user.username}
+            db.delete(user)
+
+    if finished:
+        job.status = "done"
+        job.finished_at = datetime.now()
+
+    db.flush()
+
+    return events, deleted_user, not finished
+
+
+def fail_job(db: Session, job_id: int, error: str):
+    db.query(DeletionJob).filter(DeletionJob.id == job_id).update({
+        DeletionJob.status: "failed",
+        DeletionJob.error: error,
+        DeletionJob.finished_at: datetime.now()
+    })
+
+
+def claim_stale_jobs(db: Session, worker: str, stale_before: datetime) -> list[int]:
+    stale = DeletionJob.status == "running", DeletionJob.heartbeat_at < stale_before
+    job_ids = [id for id, in db.query(DeletionJob.id).filter(*stale)]
+    if job_ids:
+        db.query(DeletionJob).filter(DeletionJob.id.in_(job_ids), *stale).update(
+            {DeletionJob.worker: worker, DeletionJob.heartbeat_at: datetime.now()},
+            synchronize_session=False
+        )
+    return job_ids
+
+
+class DeletionRunner:
+    """
+    Runs this worker's deletion jobs, one task per job.
+    """
+
+    def __init__(self, chunk_size: int = DELETION_CHUNK_SIZE, pause: float = DELETION_CHUNK_PAUSE_MS / 1000) -> None:
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.worker_id = uuid.uuid4().hex
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    async def purge_user(self, user_id: int, requested_by: int) -> dict:
+        job = await db_writer.submit(create_user_purge, user_id, requested_by, self.worker_id)
+        self.start(job["id"])
+        return job
+
+    async def delete_messages(self, message_ids: list[int], requested_by: int) -> dict:
+        job = await db_writer.submit(create_message_deletion, message_ids, requested_by, self.worker_id)
+        self.start(job["id"])
+        return job
+
+    def start(self, job_id: int):
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def stop(self):
+        # Unfinished jobs go stale and are resumed on the next start
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def resume_stale(self):
+        stale_before = datetime.now() - timedelta(seconds=DELETION_JOB_STALE_AFTER)
+        for job_id in await db_writer.submit(claim_stale_jobs, self.worker_id, stale_before):
+            logger.info(f"Resuming deletion job {job_id}")
+            self.start(job_id)
+
+    async def _run(self, job_id: int):
+        try:
+            while True:
+                events, deleted_user, more = await db_writer.submit(delete_chunk, job_id, self.worker_id, self.chunk_size)
+                for event in events:
+                    await backplane.publish(BROADCAST_CHANNEL, event)
+                if deleted_user:
+                    # Drop cached tokens, WebSocket bindings and cached messages of the deleted user on every worker
+                    await backplane.publish(USER_DELETED_CHANNEL, deleted_user)
+                if not more:
+                    break
+                await asyncio.sleep(self.pause)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Deletion job {job_id} failed")
+            await db_writer.submit(fail_job, job_id, str(e))
+        finally:
+            self._tasks.pop(job_id, None)
+
+
+deletion_runner = DeletionRunner()
+
+
+async def deletion_job_loop(interval: float = DELETION_JOB_STALE_AFTER / 2):
+    while True:
+        try:
+            await deletion_runner.resume_stale()
+        except Exception:
+            logger.exception("Resuming deletion jobs failed")
+        await asyncio.sleep(interval)
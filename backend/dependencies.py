@@ -1,11 +1,65 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 from utils import *
 from models import *
-from db import SessionLocal
+from backplane import USER_DELETED_CHANNEL, backplane
+from constants import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+from db import SessionLocal, run_in_db
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Identity of an authenticated user, safe to share between requests."""
+    id: int
+    username: str
+    token_expires_at: float
+
+
+class TokenCache:
+    """
+    Verified tokens -> user snapshots, so hot paths skip the JWT decode and
+    the user SELECT. Entries live for at most `ttl` seconds and never past
+    the token's own expiry.
+    """
+
+    def __init__(self, ttl: float = TOKEN_CACHE_TTL, max_size: int = TOKEN_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[UserSnapshot, float]] = OrderedDict()
+
+    def get(self, token: str) -> UserSnapshot | None:
+        entry = self._entries.get(token)
+        if not entry:
+            return None
+
+        user, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[token]
+            return None
+
+        self._entries.move_to_end(token)
+        return user
+
+    def put(self, token: str, user: UserSnapshot):
+        self._entries[token] = (user, min(time.time() + self.ttl, user.token_expires_at))
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        for token in [token for token, (user, _) in self._entries.items() if user.id == user_id]:
+            del self._entries[token]
+
+
+token_cache = TokenCache()
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: token_cache.invalidate_user(user["id"]))
 
 # Зависимость для получения сессии БД
 def get_db():
@@ -15,12 +69,7 @@ def get_db():
     finally:
         db.close()
 
-# Зависимость для получения текущего пользователя
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    token = credentials.credentials
+def authenticate(db: Session, token: str) -> UserSnapshot:
     payload = verify_token(token)
     if not payload:
         raise HTTPException(
@@ -35,4 +84,27 @@ def get_current_user(
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
\ No newline at end of file
+    return UserSnapshot(id=user.id, username=user.username, token_expires_at=payload["exp"])
+
+
+async def authenticate_cached(token: str) -> UserSnapshot:
+    user = token_cache.get(token)
+    if not user:
+        user = await run_in_db(authenticate, token)
+        token_cache.put(token, user)
+    return user
+
+# Зависимость для получения текущего пользователя
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> UserSnapshot:
+    return await authenticate_cached(credentials.credentials)
+
+
+# Для эндпоинтов, которые открыты и без входа
+async def get_optional_user(
+    credentials: HTTPAuthorizationCredentials | None = Depends(optional_security)
+) -> UserSnapshot | None:
+    if not credentials:
+        return None
+    return await authenticate_cached(credentials.credentials)
@@ -0,0 +1,164 @@
+"""
+Sequenced log of message events for resumable WebSocket sessions.
+
+Every newMessage, messageEdited and messageDeleted gets its `seq` from the
+`event_log` row written in the same transaction as the change itself. A
+client that reconnects with `resume_from=<seq>` is sent the logged events
+after that seq, or a snapshot of the newest page when the log no longer
+reaches back that far.
+
+The log is compacted like a keyed log: only the newest event of each
+message is kept. When that is an edit of a message whose newMessage was
+compacted away, it is logged as a newMessage carrying the edited message,
+so a client that missed the creation still gets the message. Replayed
+events are upserts: a newMessage for a message the client already shows
+replaces it. The oldest events beyond EVENT_LOG_SIZE are then trimmed.
+
+Events carry their `conversation_id`, which routes them to the connections
+subscribed to that conversation; replays only include the conversations
+the client is subscribed to.
+"""
+import asyncio
+import json
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from backplane import BROADCAST_CHANNEL, backplane
+from constants import EVENT_LOG_COMPACT_INTERVAL, EVENT_LOG_SIZE, PUBLIC_CONVERSATION_ID
+from db import run_in_db
+from models import EventLog, EventLogState
+from writer import db_writer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def record_event(db: Session, type: str, message_id: int, data: dict, conversation_id: int = PUBLIC_CONVERSATION_ID) -> dict:
+    entry = EventLog(type=type, message_id=message_id, conversation_id=conversation_id, payload=json.dumps(data))
+    db.add(entry)
+    db.flush()
+
+    return {"type": type, "seq": entry.seq, "conversation_id": conversation_id, "data": data}
+
+
+def record_deletions(db: Session, message_ids: list[int], conversation_id: int = PUBLIC_CONVERSATION_ID) -> dict:
+    """
+    Logs a messageDeleted per message, so replay and compaction stay per
+    message, and returns them as one messagesDeleted event to broadcast.
+    """
+    db.execute(insert(EventLog), [
+        {
+            "type": "messageDeleted",
+            "message_id": message_id,
+            "conversation_id": conversation_id,
+            "payload": json.dumps({"message_id": message_id})
+        }
+        for message_id in message_ids
+    ])
+    # The writer holds the write lock, nothing else was logged in between
+    seq = db.query(func.max(EventLog.seq)).scalar()
+
+    return {"type": "messagesDeleted", "seq": seq, "conversation_id": conversation_id, "data": {"message_ids": message_ids}}
+
+
+def trimmed_through(db: Session) -> int:
+    return db.query(EventLogState.trimmed_through).filter(EventLogState.id == 1).scalar() or 0
+
+
+def set_trimmed_through(db: Session, seq: int):
+    statement = insert(EventLogState).values(id=1, trimmed_through=seq)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[EventLogState.id],
+        set_={"trimmed_through": func.max(EventLogState.trimmed_through, statement.excluded.trimmed_through)}
+    ))
+
+
+def latest_seq(db: Session) -> int:
+    return max(db.query(func.max(EventLog.seq)).scalar() or 0, trimmed_through(db))
+
+
+def load_events_since(
+    db: Session,
+    seq: int,
+    limit: int,
+    conversation_ids: set[int] = frozenset({PUBLIC_CONVERSATION_ID})
+) -> tuple[list[dict] | None, int]:
+    """
+    Events of `conversation_ids` after `seq`, oldest first, and the newest
+    seq. The events are None when the gap was trimmed away or holds more
+    than `limit` events.
+    """
+    latest = latest_seq(db)
+    if seq < trimmed_through(db) or seq > latest:
+        return None, latest
+
+    rows = db.query(EventLog).filter(
+        EventLog.seq > seq,
+        EventLog.conversation_id.in_(conversation_ids)
+    ).order_by(EventLog.seq).limit(limit + 1).all()
+    if len(rows) > limit:
+        return None, latest
+
+    events = [
+        {"type": row.type, "seq": row.seq, "conversation_id": row.conversation_id, "data": json.loads(row.payload)}
+        for row in rows
+    ]
+    return events, max(latest, rows[-1].seq if rows else 0)
+
+
+def compact_event_log(db: Session, size: int = EVENT_LOG_SIZE) -> int:
+    # Older events of a message are superseded by its newest one
+    newest = db.query(func.max(EventLog.seq)).group_by(EventLog.message_id)
+    # An edit that outlives the newMessage takes its place, edits carry the
+    # whole message
+    created = db.query(EventLog.message_id).filter(EventLog.type == "newMessage", EventLog.seq.notin_(newest))
+    db.query(EventLog).filter(
+        EventLog.seq.in_(newest),
+        EventLog.type == "messageEdited",
+        EventLog.message_id.in_(created)
+    ).update({EventLog.type: "newMessage"}, synchronize_session=False)
+
+    removed = db.query(EventLog).filter(EventLog.seq.notin_(newest)).delete(synchronize_session=False)
+
+    cutoff = db.query(EventLog.seq).order_by(EventLog.seq.desc()).offset(size).limit(1).scalar()
+    if cutoff:
+        removed += db.query(EventLog).filter(EventLog.seq <= cutoff).delete(synchronize_session=False)
+        set_trimmed_through(db, cutoff)
+
+    return removed
+
+
+class EventSequence:
+    """
+    Newest seq this worker has broadcast, handed out with history pages so
+    clients know where to resume from.
+    """
+
+    def __init__(self) -> None:
+        self.latest = 0
+
+    def observe(self, event: dict):
+        seq = event.get("seq")
+        if seq and seq > self.latest:
+            self.latest = seq
+
+
+event_sequence = EventSequence()
+backplane.subscribe(BROADCAST_CHANNEL, event_sequence.observe)
+
+
+async def warm_event_sequence():
+    event_sequence.latest = max(event_sequence.latest, await run_in_db(latest_seq))
+
+
+async def event_log_compaction_loop(interval: float = EVENT_LOG_COMPACT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await db_writer.submit(compact_event_log)
+            if removed:
+                logger.info(f"Compacted {removed} events from the event log")
+        except Exception:
+            logger.exception("Event log compaction failed")
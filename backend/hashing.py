@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS
+from pools import BoundedPool
+from utils import get_password_hash, verify_password
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated pool (bcrypt releases the GIL), so a login
+    storm can't starve the event loop. When too many hashes are already waiting
+    it answers 503 right away instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING) -> None:
+        self.pool = BoundedPool(
+            lambda: ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt"),
+            max_pending
+        )
+
+    async def hash(self, password: str) -> str:
+        return await self.pool.run(get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self.pool.run(verify_password, password, hashed_password)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,167 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from constants import HOT_HISTORY_SIZE, PUBLIC_CONVERSATION_ID
+
+Key = tuple[datetime, int]
+
+
+def message_key(message: dict) -> Key:
+    return datetime.fromisoformat(message["timestamp"]), message["id"]
+
+
+class HotHistory:
+    """
+    Ring buffer of the newest serialized messages of the public room,
+    oldest first.
+
+    It always holds every message newer than its oldest entry, so any page
+    that ends inside that window can be answered without SQLite. `complete`
+    means the buffer holds the whole table. Until it has been warmed the
+    cache answers nothing and ignores updates.
+    """
+
+    def __init__(self, size: int = HOT_HISTORY_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.complete = False
+        self.warm = False
+        self._keys: list[Key] = []
+        self._messages: dict[int, dict] = {}
+        self._pending: list[dict] | None = None
+
+    def begin_warm_up(self):
+        # Events arriving while the snapshot loads are replayed on top of it
+        self._pending = []
+
+    def load(self, messages: list[dict], complete: bool):
+        self._keys = [message_key(message) for message in messages]
+        self._messages = {message["id"]: message for message in messages}
+        self.complete = complete
+        self.warm = True
+
+        pending, self._pending = self._pending or [], None
+        for event in pending:
+            self.apply_event(event)
+
+    def apply_event(self, event: dict):
+        # Only the public room is cached
+        if event.get("conversation_id", PUBLIC_CONVERSATION_ID) != PUBLIC_CONVERSATION_ID:
+            return
+        if self._pending is not None:
+            self._pending.append(event)
+            return
+        if not self.warm:
+            return
+
+        type = event["type"]
+        if type == "newMessage":
+            self.add(event["data"])
+        elif type == "messageEdited":
+            self.edit(event["data"])
+        elif type == "messageDeleted":
+            self.remove(event["data"]["message_id"])
+        elif type == "messagesDeleted":
+            self.remove_many(event["data"]["message_ids"])
+
+    def add(self, message: dict):
+        if message["id"] in self._messages:
+            return
+
+        key = message_key(message)
+        if self._keys and not self.complete and key < self._keys[0]:
+            return  # Older than the window, SQLite has it
+
+        insort(self._keys, key)
+        self._messages[message["id"]] = message
+        while len(self._keys) > self.size:
+            _, oldest_id = self._keys.pop(0)
+            del self._messages[oldest_id]
+            self.complete = False
+
+    def edit(self, message: dict):
+        if message["id"] in self._messages:
+            self._messages[message["id"]] = message
+
+        preview = {**message, "reply_to": None}
+        self._patch_replies(lambda reply: reply["id"] == message["id"], preview)
+
+    def remove(self, message_id: int):
+        message = self._messages.pop(message_id, None)
+        if message:
+            self._keys.remove(message_key(message))
+        self._patch_replies(lambda reply: reply["id"] == message_id, None)
+
+    def remove_many(self, message_ids: list[int]):
+        removed = set(message_ids)
+        popped = [self._messages.pop(message_id, None) for message_id in removed]
+        if any(popped):
+            self._keys = [key for key in self._keys if key[1] not in removed]
+        self._patch_replies(lambda reply: reply["id"] in removed, None)
+
+    def remove_user(self, username: str):
+        for message in [message for message in self._messages.values() if message["username"] == username]:
+            self.remove(message["id"])
+        self._patch_replies(lambda reply: reply["username"] == username, None)
+
+    def update_user(self, username: str, profile_picture: str | None):
+        for message_id, message in self._messages.items():
+            reply = message.get("reply_to")
+            if message["username"] == username:
+                message = {**message, "profile_picture": profile_picture}
+            if reply and reply["username"] == username:
+                message = {**message, "reply_to": {**reply, "profile_picture": profile_picture}}
+            self._messages[message_id] = message
+
+    def page(self, before: Key | None, after: Key | None, limit: int) -> tuple[list[dict], bool] | None:
+        """
+        Returns (messages, has_more) like the SQL pagination, or None when the
+        page reaches outside the window.
+        """
+        result = self._page(before, after, limit)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._keys),
+            "capacity": self.size,
+            "complete": self.complete,
+            "warm": self.warm,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _page(self, before: Key | None, after: Key | None, limit: int) -> tuple[list[dict], bool] | None:
+        if not self.warm:
+            return None
+
+        if after:
+            if not self.complete and (not self._keys or after < self._keys[0]):
+                return None
+            start = bisect_right(self._keys, after)
+            keys = self._keys[start:start + limit + 1]
+            return self._resolve(keys[:limit]), len(keys) > limit
+
+        end = bisect_left(self._keys, before) if before else len(self._keys)
+        # Without the whole table we can only tell has_more if there's a spare message
+        if end <= limit and not self.complete:
+            return None
+        keys = self._keys[max(0, end - limit):end]
+        return self._resolve(keys), end > limit
+
+    def _resolve(self, keys: list[Key]) -> list[dict]:
+        return [self._messages[message_id] for _, message_id in keys]
+
+    def _patch_replies(self, matches, preview: dict | None):
+        for message_id, message in self._messages.items():
+            reply = message.get("reply_to")
+            if reply and matches(reply):
+                self._messages[message_id] = {**message, "reply_to": preview}
+
+
+hot_history = HotHistory()
@@ -0,0 +1,103 @@
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, UploadFile
+
+from constants import IMAGE_MAX_PENDING, IMAGE_WORKERS, PROFILE_PICTURE_MAX_BYTES
+from pools import BoundedPool
+
+# Sizes clients actually render: message list, profile dialog, profile page
+PROFILE_PICTURE_SIZES = (48, 96, 200)
+PROFILE_PICTURE_DEFAULT_SIZE = 200
+
+# extension -> (Pillow format, encoder options, media type)
+PROFILE_PICTURE_FORMATS = {
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}, "image/jpeg"),
+    "webp": ("WEBP", {"quality": 80, "method": 4}, "image/webp")
+}
+PROFILE_PICTURE_DEFAULT_FORMAT = "jpg"
+
+
+def rendition_filename(filename: str, size: int, format: str) -> str:
+    """
+    `<name>.jpg` is the 200 px JPEG (the URL stored on the user), every other
+    rendition lives next to it as `<name>_<size>.<format>`.
+    """
+    if size == PROFILE_PICTURE_DEFAULT_SIZE and format == PROFILE_PICTURE_DEFAULT_FORMAT:
+        return filename
+    return f"{filename.rsplit('.', 1)[0]}_{size}.{format}"
+
+
+def avatar_filename(data: bytes) -> str:
+    # Named after the upload's content, so a URL always serves the same bytes
+    return f"{hashlib.sha256(data).hexdigest()[:32]}.jpg"
+
+
+def render_profile_picture(data: bytes, directory: str) -> str:
+    """
+    Decode the upload once and write every size/format rendition.
+    Returns the default rendition's filename. Runs in a worker process.
+    """
+    filename = avatar_filename(data)
+    renditions = [
+        os.path.join(directory, rendition_filename(filename, size, format))
+        for size in PROFILE_PICTURE_SIZES
+        for format in PROFILE_PICTURE_FORMATS
+    ]
+    if all(os.path.exists(path) for path in renditions):
+        # Same picture uploaded before, refresh the files so the collector keeps them
+        for path in renditions:
+            os.utime(path)
+        return filename
+
+    # Only image workers need Pillow, the server never loads it
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    largest = max(PROFILE_PICTURE_SIZES)
+
+    # JPEGs can be decoded directly at a fraction of their size
+    image.draft("RGB", (largest, largest))
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # reducing_gap shrinks huge images with cheap box reduction before LANCZOS
+    image.thumbnail((largest, largest), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    # Each size is scaled down from the previous one, not from the original
+    for size in sorted(PROFILE_PICTURE_SIZES, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for extension, (format, options, _) in PROFILE_PICTURE_FORMATS.items():
+            path = os.path.join(directory, rendition_filename(filename, size, extension))
+            # Written under a temporary name so readers never see a partial file
+            image.save(f"{path}.tmp", format, **options)
+            os.replace(f"{path}.tmp", path)
+
+    return filename
+
+
+async def read_upload(upload: UploadFile, limit: int = PROFILE_PICTURE_MAX_BYTES, chunk_size: int = 64 * 1024) -> bytes:
+    """
+    Read an upload in chunks, stopping as soon as it goes over `limit`
+    instead of trusting the size the client declared.
+    """
+    chunks = []
+    total = 0
+    while chunk := await upload.read(chunk_size):
+        total += len(chunk)
+        if total > limit:
+            raise HTTPException(status_code=400, detail="File size must be less than 5MB")
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+# spawn: forking a process that runs an event loop and thread pools isn't safe
+image_pool = BoundedPool(
+    lambda: ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")),
+    IMAGE_MAX_PENDING
+)
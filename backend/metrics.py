@@ -0,0 +1,214 @@
+"""
+In-process metrics, rendered in the Prometheus text format at /metrics.
+
+Every worker keeps its own numbers, so with several workers each scrape
+sees one worker; run one scrape target per worker to see them all.
+Histograms and counters may be updated from the DB threads, so each
+metric guards its values with a lock.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable
+
+# Upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# Clients can send any method, the rest share one label
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "CONNECT", "TRACE"})
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in sorted(values)]
+
+
+class Gauge(Metric):
+    """
+    Read when scraped: `collect` returns the current value per label tuple.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable[[], dict[Labels, float]], labels: Labels = ()) -> None:
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in sorted(self.collect().items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label tuple -> [count per bucket (last is +Inf), sum]
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if labels not in self._values:
+                self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[labels]
+            counts[index] += 1
+            total[0] += value
+
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+
+        samples = []
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return samples
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds: Histogram = registry.register(Histogram(
+    "fromchat_http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status")
+))
+websocket_frames: Counter = registry.register(Counter(
+    "fromchat_websocket_frames_total", "WebSocket frames received by event type", ("type",)
+))
+websocket_handler_seconds: Histogram = registry.register(Histogram(
+    "fromchat_websocket_handler_duration_seconds", "Time spent handling a WebSocket frame by event type", ("type",)
+))
+broadcast_fanout_seconds: Histogram = registry.register(Histogram(
+    "fromchat_broadcast_fanout_duration_seconds", "Time to queue a broadcast for every local connection by event type", ("type",)
+))
+sql_statements: Counter = registry.register(Counter(
+    "fromchat_sql_statements_total", "SQL statements executed by verb", ("verb",)
+))
+sql_errors: Counter = registry.register(Counter(
+    "fromchat_sql_errors_total", "SQL statements that raised by verb", ("verb",)
+))
+sql_statement_seconds: Histogram = registry.register(Histogram(
+    "fromchat_sql_statement_duration_seconds", "SQL statement execution time by verb", ("verb",), SQL_BUCKETS
+))
+
+
+def statement_verb(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+
+
+class MetricsMiddleware:
+    """
+    Records the latency of every HTTP request. Requests are labelled with
+    the route template, not the path, so ids in the URL don't create new
+    series; requests no route matched share the `unmatched` label, and
+    methods outside the standard ones share `other`.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                scope["method"] if scope["method"] in HTTP_METHODS else "other",
+                getattr(route, "path", "unmatched"),
+                str(status)
+            )
@@ -0,0 +1,131 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in the database itself, as SQLite's `user_version`.
+Each entry of MIGRATIONS runs once, in order, in the transaction that bumps
+the version, so a migration that fails leaves the database as it was.
+Workers starting together take turns on the write lock; whoever comes
+second finds nothing left to do.
+
+Changes to existing tables go at the end of the list as new migrations,
+ones that already shipped are never edited. The app migrates on startup,
+to do it by hand:
+
+    python migrations.py [status]
+"""
+import logging
+import sys
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Connection, Engine, Table, inspect
+
+from constants import PUBLIC_CONVERSATION_ID
+from db import engine
+from models import Base, Conversation, EventLog, Message, ReadCursor
+from search import ensure_search_index
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def add_column(connection: Connection, table: Table, name: str):
+    """
+    Add a column declared on the model to an existing table. It needs a
+    server default or must be nullable.
+    """
+    if name in {column["name"] for column in inspect(connection).get_columns(table.name)}:
+        return
+
+    column = table.c[name]
+    definition = f"{column.name} {column.type.compile(connection.dialect)}"
+    if not column.nullable:
+        definition += " NOT NULL"
+    if column.server_default is not None:
+        definition += f" DEFAULT {column.server_default.arg}"
+    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+
+
+def create_indexes(connection: Connection, table: Table):
+    # create_all skips indexes of tables that already exist. Indexes on
+    # columns a later migration adds are left to that migration.
+    columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for index in table.indexes:
+        if {column.name for column in index.columns} <= columns:
+            index.create(bind=connection, checkfirst=True)
+
+
+def initial_schema(connection: Connection):
+    # Databases from before versioning are at 0 with any of this already in
+    # place. create_all builds the current models, so the migrations after
+    # this one have to skip what exists, like add_column does.
+    Base.metadata.create_all(bind=connection)
+    create_indexes(connection, Message.__table__)
+    ensure_search_index(connection)
+
+
+def conversations(connection: Connection):
+    Base.metadata.create_all(bind=connection)
+    add_column(connection, Message.__table__, "conversation_id")
+    add_column(connection, EventLog.__table__, "conversation_id")
+    create_indexes(connection, Message.__table__)
+
+    # Read cursors become per conversation, which changes the primary key
+    if "conversation_id" not in {column["name"] for column in inspect(connection).get_columns("read_cursor")}:
+        connection.exec_driver_sql("ALTER TABLE read_cursor RENAME TO read_cursor_old")
+        ReadCursor.__table__.create(bind=connection)
+        connection.exec_driver_sql(
+            "INSERT INTO read_cursor (user_id, conversation_id, message_id, updated_at) "
+            f"SELECT user_id, {PUBLIC_CONVERSATION_ID}, message_id, updated_at FROM read_cursor_old"
+        )
+        connection.exec_driver_sql("DROP TABLE read_cursor_old")
+
+    # Every message so far was posted to the public room
+    if not connection.execute(Conversation.__table__.select().where(Conversation.id == PUBLIC_CONVERSATION_ID)).first():
+        connection.execute(Conversation.__table__.insert().values(
+            id=PUBLIC_CONVERSATION_ID, kind="public", title="General", created_at=datetime.now()
+        ))
+
+
+MIGRATIONS: list[tuple[str, Callable[[Connection], None]]] = [
+    ("Initial schema", initial_schema),
+    ("Message edit versions", lambda connection: add_column(connection, Message.__table__, "edit_version")),
+    ("Conversations", conversations),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine: Engine = engine) -> int:
+    """
+    Apply pending migrations. Returns how many were applied.
+    """
+    with engine.connect() as connection:
+        if schema_version(connection) == SCHEMA_VERSION:
+            return 0
+
+    # Read the version again under the write lock, another worker may have migrated meanwhile
+    with engine.execution_options(immediate=True).begin() as connection:
+        version = schema_version(connection)
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this code supports ({SCHEMA_VERSION})")
+
+        for number, (description, migration) in enumerate(MIGRATIONS[version:], version + 1):
+            logger.info(f"Migrating database to version {number}: {description}")
+            migration(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+        return SCHEMA_VERSION - version
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["status"]:
+        with engine.connect() as connection:
+            print(f"Schema version {schema_version(connection)}, latest {SCHEMA_VERSION}")
+    elif not sys.argv[1:]:
+        logging.basicConfig(level=logging.INFO)
+        print(f"Applied {migrate()} migrations")
+    else:
+        sys.exit("Usage: python migrations.py [status]")
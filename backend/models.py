@@ -1,9 +1,9 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, inspect, text
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from db import engine
 from pydantic import BaseModel
+from constants import PUBLIC_CONVERSATION_ID
 
 Base = declarative_base()
 
@@ -30,13 +30,111 @@ class Message(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.now)
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
-    is_read = Column(Boolean, default=False)
     reply_to_id = Column(Integer, ForeignKey("message.id"), nullable=True)
     is_edited = Column(Boolean, default=False)
+    # Bumped on every edit, cached encodings of the message are per version
+    edit_version = Column(Integer, nullable=False, default=0, server_default="0")
+    conversation_id = Column(Integer, ForeignKey("conversation.id"), nullable=False, default=PUBLIC_CONVERSATION_ID, server_default=str(PUBLIC_CONVERSATION_ID))
 
     author = relationship("User", back_populates="messages")
     reply_to = relationship("Message", remote_side=[id])
 
+    __table_args__ = (
+        # Keyset pagination over (timestamp, id), the first across all
+        # conversations for retention, the second within one
+        Index("ix_message_timestamp_id", "timestamp", "id"),
+        Index("ix_message_conversation_timestamp_id", "conversation_id", "timestamp", "id"),
+    )
+
+
+class Conversation(Base):
+    """
+    Where messages are posted. `kind` is "public" (the room every user is
+    in, without member rows), "room" (members only) or "direct" (two users).
+    `direct_key`, "<smaller user id>:<larger user id>", keeps one direct
+    conversation per pair.
+    """
+    __tablename__ = "conversation"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16), nullable=False)
+    title = Column(String(100), nullable=True)
+    direct_key = Column(String(32), unique=True, nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class ConversationMember(Base):
+    __tablename__ = "conversation_member"
+
+    conversation_id = Column(Integer, ForeignKey("conversation.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True, index=True)
+    joined_at = Column(DateTime, default=datetime.now)
+
+
+class EventLog(Base):
+    """
+    Message events in the order they happened, so reconnecting clients can
+    catch up on what they missed. `seq` only ever grows.
+    """
+    __tablename__ = "event_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    type = Column(String(32), nullable=False)
+    message_id = Column(Integer, nullable=False, index=True)
+    conversation_id = Column(Integer, nullable=False, default=PUBLIC_CONVERSATION_ID, server_default=str(PUBLIC_CONVERSATION_ID))
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class EventLogState(Base):
+    """
+    Single row: events up to `trimmed_through` are gone from the log.
+    """
+    __tablename__ = "event_log_state"
+
+    id = Column(Integer, primary_key=True)
+    trimmed_through = Column(Integer, nullable=False, default=0)
+
+
+class ReadCursor(Base):
+    """
+    Newest message a user has read in a conversation. Everything in it at
+    or below that id counts as read.
+    """
+    __tablename__ = "read_cursor"
+
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    conversation_id = Column(Integer, primary_key=True, default=PUBLIC_CONVERSATION_ID)
+    message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class DeletionJob(Base):
+    """
+    Bulk deletion run in the background, one short transaction per chunk.
+    `kind` is "user" (the user and all their messages) or "messages" (the
+    ids in `message_ids`, a JSON list). `worker` runs it and keeps
+    `heartbeat_at` fresh, a stale job is picked up by another worker.
+    """
+    __tablename__ = "deletion_job"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16), nullable=False)
+    user_id = Column(Integer, nullable=True)
+    message_ids = Column(Text, nullable=True)
+    requested_by = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False, default="running")  # running | done | failed
+    total = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+    position = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    worker = Column(String(32), nullable=True)
+    heartbeat_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
 
 # Pydantic модели
 class LoginRequest(BaseModel):
@@ -52,6 +150,7 @@ class RegisterRequest(BaseModel):
 
 class SendMessageRequest(BaseModel):
     content: str
+    conversation_id: int = PUBLIC_CONVERSATION_ID
 
 
 class EditMessageRequest(BaseModel):
@@ -67,10 +166,40 @@ class DeleteMessageRequest(BaseModel):
     message_id: int
 
 
+class BulkDeleteRequest(BaseModel):
+    message_ids: list[int]
+
+
+class MarkReadRequest(BaseModel):
+    message_id: int
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+
+
+class CreateRoomRequest(BaseModel):
+    title: str
+    usernames: list[str] = []
+
+
+class DirectConversationRequest(BaseModel):
+    username: str
+
+
+class AddMemberRequest(BaseModel):
+    username: str
+
+
+class SubscribeRequest(BaseModel):
+    conversation_ids: list[int]
+
+
 class UpdateBioRequest(BaseModel):
     bio: str
 
 
+class PresenceRequest(BaseModel):
+    usernames: list[str]
+
+
 class UserProfileResponse(BaseModel):
     id: int
     username: str
@@ -89,7 +218,6 @@ class MessageResponse(BaseModel):
     content: str
     timestamp: datetime
     is_author: bool
-    is_read: bool
     username: str
     profile_picture: str | None
 
@@ -97,5 +225,16 @@ class MessageResponse(BaseModel):
         from_attributes = True
 
 
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+class GetMessagesRequest(BaseModel):
+    before: str | None = None
+    after: str | None = None
+    limit: int | None = None
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+
+
+class SearchMessagesRequest(BaseModel):
+    query: str
+    cursor: str | None = None
+    limit: int | None = None
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+
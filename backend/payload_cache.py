@@ -0,0 +1,67 @@
+from collections import OrderedDict
+
+from constants import MESSAGE_PAYLOAD_CACHE_SIZE
+from protocol import MessagePayload
+
+
+class PayloadCache:
+    """
+    LRU of MessagePayloads, keyed by message id and `edit_version`, so a
+    message is encoded once for every broadcast and history page that
+    carries it. Edits and deletes drop the entry; any other change to the
+    serialized message, like a quote that went away, is caught by comparing
+    it with the cached one.
+    """
+
+    def __init__(self, size: int = MESSAGE_PAYLOAD_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, MessagePayload] = OrderedDict()
+
+    def get(self, message: dict) -> MessagePayload:
+        message_id = message["id"]
+        payload = self._entries.get(message_id)
+        if payload is not None and (payload.message is message or payload.message == message):
+            self._entries.move_to_end(message_id)
+            self.hits += 1
+            return payload
+
+        self.misses += 1
+        payload = self._entries[message_id] = MessagePayload(message)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return payload
+
+    def get_many(self, messages: list[dict]) -> list[MessagePayload]:
+        return [self.get(message) for message in messages]
+
+    def invalidate(self, message_id: int):
+        self._entries.pop(message_id, None)
+
+    def invalidate_user(self, username: str):
+        # Messages by the user and replies quoting them
+        for message_id in [
+            message_id for message_id, payload in self._entries.items()
+            if payload.message["username"] == username or (payload.message.get("reply_to") or {}).get("username") == username
+        ]:
+            del self._entries[message_id]
+
+    def apply_event(self, event: dict):
+        type = event["type"]
+        if type == "messageEdited":
+            cached = self._entries.get(event["data"]["id"])
+            if cached and cached.message.get("edit_version", 0) < event["data"].get("edit_version", 0):
+                self.invalidate(event["data"]["id"])
+        elif type == "messageDeleted":
+            self.invalidate(event["data"]["message_id"])
+        elif type == "messagesDeleted":
+            for message_id in event["data"]["message_ids"]:
+                self.invalidate(message_id)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "capacity": self.size, "hits": self.hits, "misses": self.misses}
+
+
+message_payloads = PayloadCache()
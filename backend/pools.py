@@ -0,0 +1,45 @@
+import asyncio
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+
+class BoundedPool:
+    """
+    Runs CPU-heavy work on an executor, refusing new work with a 503 once
+    `max_pending` calls are already queued or running.
+    """
+
+    def __init__(self, executor_factory: Callable[[], Executor], max_pending: int) -> None:
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor_factory = executor_factory
+        self._executor: Executor | None = None
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later",
+                headers={"Retry-After": "1"}
+            )
+
+        # Created on first use, so importing the module doesn't spawn workers
+        if self._executor is None:
+            self._executor = self._executor_factory()
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except BrokenExecutor:
+            # A worker process died, start with a fresh pool next time
+            self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from backplane import PRESENCE_CHANNEL, USER_DELETED_CHANNEL, backplane
+from constants import PRESENCE_FLUSH_INTERVAL
+from models import User
+from writer import db_writer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def flush_last_seen(db: Session, last_seen: dict[int, tuple[datetime, bool]]):
+    # One executemany UPDATE for the whole batch
+    db.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id == bindparam("user_id"))
+        .values(last_seen=bindparam("seen"), online=bindparam("is_online")),
+        [{"user_id": id, "seen": seen, "is_online": online} for id, (seen, online) in last_seen.items()]
+    )
+
+
+class PresenceTracker:
+    """
+    Who is online, kept in memory and driven by WebSocket connections.
+
+    Every `interval` seconds the tracker writes the `last_seen` values that
+    changed since the last tick in one batch, tells the other workers which
+    users it has connected, and reports users that went on- or offline since
+    the previous tick to its listeners as a single coalesced list.
+    """
+
+    def __init__(self, interval: float = PRESENCE_FLUSH_INTERVAL) -> None:
+        self.interval = interval
+        self.worker_id = uuid.uuid4().hex
+        self._connections: dict[int, int] = {}
+        self._usernames: dict[int, str] = {}
+        self._ids: dict[str, int] = {}
+        self._last_seen: dict[int, datetime] = {}
+        self._dirty: set[int] = set()
+        # Other workers' connected users, with when we last heard from them
+        self._workers: dict[str, tuple[float, set[int]]] = {}
+        self._announced: set[int] = set()
+        self._listeners: list[Callable[[list[dict]], None]] = []
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, listener: Callable[[list[dict]], None]):
+        self._listeners.append(listener)
+
+    def connect(self, user_id: int, username: str):
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        self.touch(user_id, username)
+
+    def disconnect(self, user_id: int):
+        count = self._connections.get(user_id)
+        if count is None:
+            return
+
+        if count > 1:
+            self._connections[user_id] = count - 1
+        else:
+            del self._connections[user_id]
+        self.touch(user_id)
+
+    def touch(self, user_id: int, username: str | None = None):
+        """
+        Record activity: connects, disconnects, logins and heartbeat frames.
+        """
+        if username:
+            self._set_username(user_id, username)
+        self._last_seen[user_id] = datetime.now()
+        self._dirty.add(user_id)
+
+    def remember(self, user_id: int, username: str, last_seen: datetime):
+        # Seed from the database for users this worker hasn't seen yet
+        self._set_username(user_id, username)
+        self._last_seen.setdefault(user_id, last_seen)
+
+    def forget(self, user_id: int):
+        self._connections.pop(user_id, None)
+        self._ids.pop(self._usernames.pop(user_id, None), None)
+        self._last_seen.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._announced.discard(user_id)
+        for _, user_ids in self._workers.values():
+            user_ids.discard(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._connections or any(user_id in user_ids for _, user_ids in self._workers.values())
+
+    def find(self, username: str) -> int | None:
+        """
+        Id of a user whose presence is known, None if it has to be loaded.
+        """
+        user_id = self._ids.get(username)
+        return user_id if user_id in self._last_seen else None
+
+    def last_seen(self, user_id: int, default: datetime | None = None) -> datetime | None:
+        return self._last_seen.get(user_id, default)
+
+    def presence(self, user_id: int) -> dict:
+        last_seen = self._last_seen.get(user_id)
+        return {
+            "username": self._usernames.get(user_id),
+            "online": self.is_online(user_id),
+            "last_seen": last_seen.isoformat() if last_seen else None
+        }
+
+    def receive(self, payload: dict):
+        if payload["worker"] == self.worker_id:
+            return
+
+        online = set()
+        for user_id, username in payload["online"]:
+            online.add(user_id)
+            if username:
+                self._set_username(user_id, username)
+        for user_id, seen in payload["seen"]:
+            seen = datetime.fromisoformat(seen)
+            if user_id not in self._last_seen or self._last_seen[user_id] < seen:
+                self._last_seen[user_id] = seen
+
+        if payload.get("stopping"):
+            self._workers.pop(payload["worker"], None)
+        else:
+            self._workers[payload["worker"]] = (time.monotonic(), online)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Whoever is still connected was last seen now
+        for user_id in list(self._connections):
+            self.touch(user_id)
+        self._connections.clear()
+        await self.tick(stopping=True)
+
+    async def tick(self, stopping: bool = False):
+        for user_id in self._connections:
+            self.touch(user_id)
+
+        dirty, self._dirty = self._dirty, set()
+        batch = {user_id: (self._last_seen[user_id], self.is_online(user_id)) for user_id in dirty if user_id in self._last_seen}
+        if batch:
+            try:
+                await db_writer.submit(flush_last_seen, batch)
+            except Exception:
+                logger.exception("Failed to flush last_seen")
+                self._dirty |= dirty
+
+        await backplane.publish(PRESENCE_CHANNEL, {
+            "worker": self.worker_id,
+            "stopping": stopping,
+            "online": [[user_id, self._usernames.get(user_id)] for user_id in self._connections],
+            "seen": [[user_id, seen.isoformat()] for user_id, (seen, _) in batch.items()]
+        })
+
+        self._expire_workers()
+        self._announce()
+
+    def _set_username(self, user_id: int, username: str):
+        self._usernames[user_id] = username
+        self._ids[username] = user_id
+
+    def _expire_workers(self):
+        # A worker that stopped publishing has died without saying goodbye
+        cutoff = time.monotonic() - self.interval * 3
+        for worker, (heard_at, _) in list(self._workers.items()):
+            if heard_at < cutoff:
+                del self._workers[worker]
+
+    def _announce(self):
+        online = set(self._connections)
+        for _, user_ids in self._workers.values():
+            online |= user_ids
+
+        changed = online ^ self._announced
+        self._announced = online
+        if not changed:
+            return
+
+        changes = [self.presence(user_id) for user_id in sorted(changed)]
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception("Presence listener failed")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Presence tick failed")
+
+
+presence = PresenceTracker()
+backplane.subscribe(PRESENCE_CHANNEL, presence.receive)
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: presence.forget(user["id"]))
@@ -0,0 +1,231 @@
+"""
+Wire encodings for /chat/ws, picked with the WebSocket subprotocol.
+
+- no subprotocol: JSON text frames, one event per frame
+- `fromchat.msgpack.v1`: MessagePack binary frames with the field names
+  below swapped for short tags. Every frame the server sends is an array
+  of events, several when they were queued within the flush window.
+  Client frames are a single event.
+
+Nothing is encoded twice: an event sent to many connections is a
+PreparedEvent, encoded once per codec, and messages are MessagePayloads
+whose encodings are cached with them and spliced into every event and
+history page that carries them. orjson is used for JSON when installed.
+"""
+import json
+from typing import Any
+
+import msgpack
+from fastapi import WebSocket
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MSGPACK_SUBPROTOCOL = "fromchat.msgpack.v1"
+
+# Field name -> tag. Only ever append, deployed clients depend on these.
+FIELD_TAGS = {
+    "type": "t",
+    "data": "d",
+    "error": "x",
+    "code": "xc",
+    "detail": "xd",
+    "status": "s",
+    "credentials": "cr",
+    "id": "i",
+    "content": "c",
+    "timestamp": "ts",
+    "is_edited": "e",
+    "username": "u",
+    "profile_picture": "p",
+    "reply_to": "r",
+    "reply_to_id": "ri",
+    "message": "m",
+    "message_id": "mi",
+    "messages": "ms",
+    "has_more": "hm",
+    "prev_cursor": "pc",
+    "next_cursor": "nc",
+    "before": "b",
+    "after": "a",
+    "limit": "l",
+    "query": "q",
+    "cursor": "cu",
+    "results": "rs",
+    "snippet": "sn",
+    "rank": "rk",
+    "users": "us",
+    "online": "o",
+    "last_seen": "ls",
+    "receipts": "rc",
+    "seq": "sq",
+    "replayed": "rp",
+    "message_ids": "mis",
+    "retry_after": "ra",
+    "edit_version": "ev",
+    "typing": "ty",
+    "timeout": "to",
+    "conversation_id": "ci",
+    "conversation_ids": "cis",
+    "conversation": "cv",
+    "members": "mb",
+    "kind": "k",
+    "title": "ti",
+    "member": "me",
+}
+TAG_FIELDS = {tag: field for field, tag in FIELD_TAGS.items()}
+
+assert len(TAG_FIELDS) == len(FIELD_TAGS), "Duplicate field tag"
+assert not TAG_FIELDS.keys() & FIELD_TAGS.keys(), "Field tag collides with a field name"
+
+
+def _rename(value: Any, names: dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        return {names.get(key, key): _rename(item, names) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rename(item, names) for item in value]
+    return value
+
+
+def dumps(value: Any) -> str:
+    # Same output as WebSocket.send_json and JSONResponse
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+_packer = msgpack.Packer()
+
+
+class MessagePayload:
+    """
+    A serialized message and its encodings, computed the first time a
+    codec needs them.
+    """
+
+    __slots__ = ("message", "_json", "_msgpack")
+
+    def __init__(self, message: dict) -> None:
+        self.message = message
+        self._json: str | None = None
+        self._msgpack: bytes | None = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = dumps(self.message)
+        return self._json
+
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(_rename(self.message, FIELD_TAGS))
+        return self._msgpack
+
+
+class PreparedEvent:
+    """
+    An outgoing event, encoded once per codec however many connections
+    it is sent to.
+    """
+
+    __slots__ = ("event", "_encoded")
+
+    def __init__(self, event: dict) -> None:
+        self.event = event
+        self._encoded: dict[str, str | bytes] = {}
+
+    def encoded(self, codec: "Codec") -> str | bytes:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode_value(self.event)
+        return data
+
+
+# MessagePayloads may be dict values or make up a whole list, anything
+# else is handed to the encoder as it is.
+
+def encode_json(value: Any) -> str:
+    if isinstance(value, MessagePayload):
+        return value.json()
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{dumps(key)}:{encode_json(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list) and value and isinstance(value[0], MessagePayload):
+        return "[" + ",".join(item.json() for item in value) + "]"
+    return dumps(value)
+
+
+def encode_msgpack(value: Any) -> bytes:
+    if isinstance(value, MessagePayload):
+        return value.msgpack()
+    if isinstance(value, dict):
+        return _packer.pack_map_header(len(value)) + b"".join(
+            msgpack.packb(FIELD_TAGS.get(key, key)) + encode_msgpack(item) for key, item in value.items()
+        )
+    if isinstance(value, list) and value and isinstance(value[0], MessagePayload):
+        return _packer.pack_array_header(len(value)) + b"".join(item.msgpack() for item in value)
+    return msgpack.packb(_rename(value, FIELD_TAGS))
+
+
+class JsonCodec:
+    name = "json"
+    subprotocol: str | None = None
+    batching = False
+
+    def encode_value(self, value: Any) -> str:
+        return encode_json(value)
+
+    def encode(self, events: list[dict | PreparedEvent]) -> list[str]:
+        return [event.encoded(self) if isinstance(event, PreparedEvent) else encode_json(event) for event in events]
+
+    async def send(self, websocket: WebSocket, events: list[dict | PreparedEvent]):
+        for frame in self.encode(events):
+            await websocket.send_text(frame)
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        return await websocket.receive_json()
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    subprotocol = MSGPACK_SUBPROTOCOL
+    batching = True
+
+    def encode_value(self, value: Any) -> bytes:
+        return encode_msgpack(value)
+
+    def encode(self, events: list[dict | PreparedEvent]) -> list[bytes]:
+        # An array of events, each encoded on its own so shared ones are reused
+        return [_packer.pack_array_header(len(events)) + b"".join(
+            event.encoded(self) if isinstance(event, PreparedEvent) else encode_msgpack(event) for event in events
+        )]
+
+    def encode_request(self, event: dict) -> bytes:
+        # What a client sends, for tools and benchmarks
+        return msgpack.packb(_rename(event, FIELD_TAGS))
+
+    def decode(self, frame: bytes) -> dict:
+        return _rename(msgpack.unpackb(frame), TAG_FIELDS)
+
+    async def send(self, websocket: WebSocket, events: list[dict | PreparedEvent]):
+        for frame in self.encode(events):
+            await websocket.send_bytes(frame)
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        return self.decode(await websocket.receive_bytes())
+
+
+Codec = JsonCodec | MsgpackCodec
+
+CODECS: dict[str, Codec] = {MSGPACK_SUBPROTOCOL: MsgpackCodec()}
+DEFAULT_CODEC = JsonCodec()
+
+
+def negotiate(websocket: WebSocket) -> Codec:
+    """
+    First subprotocol the client offered that we speak, JSON otherwise.
+    """
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return DEFAULT_CODEC
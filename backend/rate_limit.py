@@ -0,0 +1,96 @@
+"""
+Per-user and per-connection rate limits, and load shedding on the writer.
+
+Messaging actions have a token bucket per user, shared by the REST routes
+and the WebSocket frames that call them. Every WebSocket connection also
+has a bucket for frames of any type. Buckets live in this worker's
+memory, with several workers each one enforces the budget on its own.
+"""
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, status
+
+from constants import RATE_LIMIT_MAX_KEYS, RATE_LIMITS, WRITE_BACKLOG_LIMIT
+from metrics import Counter, registry
+from writer import db_writer
+
+throttled_requests: Counter = registry.register(Counter(
+    "fromchat_throttled_requests_total", "Requests refused by a rate limit by action", ("action",)
+))
+shed_requests: Counter = registry.register(Counter(
+    "fromchat_shed_requests_total", "Writes refused because the writer backlog was full by action", ("action",)
+))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """
+        Take `cost` tokens. Returns 0 when they were there, otherwise how
+        many seconds until they will be; nothing is taken then.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits: dict[str, tuple[float, float]] = RATE_LIMITS, max_keys: int = RATE_LIMIT_MAX_KEYS) -> None:
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[tuple[str, int], TokenBucket] = OrderedDict()
+
+    def check(self, action: str, user_id: int):
+        """
+        Take a token from the user's bucket for `action`, 429 when it's empty.
+        """
+        key = (action, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits[action])
+            # Forgetting the least recently used key only hands it a full bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        self.take(action, bucket)
+
+    def take(self, action: str, bucket: TokenBucket):
+        wait = bucket.take()
+        if wait:
+            throttled_requests.inc(action)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+
+def admit_write(action: str, backlog_limit: int = WRITE_BACKLOG_LIMIT):
+    """
+    Refuse new writes with a 503 while the group-commit writer is this far
+    behind, so it catches up instead of everyone's writes timing out.
+    """
+    if db_writer.backlog >= backlog_limit:
+        shed_requests.inc(action)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"}
+        )
+
+
+rate_limiter = RateLimiter()
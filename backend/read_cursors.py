@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from backplane import BROADCAST_CHANNEL, USER_DELETED_CHANNEL, backplane
+from constants import PUBLIC_CONVERSATION_ID, READ_RECEIPT_DELAY
+from dependencies import UserSnapshot
+from models import ConversationMember, Message, ReadCursor, User
+from writer import db_writer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+# (user id, conversation id)
+CursorKey = tuple[int, int]
+
+
+def load_read_cursor(db: Session, user_id: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> int:
+    return db.query(ReadCursor.message_id).filter(
+        ReadCursor.user_id == user_id,
+        ReadCursor.conversation_id == conversation_id
+    ).scalar() or 0
+
+
+def count_unread(db: Session, user_id: int, last_read_id: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> int:
+    # Ids grow with timestamps, so this is a range scan over the conversation's
+    # pagination index starting at the cursor's message
+    cursor_timestamp = db.query(Message.timestamp).filter(Message.id == last_read_id).scalar()
+    query = db.query(func.count(Message.id)).filter(
+        Message.conversation_id == conversation_id,
+        Message.id > last_read_id,
+        Message.user_id != user_id
+    )
+    if cursor_timestamp:
+        query = query.filter(Message.timestamp >= cursor_timestamp)
+    return query.scalar()
+
+
+def load_read_state(db: Session, user_id: int, known_cursor: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> tuple[int, int]:
+    last_read_id = max(known_cursor, load_read_cursor(db, user_id, conversation_id))
+    return last_read_id, count_unread(db, user_id, last_read_id, conversation_id)
+
+
+def load_read_cursors(db: Session, conversation_id: int = PUBLIC_CONVERSATION_ID) -> list[dict]:
+    rows = db.query(User.username, ReadCursor.message_id).join(User, User.id == ReadCursor.user_id).filter(
+        ReadCursor.conversation_id == conversation_id
+    ).all()
+    return [{"username": username, "message_id": message_id} for username, message_id in rows]
+
+
+def save_read_cursors(db: Session, cursors: dict[CursorKey, int]) -> dict[CursorKey, int]:
+    """
+    Move each user's cursor forward, never back and never past the newest
+    message. Cursors in conversations the user isn't a member of are
+    dropped. Returns the stored cursors.
+    """
+    private = {key for key in cursors if key[1] != PUBLIC_CONVERSATION_ID}
+    if private:
+        members = set(db.query(ConversationMember.user_id, ConversationMember.conversation_id).filter(
+            ConversationMember.user_id.in_({user_id for user_id, _ in private}),
+            ConversationMember.conversation_id.in_({conversation_id for _, conversation_id in private})
+        ).all())
+        cursors = {key: message_id for key, message_id in cursors.items() if key not in private or key in members}
+        if not cursors:
+            return {}
+
+    newest = db.query(func.max(Message.id)).scalar() or 0
+    statement = insert(ReadCursor).values([
+        {"user_id": user_id, "conversation_id": conversation_id, "message_id": min(message_id, newest)}
+        for (user_id, conversation_id), message_id in cursors.items()
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[ReadCursor.user_id, ReadCursor.conversation_id],
+        set_={
+            "message_id": func.max(ReadCursor.message_id, statement.excluded.message_id),
+            "updated_at": datetime.now()
+        }
+    ))
+
+    rows = db.query(ReadCursor.user_id, ReadCursor.conversation_id, ReadCursor.message_id).filter(
+        ReadCursor.user_id.in_({user_id for user_id, _ in cursors})
+    ).all()
+    return {(user_id, conversation_id): message_id for user_id, conversation_id, message_id in rows if (user_id, conversation_id) in cursors}
+
+
+class ReadTracker:
+    """
+    Collects markRead frames and writes them once per `delay`: a client that
+    marks every message it scrolls past costs one upsert per user,
+    conversation and window, and the members of each conversation get a
+    single readReceipts event for the window.
+    """
+
+    def __init__(self, delay: float = READ_RECEIPT_DELAY) -> None:
+        self.delay = delay
+        self._cursors: dict[CursorKey, int] = {}
+        self._pending: dict[CursorKey, int] = {}
+        self._usernames: dict[int, str] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    def mark(self, user: UserSnapshot, message_id: int, conversation_id: int = PUBLIC_CONVERSATION_ID):
+        if message_id <= self.cursor(user.id, conversation_id):
+            return
+
+        self._pending[user.id, conversation_id] = message_id
+        self._usernames[user.id] = user.username
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def cursor(self, user_id: int, conversation_id: int = PUBLIC_CONVERSATION_ID) -> int:
+        """
+        Highest cursor this worker knows of, including unflushed marks.
+        """
+        key = (user_id, conversation_id)
+        return max(self._cursors.get(key, 0), self._pending.get(key, 0))
+
+    def remember(self, user_id: int, message_id: int, conversation_id: int = PUBLIC_CONVERSATION_ID):
+        key = (user_id, conversation_id)
+        self._cursors[key] = max(self._cursors.get(key, 0), message_id)
+
+    def forget(self, user_id: int):
+        for cursors in (self._cursors, self._pending):
+            for key in [key for key in cursors if key[0] == user_id]:
+                del cursors[key]
+        self._usernames.pop(user_id, None)
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            stored = await db_writer.submit(save_read_cursors, pending)
+        except Exception:
+            logger.exception("Failed to save read cursors")
+            for key, message_id in pending.items():
+                self._pending[key] = max(message_id, self._pending.get(key, 0))
+            return
+
+        receipts: dict[int, list[dict]] = {}
+        for (user_id, conversation_id), message_id in stored.items():
+            self.remember(user_id, message_id, conversation_id)
+            if user_id in self._usernames:
+                receipts.setdefault(conversation_id, []).append({"username": self._usernames[user_id], "message_id": message_id})
+
+        for conversation_id, conversation_receipts in receipts.items():
+            await backplane.publish(BROADCAST_CHANNEL, {
+                "type": "readReceipts",
+                "conversation_id": conversation_id,
+                "data": {"receipts": conversation_receipts}
+            })
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+
+read_tracker = ReadTracker()
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: read_tracker.forget(user["id"]))
@@ -0,0 +1,124 @@
+"""
+Message retention: messages older than MESSAGE_RETENTION_DAYS move from
+the `message` table into the archive, oldest first, RETENTION_CHUNK_SIZE
+per step. A chunk is archived before it is deleted, so a run that stops in
+between only leaves messages that are in both places; the next run deletes
+them without archiving them again. Once a run deleted anything the freed
+pages are given back with VACUUM.
+
+Archived messages are still served by history pages, but can't be
+searched, edited or replied to any more, and replies still in the table
+lose their quote.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from archive import MessageArchive, message_archive
+from constants import MESSAGE_RETENTION_DAYS, RETENTION_CHUNK_SIZE, RETENTION_INTERVAL, RETENTION_VACUUM
+from db import db_executor, engine, run_in_db
+from history_cache import Key, message_key
+from models import Message
+from routes.messaging import MESSAGE_LOAD_OPTIONS, convert_message
+from writer import db_writer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def load_expired_messages(db: Session, cutoff: datetime, limit: int) -> list[dict]:
+    messages = db.query(Message).options(*MESSAGE_LOAD_OPTIONS).filter(
+        Message.timestamp < cutoff
+    ).order_by(Message.timestamp, Message.id).limit(limit).all()
+    return [convert_message(message) for message in messages]
+
+
+def delete_archived_messages(db: Session, message_ids: list[int], archived_through: Key) -> int:
+    # Only what the archive really has, in case a message changed since it was read
+    return db.query(Message).filter(
+        Message.id.in_(message_ids),
+        tuple_(Message.timestamp, Message.id) <= tuple_(*archived_through)
+    ).delete(synchronize_session=False)
+
+
+def vacuum(mode: str = RETENTION_VACUUM):
+    """
+    Give freed pages back to the filesystem. Incremental vacuum needs
+    auto_vacuum=INCREMENTAL, switching a database to it takes one full VACUUM.
+    """
+    if mode == "off":
+        return
+
+    # VACUUM can't run in a transaction, so this skips the session machinery
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if mode == "incremental":
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                cursor.execute("VACUUM")
+            else:
+                cursor.execute("PRAGMA incremental_vacuum").fetchall()
+        else:
+            cursor.execute("VACUUM")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+async def archive_expired_messages(
+    cutoff: datetime,
+    archive: MessageArchive = message_archive,
+    chunk_size: int = RETENTION_CHUNK_SIZE
+) -> tuple[int, int]:
+    """
+    Returns how many messages were archived and how many were deleted.
+    """
+    archived = deleted = 0
+    while True:
+        messages = await run_in_db(load_expired_messages, cutoff, chunk_size)
+        if not messages:
+            return archived, deleted
+
+        through = archive.archived_through
+        new = [message for message in messages if not through or message_key(message) > through]
+        if new:
+            await asyncio.to_thread(archive.append, new)
+            archived += len(new)
+
+        removed = await db_writer.submit(delete_archived_messages, [message["id"] for message in messages], archive.archived_through)
+        if not removed:
+            return archived, deleted
+        deleted += removed
+
+
+async def run_retention(retention_days: float = MESSAGE_RETENTION_DAYS, archive: MessageArchive = message_archive):
+    # One worker at a time, the others skip this round
+    os.makedirs(archive.directory, exist_ok=True)
+    fd = os.open(archive.directory / ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        archived, deleted = await archive_expired_messages(datetime.now() - timedelta(days=retention_days), archive)
+        if archived:
+            logger.info(f"Archived {archived} messages older than {retention_days:g} days")
+        if deleted:
+            await asyncio.get_running_loop().run_in_executor(db_executor, vacuum)
+    finally:
+        os.close(fd)
+
+
+async def retention_loop(interval: float = RETENTION_INTERVAL):
+    while True:
+        try:
+            await run_retention()
+        except Exception:
+            logger.exception("Message retention failed")
+        await asyncio.sleep(interval)
@@ -4,9 +4,14 @@ from sqlalchemy.orm import Session
 
 from routes.messaging import convert_message
 from constants import OWNER_USERNAME
-from dependencies import get_current_user, get_db
+from db import run_in_db
+from deletions import deletion_runner
+from dependencies import UserSnapshot, get_current_user
+from hashing import password_hasher
 from models import LoginRequest, RegisterRequest, User
-from utils import create_token, get_password_hash, verify_password
+from presence import presence
+from writer import db_writer
+from utils import create_token, password_needs_rehash
 from validation import is_valid_password, is_valid_username
 
 router = APIRouter()
@@ -15,14 +20,14 @@ def convert_user(user: User) -> dict:
     return {
         "id": user.id,
         "created_at": user.created_at.isoformat(),
-        "last_seen": user.last_seen.isoformat(),
-        "online": user.online,
+        "last_seen": presence.last_seen(user.id, user.last_seen).isoformat(),
+        "online": presence.is_online(user.id),
         "username": user.username,
         "admin": user.username == OWNER_USERNAME
     }
 
 @router.get("/check_auth")
-def check_auth(current_user: User = Depends(get_current_user)):
+def check_auth(current_user: UserSnapshot = Depends(get_current_user)):
     return {
         "authenticated": True,
         "username": current_user.username,
@@ -30,19 +35,54 @@ def check_auth(current_user: User = Depends(get_current_user)):
     }
 
 
+def find_user(db: Session, username: str) -> User | None:
+    return db.query(User).filter(User.username == username).first()
+
+
+def update_password_hash(db: Session, user_id: int, password_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+
+
+def registration_state(db: Session, username: str) -> tuple[bool, bool]:
+    owner_exists = find_user(db, OWNER_USERNAME) is not None
+    username_taken = find_user(db, username) is not None
+    return owner_exists, username_taken
+
+
+def create_user(db: Session, username: str, password_hash: str):
+    # Checked again here, someone may have registered it while we were hashing
+    if find_user(db, username):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Это имя пользователя уже занято"
+        )
+
+    db.add(User(
+        username=username,
+        password_hash=password_hash,
+        last_seen=datetime.now()
+    ))
+    db.flush()
+
+
 @router.post("/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == request.username.strip()).first()
+async def login(request: LoginRequest):
+    password = request.password.strip()
+    user = await run_in_db(find_user, request.username.strip())
 
-    if not user or not verify_password(request.password.strip(), user.password_hash):
+    if not user or not await password_hasher.verify(password, user.password_hash):
         raise HTTPException(
             status_code=401,
             detail="Неверное имя пользователя или пароль"
         )
 
-    user.online = True
-    user.last_seen = datetime.now()
-    db.commit()
+    # Stored with an outdated bcrypt cost
+    if password_needs_rehash(user.password_hash):
+        await db_writer.submit(update_password_hash, user.id, await password_hasher.hash(password))
+
+    # last_seen reaches the database with the presence tracker's next flush
+    presence.touch(user.id, user.username)
+    user_data = convert_user(user)
 
     token = create_token(user.id, user.username)
 
@@ -50,18 +90,18 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
         "status": "success",
         "message": "Login successful",
         "token": token,
-        "user": convert_user(user)
+        "user": user_data
     }
 
 
 @router.post("/register")
-def register(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest):
     username = request.username.strip()
     password = request.password.strip()
     confirm_password = request.confirm_password.strip()
 
     # Determine if owner already exists
-    owner_exists = db.query(User).filter(User.username == OWNER_USERNAME).first() is not None
+    owner_exists, username_taken = await run_in_db(registration_state, username)
 
     # If owner not yet registered, only allow the owner to register
     if not owner_exists and username != OWNER_USERNAME:
@@ -96,24 +136,14 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
             detail="Это имя пользователя зарезервировано"
         )
 
-    existing_user = db.query(User).filter(User.username == username).first()
-    if existing_user:
+    if username_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Это имя пользователя уже занято"
         )
 
-    hashed_password = get_password_hash(password)
-    new_user = User(
-        username=username,
-        password_hash=hashed_password,
-        online=True,
-        last_seen=datetime.now()
-    )
-
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    hashed_password = await password_hasher.hash(password)
+    await db_writer.submit(create_user, username, hashed_password)
 
     return {
         "status": "success",
@@ -121,41 +151,24 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
     }
 
 
-@router.delete("/admin/user/{user_id}")
-def delete_user_as_owner(
+@router.delete("/admin/user/{user_id}", status_code=status.HTTP_202_ACCEPTED)
+async def delete_user_as_owner(
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     # Only owner can delete users
     if current_user.username != OWNER_USERNAME:
         raise HTTPException(status_code=403, detail="Only owner can perform this action")
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # Prevent deleting the owner account via API
-    if user.username == OWNER_USERNAME:
-        raise HTTPException(status_code=400, detail="Cannot delete owner account")
+    # Messages go in chunks, the user is deleted with the last one
+    job = await deletion_runner.purge_user(user_id, current_user.id)
 
-    # Manually delete user's messages to satisfy FK constraints
-    from models import Message  # local import to avoid circular
-    db.query(Message).filter(Message.user_id == user.id).delete()
-
-    db.delete(user)
-    db.commit()
-
-    return {"status": "success", "deleted_user_id": user_id}
+    return {"status": "success", "deleted_user_id": user_id, "job": job}
 
 @router.get("/logout")
-def logout(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    current_user.online = False
-    current_user.last_seen = datetime.now()
-    db.commit()
+async def logout(current_user: UserSnapshot = Depends(get_current_user)):
+    # Online state follows the WebSocket, closing it takes the user offline
+    presence.touch(current_user.id, current_user.username)
 
     return {
         "status": "success",
@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from backplane import MEMBERSHIP_CHANNEL, backplane
+from constants import OWNER_USERNAME
+from conversations import add_member, create_room, load_conversation, load_conversations, open_direct_conversation, remove_member
+from db import run_in_db
+from dependencies import UserSnapshot, get_current_user
+from models import AddMemberRequest, CreateRoomRequest, DirectConversationRequest
+from rate_limit import admit_write, rate_limiter
+from read_cursors import load_read_state, read_tracker
+from writer import db_writer
+
+router = APIRouter()
+
+
+def load_conversations_with_unread(db: Session, user_id: int) -> list[dict]:
+    conversations = load_conversations(db, user_id)
+    for conversation in conversations:
+        known_cursor = read_tracker.cursor(user_id, conversation["id"])
+        conversation["last_read_message_id"], conversation["unread_count"] = load_read_state(db, user_id, known_cursor, conversation["id"])
+    return conversations
+
+
+async def change_membership(current_user: UserSnapshot, write, *args) -> dict:
+    admit_write("conversation")
+    rate_limiter.check("conversation", current_user.id)
+
+    conversation, changes = await db_writer.submit(write, *args)
+    # Every worker moves the members' connections in or out
+    for change in changes:
+        await backplane.publish(MEMBERSHIP_CHANNEL, change)
+
+    return {"status": "success", "conversation": conversation}
+
+
+@router.get("/conversations")
+async def get_conversations(current_user: UserSnapshot = Depends(get_current_user)):
+    return {"status": "success", "conversations": await run_in_db(load_conversations_with_unread, current_user.id)}
+
+
+@router.post("/conversations")
+async def create_conversation(
+    request: CreateRoomRequest,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await change_membership(current_user, create_room, current_user.id, request.title, request.usernames)
+
+
+@router.post("/conversations/direct")
+async def direct_conversation(
+    request: DirectConversationRequest,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await change_membership(current_user, open_direct_conversation, current_user.id, request.username)
+
+
+@router.get("/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: int,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return {"status": "success", "conversation": await run_in_db(load_conversation, conversation_id, current_user.id)}
+
+
+@router.post("/conversations/{conversation_id}/members")
+async def add_conversation_member(
+    conversation_id: int,
+    request: AddMemberRequest,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await change_membership(current_user, add_member, conversation_id, current_user.id, request.username)
+
+
+@router.delete("/conversations/{conversation_id}/members/{username}")
+async def remove_conversation_member(
+    conversation_id: int,
+    username: str,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    is_owner = current_user.username == OWNER_USERNAME
+    return await change_membership(current_user, remove_member, conversation_id, current_user.id, username, is_owner)
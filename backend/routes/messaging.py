@@ -1,33 +1,330 @@
 from datetime import datetime
+import asyncio
+import base64
 import logging
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.security import HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from dependencies import get_current_user, get_db
-from constants import OWNER_USERNAME
-from models import Message, SendMessageRequest, EditMessageRequest, ReplyMessageRequest, User
+import time
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Response, WebSocket, WebSocketDisconnect
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, joinedload
+from archive import message_archive
+from backplane import BROADCAST_CHANNEL, MEMBERSHIP_CHANNEL, PROFILE_UPDATED_CHANNEL, TYPING_CHANNEL, USER_DELETED_CHANNEL, backplane
+from connections import SocketConnection
+from conversations import accessible_conversations, require_access
+from db import run_in_db
+from dependencies import UserSnapshot, authenticate_cached, get_current_user, get_optional_user
+from deletions import deletion_runner, load_job
+from event_log import event_sequence, load_events_since, record_event
+from history_cache import Key, hot_history, message_key
+from metrics import Gauge, broadcast_fanout_seconds, registry, websocket_frames, websocket_handler_seconds
+from constants import BULK_DELETE_MAX_SIZE, EVENT_REPLAY_MAX, MESSAGES_PAGE_MAX_SIZE, MESSAGES_PAGE_SIZE, OWNER_USERNAME, PUBLIC_CONVERSATION_ID, SEARCH_PAGE_MAX_SIZE, SEARCH_PAGE_SIZE, SUBSCRIPTIONS_MAX
+from presence import presence
+from payload_cache import message_payloads
+from protocol import PreparedEvent, encode_json, negotiate
+from models import Message, BulkDeleteRequest, SendMessageRequest, EditMessageRequest, ReplyMessageRequest, GetMessagesRequest, SearchMessagesRequest, MarkReadRequest, SubscribeRequest
+from rate_limit import admit_write, rate_limiter
+from read_cursors import load_read_cursors, load_read_state, read_tracker
+from search import search_message_ids
+from typing_indicator import typing_tracker
+from writer import db_writer
 
 router = APIRouter()
 logger = logging.getLogger("uvicorn.error")
 
-def convert_message(msg: Message) -> dict:
+# Everything convert_message touches, loaded in the same SELECT
+MESSAGE_LOAD_OPTIONS = (
+    joinedload(Message.author),
+    joinedload(Message.reply_to).joinedload(Message.author),
+)
+
+
+def convert_message(msg: Message, include_reply: bool = True) -> dict:
+    """
+    Serialize a message. Quoted messages are serialized one level deep,
+    so a page loaded with MESSAGE_LOAD_OPTIONS needs no extra queries.
+    """
     return {
         "id": msg.id,
+        "conversation_id": msg.conversation_id,
         "content": msg.content,
         "timestamp": msg.timestamp.isoformat(),
-        "is_read": msg.is_read,
         "is_edited": msg.is_edited,
+        "edit_version": msg.edit_version,
         "username": msg.author.username,
         "profile_picture": msg.author.profile_picture,
-        "reply_to": convert_message(msg.reply_to) if msg.reply_to else None
+        "reply_to": convert_message(msg.reply_to, False) if include_reply and msg.reply_to else None
+    }
+
+
+def load_message(db: Session, message_id: int) -> Message | None:
+    return db.query(Message).options(*MESSAGE_LOAD_OPTIONS).filter(Message.id == message_id).first()
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{message_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = f"{rank!r}|{message_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        rank, message_id = raw.split("|")
+        return float(rank), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_conversation_ids(value: str) -> set[int]:
+    try:
+        return {int(id) for id in value.split(",")}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid conversation list")
+
+
+def search_messages_page(
+    db: Session,
+    query: str,
+    cursor: str | None,
+    limit: int,
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    user_id: int | None = None
+) -> dict:
+    require_access(db, conversation_id, user_id)
+    after = decode_search_cursor(cursor) if cursor else None
+    rows, has_more = search_message_ids(db, query, limit, after, conversation_id)
+
+    messages = db.query(Message).options(*MESSAGE_LOAD_OPTIONS).filter(Message.id.in_([id for id, _, _ in rows])).all()
+    by_id = {msg.id: msg for msg in messages}
+
+    return {
+        # Rows whose message vanished since the index was read are skipped
+        "results": [
+            {"message": convert_message(by_id[id]), "snippet": snippet, "rank": rank}
+            for id, rank, snippet in rows if id in by_id
+        ],
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor(rows[-1][1], rows[-1][0]) if rows else cursor
+    }
+
+
+def query_messages_page(
+    db: Session,
+    before: Key | None,
+    after: Key | None,
+    limit: int,
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    user_id: int | None = None
+) -> tuple[list[dict], bool]:
+    require_access(db, conversation_id, user_id)
+
+    key = tuple_(Message.timestamp, Message.id)
+    query = db.query(Message).options(*MESSAGE_LOAD_OPTIONS).filter(Message.conversation_id == conversation_id)
+
+    if after:
+        query = query.filter(key > tuple_(*after))
+        query = query.order_by(Message.timestamp.asc(), Message.id.asc())
+    else:
+        if before:
+            query = query.filter(key < tuple_(*before))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    messages = query.limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+
+    return [convert_message(msg) for msg in messages], has_more
+
+
+def add_archived_messages(
+    page: tuple[list[dict], bool],
+    before: Key | None,
+    after: Key | None,
+    limit: int,
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+) -> tuple[list[dict], bool]:
+    """
+    Complete a page from the table with archived messages where it runs
+    past the oldest message still in the table.
+    """
+    through = message_archive.archived_through
+    if not through:
+        return page
+
+    # Left over by a retention run that didn't get to delete them
+    messages = [message for message in page[0] if message_key(message) > through]
+    has_more = page[1]
+
+    if after:
+        if after >= through:
+            return page
+        messages = message_archive.after(after, limit + 1, conversation_id) + messages
+        return messages[:limit], has_more or len(messages) > limit
+
+    if has_more:
+        return messages, has_more
+
+    needed = limit - len(messages)
+    archived = message_archive.before(message_key(messages[0]) if messages else before, needed + 1, conversation_id)
+    return (archived[-needed:] if needed else []) + messages, len(archived) > needed
+
+
+async def load_messages_page(
+    before: str | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    user_id: int | None = None
+) -> dict:
+    """
+    Keyset pagination over (timestamp, id) within one conversation.
+
+    Without cursors returns the newest page. `before` walks back in history,
+    `after` fetches what was written since. Messages are always ascending.
+    Public pages inside the hot history window don't touch SQLite, pages
+    past the oldest message in the table come from the archive.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    limit = max(1, min(limit or MESSAGES_PAGE_SIZE, MESSAGES_PAGE_MAX_SIZE))
+    # Taken before the page, resuming from it may repeat events but never skips one
+    seq = event_sequence.latest
+    before_key = decode_cursor(before) if before else None
+    after_key = decode_cursor(after) if after else None
+
+    page = hot_history.page(before_key, after_key, limit) if conversation_id == PUBLIC_CONVERSATION_ID else None
+    if page is None:
+        page = await run_in_db(query_messages_page, before_key, after_key, limit, conversation_id, user_id)
+        # Reads and decompresses archive segments, keep it off the event loop
+        page = await asyncio.to_thread(add_archived_messages, page, before_key, after_key, limit, conversation_id)
+    messages, has_more = page
+
+    return {
+        "conversation_id": conversation_id,
+        # Encoded once and reused by every page and broadcast carrying them
+        "messages": message_payloads.get_many(messages),
+        "has_more": has_more,
+        "prev_cursor": encode_cursor(*message_key(messages[0])) if messages else before,
+        "next_cursor": encode_cursor(*message_key(messages[-1])) if messages else after,
+        "seq": seq
     }
 
 
+def load_hot_history(db: Session, size: int) -> tuple[list[dict], bool]:
+    messages, has_more = query_messages_page(db, None, None, size)
+    # Older messages in the archive mean the cache never holds everything
+    return messages, not has_more and not message_archive.archived_through
+
+
+def load_unread(db: Session, user_id: int, known_cursor: int, conversation_id: int) -> tuple[int, int]:
+    require_access(db, conversation_id, user_id)
+    return load_read_state(db, user_id, known_cursor, conversation_id)
+
+
+def load_conversation_read_cursors(db: Session, conversation_id: int, user_id: int) -> list[dict]:
+    require_access(db, conversation_id, user_id)
+    return load_read_cursors(db, conversation_id)
+
+
+async def warm_hot_history():
+    hot_history.begin_warm_up()
+    hot_history.load(*await run_in_db(load_hot_history, hot_history.size))
+
+
+# Write helpers run inside GroupCommitWriter, which commits for them.
+# They return the event to broadcast, logged in the same transaction.
+
+def create_message(
+    db: Session,
+    user_id: int,
+    content: str,
+    reply_to_id: int | None = None,
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+) -> dict:
+    # Check if the message being replied to exists, the reply goes to its conversation
+    if reply_to_id is not None:
+        original = db.get(Message, reply_to_id)
+        if not original:
+            raise HTTPException(status_code=404, detail="Original message not found")
+        conversation_id = original.conversation_id
+
+    require_access(db, conversation_id, user_id)
+
+    new_message = Message(
+        content=content,
+        user_id=user_id,
+        conversation_id=conversation_id,
+        timestamp=datetime.now(),
+        reply_to_id=reply_to_id
+    )
+
+    db.add(new_message)
+    db.flush()
+
+    return record_event(db, "newMessage", new_message.id, convert_message(load_message(db, new_message.id)), conversation_id)
+
+
+def update_message(db: Session, message_id: int, user_id: int, content: str) -> dict:
+    message = db.get(Message, message_id)
+
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    if message.user_id != user_id:
+        raise HTTPException(status_code=403, detail="You can only edit your own messages")
+
+    # Not after leaving the conversation
+    require_access(db, message.conversation_id, user_id)
+
+    message.content = content
+    message.is_edited = True
+    message.edit_version += 1
+
+    db.flush()
+
+    return record_event(db, "messageEdited", message_id, convert_message(load_message(db, message_id)), message.conversation_id)
+
+
+def remove_message(db: Session, message_id: int, user: UserSnapshot) -> dict:
+    message = db.get(Message, message_id)
+
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    # Allow owner to delete any message
+    if user.username != OWNER_USERNAME and message.user_id != user.id:
+        raise HTTPException(status_code=403, detail="You can only delete your own messages")
+
+    conversation_id = message.conversation_id
+
+    # Replies stay, without the quote
+    db.query(Message).filter(Message.reply_to_id == message_id).update({Message.reply_to_id: None}, synchronize_session=False)
+    db.delete(message)
+    db.flush()
+
+    return record_event(db, "messageDeleted", message_id, {"message_id": message_id}, conversation_id)
+
+
 @router.post("/send_message")
 async def send_message(
     request: SendMessageRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     if not request.content.strip():
         raise HTTPException(
@@ -41,30 +338,43 @@ async def send_message(
             detail="Message too long"
         )
 
-    new_message = Message(
-        content=request.content.strip(),
-        user_id=current_user.id,
-        timestamp=datetime.now()
-    )
+    admit_write("send")
+    rate_limiter.check("send", current_user.id)
 
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
+    event = await db_writer.submit(create_message, current_user.id, request.content.strip(), None, request.conversation_id)
+    typing_tracker.stop_typing(current_user.id, request.conversation_id)
+    await messagingManager.broadcast(event)
 
-    return {"status": "success", "message": convert_message(new_message)}
+    return {"status": "success", "message": event["data"]}
 
 
 @router.get("/get_messages")
-async def get_messages(db: Session = Depends(get_db)):
-    messages = db.query(Message).order_by(Message.timestamp.asc()).all()
-
-    messages_data = []
-    for msg in messages:
-        messages_data.append(convert_message(msg))
+async def get_messages(
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = MESSAGES_PAGE_SIZE,
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    current_user: UserSnapshot | None = Depends(get_optional_user)
+):
+    page = await load_messages_page(before, after, limit, conversation_id, current_user.id if current_user else None)
+    # The page holds pre-encoded messages, JSONResponse would encode them again
+    return Response(encode_json({"status": "success", **page}), media_type="application/json")
+
+
+@router.get("/search_messages")
+async def search_messages(
+    query: str,
+    cursor: str | None = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    rate_limiter.check("search", current_user.id)
+    limit = max(1, min(limit or SEARCH_PAGE_SIZE, SEARCH_PAGE_MAX_SIZE))
 
     return {
         "status": "success",
-        "messages": messages_data
+        **await run_in_db(search_messages_page, query, cursor, limit, conversation_id, current_user.id)
     }
 
 
@@ -72,208 +382,560 @@ async def get_messages(db: Session = Depends(get_db)):
 async def edit_message(
     message_id: int,
     request: EditMessageRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
-    message = db.query(Message).filter(Message.id == message_id).first()
-    
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
-    
-    if message.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You can only edit your own messages")
-    
     if not request.content.strip():
         raise HTTPException(status_code=400, detail="Message content cannot be empty")
+
+    admit_write("edit")
+    rate_limiter.check("edit", current_user.id)
+
+    event = await db_writer.submit(update_message, message_id, current_user.id, request.content.strip())
+    await messagingManager.broadcast(event)
     
-    message.content = request.content.strip()
-    message.is_edited = True
-    
-    db.commit()
-    db.refresh(message)
-    
-    return {"status": "success", "message": convert_message(message)}
+    return {"status": "success", "message": event["data"]}
 
 
 @router.delete("/delete_message/{message_id}")
 async def delete_message(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
-    message = db.query(Message).filter(Message.id == message_id).first()
-    
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
-    
-    # Allow owner to delete any message
-    if current_user.username != OWNER_USERNAME and message.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="You can only delete your own messages")
-    
-    db.delete(message)
-    db.commit()
+    admit_write("delete")
+    rate_limiter.check("delete", current_user.id)
+
+    event = await db_writer.submit(remove_message, message_id, current_user)
+    await messagingManager.broadcast(event)
     
     return {"status": "success", "message_id": message_id}
 
 
+@router.post("/admin/delete_messages", status_code=202)
+async def delete_messages_as_owner(
+    request: BulkDeleteRequest,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    if not request.message_ids:
+        raise HTTPException(status_code=400, detail="No messages provided")
+
+    if len(request.message_ids) > BULK_DELETE_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DELETE_MAX_SIZE} messages at once")
+
+    # Deleted in chunks in the background, each chunk is broadcast as messagesDeleted
+    job = await deletion_runner.delete_messages(request.message_ids, current_user.id)
+
+    return {"status": "success", "job": job}
+
+
+@router.get("/admin/jobs/{job_id}")
+async def get_deletion_job(
+    job_id: int,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    job = await run_in_db(load_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {"status": "success", "job": job}
+
+
 @router.post("/reply_message")
 async def reply_message(
     request: ReplyMessageRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
-    # Check if the message being replied to exists
-    original_message = db.query(Message).filter(Message.id == request.reply_to_id).first()
-    if not original_message:
-        raise HTTPException(status_code=404, detail="Original message not found")
-    
     if not request.content.strip():
         raise HTTPException(status_code=400, detail="No content provided")
+
+    admit_write("send")
+    rate_limiter.check("send", current_user.id)
+
+    event = await db_writer.submit(create_message, current_user.id, request.content.strip(), request.reply_to_id)
+    typing_tracker.stop_typing(current_user.id, event["conversation_id"])
+    await messagingManager.broadcast(event)
     
-    new_message = Message(
-        content=request.content.strip(),
-        user_id=current_user.id,
-        timestamp=datetime.now(),
-        reply_to_id=request.reply_to_id
-    )
-    
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
-    
-    return {"status": "success", "message": convert_message(new_message)}
+    return {"status": "success", "message": event["data"]}
+
+
+async def check_subscriptions(conversation_ids: set[int], user: UserSnapshot | None):
+    """
+    401/403 unless the user may follow every one of the conversations.
+    """
+    if len(conversation_ids) > SUBSCRIPTIONS_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {SUBSCRIPTIONS_MAX} conversations")
+
+    private = conversation_ids - {PUBLIC_CONVERSATION_ID}
+    if not private:
+        return
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if await run_in_db(accessible_conversations, private, user.id) != private:
+        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
+
+@router.get("/events")
+async def get_events(
+    after: int,
+    conversations: str | None = None,
+    current_user: UserSnapshot | None = Depends(get_optional_user)
+):
+    """
+    Events after seq `after` in the comma separated `conversations`, the
+    public room by default. 410 means the log no longer reaches back that
+    far and the client has to reload history. Apply the events as upserts,
+    compaction can turn an edit into a newMessage.
+    """
+    conversation_ids = parse_conversation_ids(conversations) if conversations else {PUBLIC_CONVERSATION_ID}
+    await check_subscriptions(conversation_ids, current_user)
+
+    events, seq = await run_in_db(load_events_since, after, EVENT_REPLAY_MAX, conversation_ids)
+    if events is None:
+        raise HTTPException(status_code=410, detail="Events are no longer available, reload the history")
+
+    return {"status": "success", "events": events, "seq": seq}
+
+
+@router.post("/mark_read")
+async def mark_read(
+    request: MarkReadRequest,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    # Saved and announced with the next batch of read receipts
+    read_tracker.mark(current_user, request.message_id, request.conversation_id)
 
+    return {"status": "success", "message_id": request.message_id}
 
-class MessaggingSocketManager:
-    def __init__(self) -> None:
-        self.connections: list[WebSocket] = []
 
-    async def send_error(self, websocket: WebSocket, type: str, e: HTTPException):
-        await websocket.send_json({"type": type, "error": {"code": e.status_code, "detail": e.detail}})
+@router.get("/unread")
+async def get_unread(
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    known_cursor = read_tracker.cursor(current_user.id, conversation_id)
+    last_read_id, unread = await run_in_db(load_unread, current_user.id, known_cursor, conversation_id)
+    read_tracker.remember(current_user.id, last_read_id, conversation_id)
+
+    return {"status": "success", "last_read_message_id": last_read_id, "unread_count": unread}
 
-    async def handle_connection(self, websocket: WebSocket, db: Session):
+
+@router.get("/read_cursors")
+async def get_read_cursors(
+    conversation_id: int = PUBLIC_CONVERSATION_ID,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return {"status": "success", "cursors": await run_in_db(load_conversation_read_cursors, conversation_id, current_user.id)}
+
+
+FRAME_TYPES = {
+    "ping", "auth", "getMessages", "searchMessages", "sendMessage",
+    "editMessage", "deleteMessage", "replyMessage", "markRead", "typing",
+    "subscribe", "unsubscribe"
+}
+
+
+class MessaggingSocketManager:
+    def __init__(self) -> None:
+        self.connections: list[SocketConnection] = []
+        # Conversation id -> connections subscribed to it
+        self.subscribers: dict[int, set[SocketConnection]] = {}
+
+    async def send_error(self, connection: SocketConnection, type: str, e: HTTPException):
+        error = {"code": e.status_code, "detail": e.detail}
+        if e.headers and "Retry-After" in e.headers:
+            error["retry_after"] = int(e.headers["Retry-After"])
+        connection.send({"type": type, "error": error})
+
+    async def authenticate(self, connection: SocketConnection, token: str | None) -> UserSnapshot | None:
+        """
+        Bind the connection to the token's user. Later frames reuse the binding
+        until the token expires, so they skip the JWT decode and the user lookup.
+        """
+        if token and token != connection.token:
+            self.bind(connection, await authenticate_cached(token), token)
+
+        if connection.user and time.time() >= connection.user.token_expires_at:
+            self.unbind(connection)
+            raise HTTPException(401, "Token expired")
+
+        return connection.user
+
+    def bind(self, connection: SocketConnection, user: UserSnapshot, token: str):
+        # A new token of the same user keeps its conversations
+        kept = set(connection.subscriptions) if connection.user and connection.user.id == user.id else set()
+        self.unbind(connection)
+        connection.bind(user, token)
+        presence.connect(user.id, user.username)
+        self.subscribe(connection, kept)
+
+    def unbind(self, connection: SocketConnection):
+        if connection.user:
+            presence.disconnect(connection.user.id)
+            typing_tracker.stop_typing(connection.user.id)
+        # Private conversations were checked against the user
+        self.unsubscribe(connection, connection.subscriptions - {PUBLIC_CONVERSATION_ID})
+        connection.unbind()
+
+    def unbind_user(self, user_id: int):
+        for connection in self.connections:
+            if connection.user and connection.user.id == user_id:
+                self.unsubscribe(connection, connection.subscriptions - {PUBLIC_CONVERSATION_ID})
+                connection.unbind()
+
+    def subscribe(self, connection: SocketConnection, conversation_ids: set[int]):
+        for conversation_id in conversation_ids:
+            connection.subscriptions.add(conversation_id)
+            self.subscribers.setdefault(conversation_id, set()).add(connection)
+
+    def unsubscribe(self, connection: SocketConnection, conversation_ids: set[int]):
+        for conversation_id in list(conversation_ids):
+            connection.subscriptions.discard(conversation_id)
+            subscribers = self.subscribers.get(conversation_id)
+            if subscribers:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.subscribers[conversation_id]
+
+    async def add_subscriptions(self, connection: SocketConnection, conversation_ids: set[int]):
+        if len(connection.subscriptions | conversation_ids) > SUBSCRIPTIONS_MAX:
+            raise HTTPException(status_code=400, detail=f"At most {SUBSCRIPTIONS_MAX} conversations")
+        await check_subscriptions(conversation_ids - connection.subscriptions, connection.user)
+        self.subscribe(connection, conversation_ids)
+
+    def remove(self, connection: SocketConnection):
+        self.unsubscribe(connection, connection.subscriptions)
+        if connection in self.connections:
+            self.connections.remove(connection)
+
+    def apply_membership(self, change: dict):
+        """
+        Follow a membership change published by any worker: the user's
+        connections here are told, a removed member's connections stop
+        getting its events, and its subscribers hear about it. New members
+        subscribe themselves, so clients only get the conversations they show.
+        """
+        conversation = change["conversation"]
+        conversation_id = conversation["id"]
+        connections = [connection for connection in self.connections if connection.user and connection.user.id == change["user_id"]]
+        event = {
+            "type": "memberJoined" if change["member"] else "memberLeft",
+            "conversation_id": conversation_id,
+            "data": {"username": change["username"]}
+        }
+
+        if change["member"]:
+            self.deliver(event)
+            for connection in connections:
+                connection.send({"type": "conversationJoined", "data": {"conversation": conversation}})
+        else:
+            for connection in connections:
+                self.unsubscribe(connection, {conversation_id})
+                connection.send({"type": "conversationLeft", "data": {"conversation_id": conversation_id}})
+            typing_tracker.stop_typing(change["user_id"], conversation_id)
+            self.deliver(event)
+
+    async def handle_connection(self, connection: SocketConnection):
         while True:
-            data = await websocket.receive_json()
+            data = await connection.receive()
             type = data["type"]
+            started = time.perf_counter()
+
+            try:
+                rate_limiter.take("frame", connection.frame_bucket)
+            except HTTPException as e:
+                await self.send_error(connection, type, e)
+                continue
 
-            def get_current_user_inner() -> User | None:
-                if data["credentials"]:
-                    return get_current_user(
-                        HTTPAuthorizationCredentials(
-                            scheme=data["credentials"]["scheme"], 
-                            credentials=data["credentials"]["credentials"]
-                        ), 
-                        db
-                    )
-                else:
-                    return None
+            # Any frame from a signed-in client counts as a heartbeat
+            if connection.user:
+                presence.touch(connection.user.id)
+
+            async def get_current_user_inner() -> UserSnapshot | None:
+                credentials = data.get("credentials")
+                return await self.authenticate(connection, credentials["credentials"] if credentials else None)
 
             if type == "ping":
-                await websocket.send_json({"type": "ping", "data": {"status": "success"}})
+                connection.send({"type": "ping", "data": {"status": "success"}})
+            elif type == "auth":
+                try:
+                    current_user = await get_current_user_inner()
+                    if not current_user:
+                        raise HTTPException(401)
+
+                    connection.send({"type": type, "data": {"status": "success", "username": current_user.username}})
+                except HTTPException as e:
+                    await self.send_error(connection, type, e)
             elif type == "getMessages":
                 try:
-                    current_user = get_current_user_inner()
+                    current_user = await get_current_user_inner()
                     if not current_user:
                         raise HTTPException(401)
 
-                    await websocket.send_json({"type": type, "data": await get_messages(current_user, db)})
+                    request: GetMessagesRequest = GetMessagesRequest.model_validate(data.get("data") or {})
+                    page = await load_messages_page(request.before, request.after, request.limit, request.conversation_id, current_user.id)
+                    response = {"status": "success", **page}
+
+                    connection.send({"type": type, "data": response})
+                except HTTPException as e:
+                    await self.send_error(connection, type, e)
+            elif type == "searchMessages":
+                try:
+                    current_user = await get_current_user_inner()
+                    if not current_user:
+                        raise HTTPException(401)
+
+                    request: SearchMessagesRequest = SearchMessagesRequest.model_validate(data["data"])
+                    response = await search_messages(request.query, request.cursor, request.limit, request.conversation_id, current_user)
+
+                    connection.send({"type": type, "data": response})
                 except HTTPException as e:
-                    await self.send_error(websocket, type, e)
+                    await self.send_error(connection, type, e)
             elif type == "sendMessage":
                 try:
-                    current_user = get_current_user_inner()
+                    current_user = await get_current_user_inner()
                     if not current_user:
                         raise HTTPException(401)
                     
                     request: SendMessageRequest = SendMessageRequest.model_validate(data["data"])
 
-                    response = await send_message(request, current_user, db)
-                    await self.broadcast({
-                        "type": "newMessage",
-                        "data": response["message"]
-                    })
-
-                    await websocket.send_json({"type": type, "data": response})
+                    response = await send_message(request, current_user)
+                    connection.send({"type": type, "data": response})
                 except HTTPException as e:
-                    await self.send_error(websocket, type, e)
+                    await self.send_error(connection, type, e)
             elif type == "editMessage":
                 try:
-                    current_user = get_current_user_inner()
+                    current_user = await get_current_user_inner()
                     if not current_user:
                         raise HTTPException(401)
                     
                     message_id = data["data"]["message_id"]
                     request: EditMessageRequest = EditMessageRequest.model_validate(data["data"])
 
-                    response = await edit_message(message_id, request, current_user, db)
-                    await self.broadcast({
-                        "type": "messageEdited",
-                        "data": response["message"]
-                    })
-
-                    await websocket.send_json({"type": type, "data": response})
+                    response = await edit_message(message_id, request, current_user)
+                    connection.send({"type": type, "data": response})
                 except HTTPException as e:
-                    await self.send_error(websocket, type, e)
+                    await self.send_error(connection, type, e)
             elif type == "deleteMessage":
                 try:
-                    current_user = get_current_user_inner()
+                    current_user = await get_current_user_inner()
                     if not current_user:
                         raise HTTPException(401)
                     
                     message_id = data["data"]["message_id"]
-                    response = await delete_message(message_id, current_user, db)
-                    await self.broadcast({
-                        "type": "messageDeleted",
-                        "data": {"message_id": message_id}
-                    })
+                    response = await delete_message(message_id, current_user)
 
-                    await websocket.send_json({"type": type, "data": response})
+                    connection.send({"type": type, "data": response})
                 except HTTPException as e:
-                    await self.send_error(websocket, type, e)
+                    await self.send_error(connection, type, e)
             elif type == "replyMessage":
                 try:
-                    current_user = get_current_user_inner()
+                    current_user = await get_current_user_inner()
                     if not current_user:
                         raise HTTPException(401)
                     
                     request: ReplyMessageRequest = ReplyMessageRequest.model_validate(data["data"])
-                    response = await reply_message(request, current_user, db)
-                    await self.broadcast({
-                        "type": "newMessage",
-                        "data": response["message"]
-                    })
+                    response = await reply_message(request, current_user)
+                    connection.send({"type": type, "data": response})
+                except HTTPException as e:
+                    await self.send_error(connection, type, e)
+            elif type == "markRead":
+                try:
+                    current_user = await get_current_user_inner()
+                    if not current_user:
+                        raise HTTPException(401)
 
-                    await websocket.send_json({"type": type, "data": response})
+                    request: MarkReadRequest = MarkReadRequest.model_validate(data["data"])
+                    response = await mark_read(request, current_user)
+                    connection.send({"type": type, "data": response})
                 except HTTPException as e:
-                    await self.send_error(websocket, type, e)
+                    await self.send_error(connection, type, e)
+            elif type == "typing":
+                # Ephemeral: after the first frame binds the connection there
+                # is no JWT decode, no database and no reply
+                try:
+                    current_user = await get_current_user_inner()
+                    if not current_user:
+                        raise HTTPException(401)
+
+                    frame = data.get("data") or {}
+                    conversation_id = frame.get("conversation_id", PUBLIC_CONVERSATION_ID)
+                    if not isinstance(conversation_id, int) or conversation_id not in connection.subscriptions:
+                        raise HTTPException(403, "Not subscribed to this conversation")
+
+                    if frame.get("typing", True):
+                        typing_tracker.start_typing(current_user, conversation_id)
+                    else:
+                        typing_tracker.stop_typing(current_user.id, conversation_id)
+                except HTTPException as e:
+                    await self.send_error(connection, type, e)
+            elif type == "subscribe" or type == "unsubscribe":
+                try:
+                    await get_current_user_inner()
+
+                    request: SubscribeRequest = SubscribeRequest.model_validate(data["data"])
+                    if type == "subscribe":
+                        await self.add_subscriptions(connection, set(request.conversation_ids))
+                    else:
+                        self.unsubscribe(connection, set(request.conversation_ids))
+
+                    connection.send({"type": type, "data": {"status": "success", "conversation_ids": sorted(connection.subscriptions)}})
+                except HTTPException as e:
+                    await self.send_error(connection, type, e)
             else:
-                await websocket.send_json({"type": type, "error": {"code": 400, "detail": "Invalid type"}})
+                connection.send({"type": type, "error": {"code": 400, "detail": "Invalid type"}})
+
+            # Unknown types share one label so clients can't create new series
+            label = type if isinstance(type, str) and type in FRAME_TYPES else "invalid"
+            websocket_frames.inc(label)
+            websocket_handler_seconds.observe(time.perf_counter() - started, label)
 
-    async def disconnect(self, websocket: WebSocket, code: int = 1000, message: str | None = None):
+    async def disconnect(self, connection: SocketConnection, code: int = 1000, message: str | None = None):
         try:
-            await websocket.close(code=code, reason=message)
+            await connection.stop()
+            await connection.websocket.close(code=code, reason=message)
         finally: 
-            self.connections.remove(websocket)
+            self.remove(connection)
     
-    async def connect(self, websocket: WebSocket, db: Session):
-        await websocket.accept()
-        self.connections.append(websocket)
+    async def resume(self, connection: SocketConnection, resume_from: int):
+        """
+        Replay the events the client missed in its conversations, or send a
+        snapshot of the newest page of each when the log can't cover the gap.
+        The connection has been held since it was accepted, so live events
+        wait until then.
+        """
         try:
-            await self.handle_connection(websocket, db)
+            subscriptions = frozenset(connection.subscriptions)
+            events, seq = await run_in_db(load_events_since, resume_from, EVENT_REPLAY_MAX, subscriptions)
+            if events is None:
+                user_id = connection.user.id if connection.user else None
+                first = [
+                    {"type": "snapshot", "data": {**await load_messages_page(conversation_id=conversation_id, user_id=user_id), "seq": seq}}
+                    for conversation_id in sorted(subscriptions)
+                ]
+            else:
+                first = [*events, {"type": "resumed", "data": {"seq": seq, "replayed": len(events)}}]
+        except Exception:
+            connection.release([], 0)
+            raise
+
+        connection.release(first, seq)
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        token: str | None = None,
+        resume_from: int | None = None,
+        conversations: str | None = None
+    ):
+        codec = negotiate(websocket)
+        await websocket.accept(subprotocol=codec.subprotocol)
+        connection = SocketConnection(websocket, codec)
+        if resume_from is not None:
+            connection.hold()
+        connection.start()
+        self.connections.append(connection)
+        self.subscribe(connection, connection.subscriptions)
+        try:
+            if token:
+                try:
+                    await self.authenticate(connection, token)
+                except HTTPException as e:
+                    await self.send_error(connection, "auth", e)
+            if conversations:
+                try:
+                    await self.add_subscriptions(connection, parse_conversation_ids(conversations))
+                except HTTPException as e:
+                    await self.send_error(connection, "subscribe", e)
+            if resume_from is not None:
+                await self.resume(connection, resume_from)
+            await self.handle_connection(connection)
         except WebSocketDisconnect as e:
             logger.info(f"WebSocket disconnected with code {e.code}: {e.reason}")
         finally:
-            self.connections.remove(websocket)
+            await connection.stop()
+            self.unbind(connection)
+            self.remove(connection)
 
     async def broadcast(self, message: dict):
-        for websocket in self.connections:
-            await websocket.send_json(message)
+        # Goes through the backplane so clients of every worker get it
+        await backplane.publish(BROADCAST_CHANNEL, message)
+
+    def deliver(self, message: dict):
+        # Encoded once per codec on first send, then shared by every connection
+        if message["type"] in ("newMessage", "messageEdited"):
+            message = {**message, "data": message_payloads.get(message["data"])}
+        prepared = PreparedEvent(message)
+
+        # Conversation events go to its subscribers, the rest to everyone
+        conversation_id = message.get("conversation_id")
+        connections = self.connections if conversation_id is None else self.subscribers.get(conversation_id, ())
+
+        # Only enqueues, each connection's writer task does the sending
+        with broadcast_fanout_seconds.time(message["type"]):
+            for connection in list(connections):
+                connection.send(prepared)
+
+    def stats(self) -> list[dict]:
+        return [connection.stats() for connection in self.connections]
+
+    def connection_counts(self) -> dict[tuple[str, str], int]:
+        counts = Counter((connection.codec.name, "true" if connection.user else "false") for connection in self.connections)
+        # Keep every series present when a kind has no connections
+        for protocol in ("json", "msgpack"):
+            for authenticated in ("true", "false"):
+                counts.setdefault((protocol, authenticated), 0)
+        return counts
 
 messagingManager = MessaggingSocketManager()
+backplane.subscribe(BROADCAST_CHANNEL, messagingManager.deliver)
+backplane.subscribe(TYPING_CHANNEL, messagingManager.deliver)
+backplane.subscribe(MEMBERSHIP_CHANNEL, messagingManager.apply_membership)
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: messagingManager.unbind_user(user["id"]))
+backplane.subscribe(BROADCAST_CHANNEL, hot_history.apply_event)
+backplane.subscribe(BROADCAST_CHANNEL, message_payloads.apply_event)
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: hot_history.remove_user(user["username"]))
+backplane.subscribe(PROFILE_UPDATED_CHANNEL, lambda user: hot_history.update_user(user["username"], user["profile_picture"]))
+backplane.subscribe(PROFILE_UPDATED_CHANNEL, lambda user: message_payloads.invalidate_user(user["username"]))
+registry.register(Gauge(
+    "fromchat_websocket_connections", "Open WebSocket connections on this worker",
+    messagingManager.connection_counts, ("protocol", "authenticated")
+))
+presence.subscribe(lambda users: messagingManager.deliver({"type": "presenceChanged", "data": {"users": users}}))
 
 @router.websocket("/chat/ws")
 async def chat_websocket(
     websocket: WebSocket,
-    db: Session = Depends(get_db)
+    token: str | None = None,
+    resume_from: int | None = None,
+    conversations: str | None = None
 ):
-    await messagingManager.connect(websocket, db)
\ No newline at end of file
+    await messagingManager.connect(websocket, token, resume_from, conversations)
+
+
+@router.get("/admin/ws/stats")
+async def websocket_stats(current_user: UserSnapshot = Depends(get_current_user)):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    return {"status": "success", "connections": messagingManager.stats()}
+
+
+@router.get("/admin/history_cache/stats")
+async def history_cache_stats(current_user: UserSnapshot = Depends(get_current_user)):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    return {"status": "success", "cache": hot_history.stats()}
+
+
+@router.get("/admin/payload_cache/stats")
+async def payload_cache_stats(current_user: UserSnapshot = Depends(get_current_user)):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    return {"status": "success", "cache": message_payloads.stats()}
@@ -1,26 +1,68 @@
+from datetime import datetime
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, UploadFile, File
 from sqlalchemy.orm import Session
-from PIL import Image
-import os
-import uuid
-import io
+import asyncio
 
-from dependencies import get_db, get_current_user
-from models import User, UpdateBioRequest, UserProfileResponse
+from avatars import AVATAR_CACHE_CONTROL, PROFILE_PICTURES_DIR, avatar_cache, avatar_etag, etag_matches
+from backplane import PROFILE_UPDATED_CHANNEL, backplane
+from constants import OWNER_USERNAME, PRESENCE_QUERY_MAX_SIZE, PROFILE_PICTURE_MAX_BYTES
+from db import run_in_db
+from dependencies import UserSnapshot, get_current_user
+from images import (
+    PROFILE_PICTURE_DEFAULT_FORMAT,
+    PROFILE_PICTURE_DEFAULT_SIZE,
+    PROFILE_PICTURE_FORMATS,
+    PROFILE_PICTURE_SIZES,
+    image_pool,
+    read_upload,
+    render_profile_picture,
+    rendition_filename
+)
+from models import PresenceRequest, User, UpdateBioRequest, UserProfileResponse
+from presence import presence
+from writer import db_writer
 
 router = APIRouter()
 
-# Create uploads directory if it doesn't exist
-PROFILE_PICTURES_DIR = Path("data/uploads/pfp")
 
-os.makedirs(PROFILE_PICTURES_DIR, exist_ok=True)
+def set_profile_picture(db: Session, user_id: int, profile_picture_url: str):
+    db.query(User).filter(User.id == user_id).update({User.profile_picture: profile_picture_url})
+
+
+def set_bio(db: Session, user_id: int, bio: str):
+    db.query(User).filter(User.id == user_id).update({User.bio: bio})
+
+
+def read_profile_picture(filename: str, rendition: str, format: str) -> tuple[bytes, str]:
+    try:
+        return (PROFILE_PICTURES_DIR / rendition).read_bytes(), PROFILE_PICTURE_FORMATS[format][2]
+    except FileNotFoundError:
+        pass
+    
+    # Pictures uploaded before renditions existed only have the default one
+    try:
+        return (PROFILE_PICTURES_DIR / filename).read_bytes(), "image/jpeg"
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile picture not found")
+
+
+def find_user(db: Session, username: str) -> User | None:
+    return db.query(User).filter(User.username == username).first()
+
+
+def get_user(db: Session, user_id: int) -> User | None:
+    return db.get(User, user_id)
+
+
+def find_last_seen(db: Session, usernames: list[str]) -> list[tuple[int, str, datetime]]:
+    return db.query(User.id, User.username, User.last_seen).filter(User.username.in_(usernames)).all()
+
 
 @router.post("/upload-profile-picture")
 async def upload_profile_picture(
     profile_picture: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """
     Upload and process a profile picture
@@ -29,81 +71,101 @@ async def upload_profile_picture(
     if not profile_picture.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Validate file size (max 5MB)
-    if profile_picture.size > 5 * 1024 * 1024:
+    # Reject early when the client declared the size, read_upload enforces it anyway
+    if profile_picture.size is not None and profile_picture.size > PROFILE_PICTURE_MAX_BYTES:
         raise HTTPException(status_code=400, detail="File size must be less than 5MB")
     
+    image_data = await read_upload(profile_picture)
+    
     try:
-        # Read and process the image
-        image_data = await profile_picture.read()
-        
-        # Open image with PIL
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize to a reasonable size (200x200)
-        image.thumbnail((200, 200), Image.Resampling.LANCZOS)
-        
-        # Generate unique filename
-        filename = f"{current_user.id}_{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(PROFILE_PICTURES_DIR, filename)
-        
-        # Save the processed image
-        image.save(filepath, 'JPEG', quality=85)
-        
-        # Update user's profile picture in database
-        profile_picture_url = f"/api/profile-picture/{filename}"
-        current_user.profile_picture = profile_picture_url
-        db.commit()
-        
-        return {
-            "message": "Profile picture uploaded successfully",
-            "profile_picture_url": profile_picture_url
-        }
-        
+        # Decoding and encoding happen in a worker process, off the event loop
+        filename = await image_pool.run(render_profile_picture, image_data, str(PROFILE_PICTURES_DIR))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    
+    # Update user's profile picture in database
+    profile_picture_url = f"/api/profile-picture/{filename}"
+    await db_writer.submit(set_profile_picture, current_user.id, profile_picture_url)
+    # Cached messages of every worker still carry the old picture
+    await backplane.publish(PROFILE_UPDATED_CHANNEL, {
+        "id": current_user.id,
+        "username": current_user.username,
+        "profile_picture": profile_picture_url
+    })
+    
+    return {
+        "message": "Profile picture uploaded successfully",
+        "profile_picture_url": profile_picture_url,
+        "renditions": {
+            size: {format: f"{profile_picture_url}?size={size}&format={format}" for format in PROFILE_PICTURE_FORMATS}
+            for size in PROFILE_PICTURE_SIZES
+        }
+    }
 
 @router.get("/profile-picture/{filename}")
-async def get_profile_picture(filename: str):
+async def get_profile_picture(
+    filename: str,
+    size: int = PROFILE_PICTURE_DEFAULT_SIZE,
+    format: str = PROFILE_PICTURE_DEFAULT_FORMAT,
+    if_none_match: str | None = Header(default=None)
+):
     """
-    Serve profile picture files
+    Serve profile picture files, optionally a smaller size or WebP rendition
     """
-    filepath = os.path.join(PROFILE_PICTURES_DIR, filename)
+    if size not in PROFILE_PICTURE_SIZES or format not in PROFILE_PICTURE_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported profile picture size or format")
     
-    if not os.path.exists(filepath):
+    if Path(filename).name != filename or not filename.endswith(".jpg"):
         raise HTTPException(status_code=404, detail="Profile picture not found")
     
-    from fastapi.responses import FileResponse
-    return FileResponse(filepath, media_type="image/jpeg")
+    rendition = rendition_filename(filename, size, format)
+    headers = {"ETag": avatar_etag(rendition), "Cache-Control": AVATAR_CACHE_CONTROL}
+    
+    # File names never get reused for other content, so the browser's copy is still valid
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    cached = avatar_cache.get(rendition)
+    if cached is None:
+        cached = await asyncio.to_thread(read_profile_picture, filename, rendition, format)
+        avatar_cache.put(rendition, *cached)
+    
+    data, media_type = cached
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@router.get("/admin/avatar_cache/stats")
+async def avatar_cache_stats(current_user: UserSnapshot = Depends(get_current_user)):
+    if current_user.username != OWNER_USERNAME:
+        raise HTTPException(status_code=403, detail="Only owner can perform this action")
+
+    return {"status": "success", "cache": avatar_cache.stats()}
 
 @router.get("/user/profile")
 async def get_user_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """
     Get current user's profile information
     """
+    user = await run_in_db(get_user, current_user.id)
+
     return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "profile_picture": current_user.profile_picture,
-        "bio": current_user.bio,
-        "online": current_user.online,
-        "last_seen": current_user.last_seen,
-        "created_at": current_user.created_at
+        "id": user.id,
+        "username": user.username,
+        "profile_picture": user.profile_picture,
+        "bio": user.bio,
+        "online": presence.is_online(user.id),
+        "last_seen": presence.last_seen(user.id, user.last_seen),
+        "created_at": user.created_at
     }
 
 
 @router.put("/user/bio")
 async def update_user_bio(
     request: UpdateBioRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """
     Update current user's bio
@@ -111,24 +173,21 @@ async def update_user_bio(
     if len(request.bio) > 500:  # Limit bio to 500 characters
         raise HTTPException(status_code=400, detail="Bio must be 500 characters or less")
     
-    current_user.bio = request.bio.strip()
-    db.commit()
+    bio = request.bio.strip()
+    await db_writer.submit(set_bio, current_user.id, bio)
     
     return {
         "message": "Bio updated successfully",
-        "bio": current_user.bio
+        "bio": bio
     }
 
 
 @router.get("/user/{username}")
-async def get_user_by_username(
-    username: str,
-    db: Session = Depends(get_db)
-):
+async def get_user_by_username(username: str):
     """
     Get user profile by username
     """
-    user = db.query(User).filter(User.username == username).first()
+    user = await run_in_db(find_user, username)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -138,7 +197,32 @@ async def get_user_by_username(
         username=user.username,
         profile_picture=user.profile_picture,
         bio=user.bio,
-        online=user.online,
-        last_seen=user.last_seen,
+        online=presence.is_online(user.id),
+        last_seen=presence.last_seen(user.id, user.last_seen),
         created_at=user.created_at
     )
+
+
+@router.post("/users/presence")
+async def get_users_presence(request: PresenceRequest):
+    """
+    Online state and last seen time of several users at once
+    """
+    if len(request.usernames) > PRESENCE_QUERY_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {PRESENCE_QUERY_MAX_SIZE} usernames per request")
+    
+    usernames = list(dict.fromkeys(request.usernames))
+    
+    # Only users nobody has seen since startup need the database
+    unknown = [username for username in usernames if presence.find(username) is None]
+    if unknown:
+        for user_id, username, last_seen in await run_in_db(find_last_seen, unknown):
+            presence.remember(user_id, username, last_seen)
+    
+    return {
+        "users": [
+            presence.presence(user_id)
+            for user_id in (presence.find(username) for username in usernames)
+            if user_id is not None
+        ]
+    }
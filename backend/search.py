@@ -0,0 +1,129 @@
+"""
+Full-text search over message content, backed by an SQLite FTS5 index.
+
+The index is an external-content FTS5 table over `message`, kept in sync by
+triggers, so every write path (group commits, bulk deletes, raw SQL) updates
+it. Messages written before the index existed are indexed when it is
+created. To rebuild it by hand:
+
+    python search.py rebuild
+"""
+import html
+import re
+import sys
+
+from fastapi import HTTPException
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.orm import Session
+
+from constants import PUBLIC_CONVERSATION_ID
+
+SEARCH_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+        content,
+        content='message',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """
+]
+
+# Stand-ins for <mark> until the snippet has been HTML-escaped
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+
+def ensure_search_index(connection: Connection):
+    created = not connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'message_fts'")).first()
+    for statement in SEARCH_SCHEMA:
+        connection.execute(text(statement))
+
+    # The delete and update triggers need every existing row in the index,
+    # removing one that isn't there corrupts it
+    if created:
+        connection.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+
+
+def rebuild_search_index(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+        connection.execute(text("INSERT INTO message_fts(message_fts) VALUES ('optimize')"))
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn user input into a safe FTS5 query: every word must match, the last
+    one as a prefix so results show up while the user is still typing.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def format_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def search_message_ids(
+    db: Session,
+    query: str,
+    limit: int,
+    after: tuple[float, int] | None = None,
+    conversation_id: int = PUBLIC_CONVERSATION_ID
+) -> tuple[list[tuple[int, float, str]], bool]:
+    """
+    Best matches in one conversation first, ordered by (bm25 rank, id) so
+    `after` can continue where the previous page stopped. Returns
+    (id, rank, snippet) rows.
+    """
+    # CROSS JOIN keeps the index lookup outermost, SQLite would otherwise
+    # scan the conversation and run the full-text query per message
+    sql = f"""
+        SELECT message_fts.rowid, rank, snippet(message_fts, 0, '{_MARK_START}', '{_MARK_END}', '…', 12)
+        FROM message_fts
+        CROSS JOIN message ON message.id = message_fts.rowid
+        WHERE message_fts MATCH :query AND message.conversation_id = :conversation_id
+            {"AND (rank, message_fts.rowid) > (:rank, :id)" if after else ""}
+        ORDER BY rank, message_fts.rowid
+        LIMIT :limit
+    """
+    params = {"query": build_match_query(query), "conversation_id": conversation_id, "limit": limit + 1}
+    if after:
+        params["rank"], params["id"] = after
+
+    rows = db.execute(text(sql), params).all()
+    return [(id, rank, format_snippet(snippet)) for id, rank, snippet in rows[:limit]], len(rows) > limit
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("Usage: python search.py rebuild")
+
+    from db import engine
+    from migrations import migrate
+
+    migrate(engine)
+
+    rebuild_search_index(engine)
+    print("Search index rebuilt")
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The app keeps its database and uploads under ./data, so the tests get a
+# throwaway working directory before anything opens them
+os.chdir(tempfile.mkdtemp(prefix="fromchat-tests-"))
+os.environ.setdefault("JWT_SECRET", "test-secret-not-for-production")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
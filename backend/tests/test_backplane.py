@@ -0,0 +1,96 @@
+"""
+The Unix socket backplane keeps delivering when the broker connection
+breaks, a frame is bad or a worker stops reading.
+"""
+import asyncio
+import struct
+
+import pytest
+
+from backplane import UnixSocketBackplane
+
+
+@pytest.fixture
+def socket_path(tmp_path) -> str:
+    return str(tmp_path / "backplane.sock")
+
+
+async def started(path: str, **kwargs) -> tuple[UnixSocketBackplane, asyncio.Queue]:
+    backplane = UnixSocketBackplane(path, reconnect_delay=0.05, **kwargs)
+    received = asyncio.Queue()
+    backplane.subscribe("test", received.put_nowait)
+    await backplane.start()
+    assert backplane.is_broker
+    return backplane, received
+
+
+async def wait_until(condition, timeout: float = 2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def test_publish_delivers_locally_when_the_broker_connection_breaks(socket_path):
+    class BrokenWriter:
+        def write(self, data: bytes):
+            pass
+
+        async def drain(self):
+            raise ConnectionResetError("Connection lost")
+
+        def close(self):
+            pass
+
+    async def run():
+        backplane, received = await started(socket_path)
+        try:
+            backplane._writer = BrokenWriter()
+            await backplane.publish("test", "local")
+            return received.get_nowait()
+        finally:
+            await backplane.stop()
+
+    assert asyncio.run(run()) == "local"
+
+
+def test_bad_frame_reconnects(socket_path):
+    async def run():
+        backplane, received = await started(socket_path)
+        try:
+            _, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(struct.pack("!I", 3) + b"{{{")
+            await writer.drain()
+
+            await wait_until(lambda: not backplane._connected.is_set())
+            await wait_until(backplane._connected.is_set)
+            assert not backplane._client_task.done()
+
+            await backplane.publish("test", "after reconnect")
+            writer.close()
+            return await asyncio.wait_for(received.get(), 2)
+        finally:
+            await backplane.stop()
+
+    assert asyncio.run(run()) == "after reconnect"
+
+
+def test_broker_drops_a_peer_that_stops_reading(socket_path):
+    async def run():
+        backplane, received = await started(socket_path, peer_buffer_limit=1024 * 1024)
+        try:
+            # Connects and never reads
+            _, stalled = await asyncio.open_unix_connection(socket_path)
+            await wait_until(lambda: len(backplane._peers) == 2)
+
+            for _ in range(100):
+                await backplane.publish("test", "x" * 64 * 1024)
+            await wait_until(lambda: len(backplane._peers) == 1)
+
+            # The workers that do read still get everything
+            for _ in range(100):
+                await asyncio.wait_for(received.get(), 2)
+            stalled.close()
+        finally:
+            await backplane.stop()
+
+    asyncio.run(run())
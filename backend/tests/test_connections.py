@@ -0,0 +1,59 @@
+"""
+Slow consumer handling of SocketConnection: events held back during a resume
+are bounded like the outbound queue and follow the same policy.
+"""
+import asyncio
+
+from connections import POLICY_DISCONNECT, POLICY_DROP_OLDEST, SocketConnection
+
+QUEUE_SIZE = 4
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.closed_with: tuple[int, str] | None = None
+
+    async def close(self, code: int, reason: str):
+        self.closed_with = (code, reason)
+
+
+def event(seq: int) -> dict:
+    return {"type": "newMessage", "seq": seq, "data": {"id": seq}}
+
+
+def queued(connection: SocketConnection) -> list[int]:
+    seqs = []
+    while not connection.queue.empty():
+        seqs.append(connection.queue.get_nowait().event["seq"])
+    return seqs
+
+
+def test_held_events_drop_oldest():
+    connection = SocketConnection(FakeWebSocket(), queue_size=QUEUE_SIZE, policy=POLICY_DROP_OLDEST)
+    connection.hold()
+    for seq in range(1, 11):
+        assert connection.send(event(seq))
+    # Dropped while held, not only once released into the queue
+    assert connection.dropped == 6
+
+    connection.release([], 0)
+
+    assert queued(connection) == [7, 8, 9, 10]
+    assert connection.dropped == 6
+
+
+def test_held_events_disconnect():
+    async def run():
+        websocket = FakeWebSocket()
+        connection = SocketConnection(websocket, queue_size=QUEUE_SIZE, policy=POLICY_DISCONNECT)
+        connection.hold()
+        sent = [connection.send(event(seq)) for seq in range(1, QUEUE_SIZE + 2)]
+
+        assert connection.closed
+        await connection._close_task
+        return sent, websocket.closed_with
+
+    sent, closed_with = asyncio.run(run())
+
+    assert sent == [True] * QUEUE_SIZE + [False]
+    assert closed_with == (1013, "Too slow")
@@ -0,0 +1,195 @@
+"""
+The event log behind resumable sessions: replays after a seq, compaction
+that keeps a created message a newMessage, and the snapshot or 410 once the
+log no longer reaches back far enough.
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from connections import SocketConnection
+from constants import PUBLIC_CONVERSATION_ID
+from db import SessionLocal
+from event_log import compact_event_log, latest_seq, load_events_since, record_deletions, record_event, set_trimmed_through
+from main import app
+from migrations import migrate
+from routes.messaging import messagingManager
+
+# Not a real conversation, keeps these events apart from the public room
+CONVERSATION_ID = 4242
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    migrate()
+
+
+def message(message_id: int, content: str) -> dict:
+    return {"id": message_id, "content": content}
+
+
+def log(*events: tuple[str, int, dict], conversation_id: int = CONVERSATION_ID) -> list[dict]:
+    with SessionLocal() as db:
+        recorded = [record_event(db, type, message_id, data, conversation_id) for type, message_id, data in events]
+        db.commit()
+    return recorded
+
+
+def replay(seq: int, limit: int = 100, conversation_ids: set[int] = frozenset({CONVERSATION_ID})) -> tuple[list[dict] | None, int]:
+    with SessionLocal() as db:
+        return load_events_since(db, seq, limit, conversation_ids)
+
+
+def current_seq() -> int:
+    with SessionLocal() as db:
+        return latest_seq(db)
+
+
+def compact():
+    with SessionLocal() as db:
+        compact_event_log(db)
+        db.commit()
+
+
+def test_replays_events_after_seq_in_order():
+    recorded = log(
+        ("newMessage", 101, message(101, "one")),
+        ("newMessage", 102, message(102, "two")),
+        ("messageEdited", 101, message(101, "one, edited"))
+    )
+
+    events, seq = replay(recorded[0]["seq"])
+    assert events == recorded[1:]
+    assert seq == recorded[-1]["seq"]
+
+
+def test_replay_only_includes_requested_conversations():
+    start = current_seq()
+    log(("newMessage", 111, message(111, "elsewhere")), conversation_id=CONVERSATION_ID + 1)
+    recorded = log(("newMessage", 112, message(112, "here")))
+
+    events, _ = replay(start)
+    assert events == recorded
+
+
+def test_replay_past_the_limit_is_none():
+    start = current_seq()
+    log(
+        ("newMessage", 121, message(121, "one")),
+        ("newMessage", 122, message(122, "two"))
+    )
+
+    events, seq = replay(start, limit=1)
+    assert events is None
+    assert seq == current_seq()
+
+
+def test_compaction_keeps_an_edited_message_a_new_message():
+    start = current_seq()
+    created, _, edited = log(
+        ("newMessage", 131, message(131, "draft")),
+        ("messageEdited", 131, message(131, "first edit")),
+        ("messageEdited", 131, message(131, "final"))
+    )
+    compact()
+
+    # A client that never saw the message gets it, with the edited content
+    events, _ = replay(start)
+    assert events == [{**edited, "type": "newMessage"}]
+    # One that did replaces it, the event is an upsert
+    events, _ = replay(created["seq"])
+    assert events == [{**edited, "type": "newMessage"}]
+
+
+def test_compaction_keeps_edits_of_messages_created_before_the_log():
+    start = current_seq()
+    (edited,) = log(("messageEdited", 141, message(141, "edited")))
+    compact()
+
+    events, _ = replay(start)
+    assert events == [edited]
+
+
+def test_compaction_keeps_deletions():
+    start = current_seq()
+    log(
+        ("newMessage", 151, message(151, "gone")),
+        ("messageEdited", 151, message(151, "gone soon"))
+    )
+    with SessionLocal() as db:
+        deleted = record_deletions(db, [151], CONVERSATION_ID)
+        db.commit()
+    compact()
+
+    events, _ = replay(start)
+    assert events == [{"type": "messageDeleted", "seq": deleted["seq"], "conversation_id": CONVERSATION_ID, "data": {"message_id": 151}}]
+
+
+def resume(connection: SocketConnection, resume_from: int, live: list[dict]) -> list[dict]:
+    async def run():
+        connection.hold()
+        # Broadcasts that arrive while the replay is loaded wait for it
+        for event in live:
+            connection.send(event)
+        await messagingManager.resume(connection, resume_from)
+
+    asyncio.run(run())
+    sent = []
+    while not connection.queue.empty():
+        sent.append(connection.queue.get_nowait().event)
+    return sent
+
+
+def test_resume_sends_replay_before_held_events():
+    start = current_seq()
+    replayed = log(
+        ("newMessage", 161, message(161, "missed")),
+        ("messageEdited", 161, message(161, "missed, edited"))
+    )
+    live = [
+        # Already part of the replay
+        replayed[-1],
+        {"type": "typing", "data": {"users": []}},
+        {"type": "newMessage", "seq": replayed[-1]["seq"] + 1, "conversation_id": CONVERSATION_ID, "data": message(162, "live")}
+    ]
+
+    connection = SocketConnection(None)
+    connection.subscriptions = {CONVERSATION_ID}
+    sent = resume(connection, start, live)
+
+    assert sent == [
+        *replayed,
+        {"type": "resumed", "data": {"seq": replayed[-1]["seq"], "replayed": 2}},
+        *live[1:]
+    ]
+
+
+def test_resume_falls_back_to_a_snapshot_once_trimmed():
+    (event,) = log(("newMessage", 171, message(171, "trimmed")))
+    with SessionLocal() as db:
+        set_trimmed_through(db, event["seq"])
+        db.commit()
+    live = {"type": "newMessage", "seq": event["seq"] + 1, "conversation_id": CONVERSATION_ID, "data": message(172, "live")}
+
+    sent = resume(SocketConnection(None), event["seq"] - 1, [live])
+
+    assert [item["type"] for item in sent] == ["snapshot", "newMessage"]
+    assert sent[0]["data"]["seq"] == event["seq"]
+    assert sent[1] == live
+
+
+def test_events_endpoint():
+    client = TestClient(app)
+    start = current_seq()
+    (event,) = log(("newMessage", 181, message(181, "public")), conversation_id=PUBLIC_CONVERSATION_ID)
+
+    response = client.get("/events", params={"after": start})
+    assert response.status_code == 200
+    assert response.json()["events"] == [event]
+
+    with SessionLocal() as db:
+        set_trimmed_through(db, event["seq"])
+        db.commit()
+    response = client.get("/events", params={"after": start})
+    assert response.status_code == 410
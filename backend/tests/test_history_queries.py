@@ -0,0 +1,89 @@
+"""
+History pages are serialized from one SELECT that eager-loads authors and
+quoted messages, however many messages and authors the page has.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from db import SessionLocal, engine
+from history_cache import message_key
+from migrations import migrate
+from models import Message, User
+from routes.messaging import query_messages_page
+
+PAGE_SIZE = 50
+
+
+@contextmanager
+def count_selects():
+    statements = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        # BEGIN and friends depend on the session, not on the page
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def history():
+    migrate()
+    with SessionLocal() as db:
+        users = [User(username=f"user{i}", password_hash="x", profile_picture=f"/api/profile-picture/{i}.jpg") for i in range(10)]
+        db.add_all(users)
+        db.flush()
+
+        start = datetime.now() - timedelta(hours=1)
+        previous = None
+        for i in range(3 * PAGE_SIZE):
+            message = Message(
+                content=f"message {i}",
+                user_id=users[i % len(users)].id,
+                timestamp=start + timedelta(seconds=i),
+                reply_to_id=previous.id if previous and i % 3 == 0 else None
+            )
+            db.add(message)
+            db.flush()
+            previous = message
+        db.commit()
+
+
+def test_newest_page_is_one_select():
+    with SessionLocal() as db, count_selects() as statements:
+        messages, has_more = query_messages_page(db, None, None, PAGE_SIZE)
+
+    assert len(messages) == PAGE_SIZE and has_more
+    assert any(message["reply_to"] for message in messages)
+    assert len(statements) == 1
+
+
+def test_older_page_is_one_select():
+    with SessionLocal() as db:
+        newest, _ = query_messages_page(db, None, None, PAGE_SIZE)
+
+    with SessionLocal() as db, count_selects() as statements:
+        messages, _ = query_messages_page(db, message_key(newest[0]), None, PAGE_SIZE)
+
+    assert len(messages) == PAGE_SIZE
+    assert len(statements) == 1
+
+
+def test_get_messages_is_one_select():
+    # Without the lifespan the hot history stays cold, so the page comes from SQLite
+    from app import app
+
+    with count_selects() as statements:
+        response = TestClient(app).get("/get_messages", params={"limit": PAGE_SIZE})
+
+    assert response.status_code == 200
+    assert len(response.json()["messages"]) == PAGE_SIZE
+    assert len(statements) == 1
@@ -0,0 +1,76 @@
+"""
+Concurrent writes must not stall the event loop: the database work runs on
+the DB thread pool, so a probe that sleeps 1 ms keeps waking up on time
+while many clients send messages at once.
+
+benchmarks/loop_stall.py runs the same probe at a larger scale.
+"""
+import asyncio
+import statistics
+from collections import Counter
+
+import httpx
+
+from benchmarks.loop_stall import probe
+from db import SessionLocal
+from main import app
+from migrations import migrate
+from models import User
+from rate_limit import rate_limiter
+from utils import create_token
+from writer import db_writer
+
+CLIENTS = 20
+MESSAGES = 10
+
+# Commits on the loop stall it for 70 ms and more per batch, with the thread
+# pool the worst wake-ups stay around 20 ms
+STALL_P99_LIMIT = 0.035
+STALL_MAX_LIMIT = 0.06
+
+
+async def send_concurrently() -> tuple[Counter, list[float]]:
+    # ASGITransport doesn't run the lifespan
+    migrate()
+    with SessionLocal() as db:
+        user = User(username="loop-stall", password_hash="x")
+        db.add(user)
+        db.commit()
+        headers = {"Authorization": f"Bearer {create_token(user.id, user.username)}"}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        statuses: Counter[int] = Counter()
+
+        async def writer(index: int):
+            for i in range(MESSAGES):
+                response = await client.post("/send_message", json={"content": f"{index}:{i}"}, headers=headers)
+                statuses[response.status_code] += 1
+
+        # The first request pays for imports and caches, that isn't a stall
+        await client.post("/send_message", json={"content": "warm up"}, headers=headers)
+
+        stalls: list[float] = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(stalls, stop))
+        try:
+            await asyncio.gather(*(writer(i) for i in range(CLIENTS)))
+        finally:
+            stop.set()
+            await probe_task
+            await db_writer.stop()
+
+    stalls.sort()
+    return statuses, stalls
+
+
+def test_concurrent_sends_do_not_stall_the_loop(monkeypatch):
+    # Every writer is the same user, measure the loop rather than the rate limits
+    monkeypatch.setitem(rate_limiter.limits, "send", (1e6, 1e6))
+
+    statuses, stalls = asyncio.run(send_concurrently())
+
+    assert statuses == {200: CLIENTS * MESSAGES}
+    p99 = stalls[int(len(stalls) * 0.99)]
+    assert p99 < STALL_P99_LIMIT, f"p99 stall {p99 * 1000:.1f} ms, median {statistics.median(stalls) * 1000:.1f} ms"
+    assert stalls[-1] < STALL_MAX_LIMIT, f"max stall {stalls[-1] * 1000:.1f} ms"
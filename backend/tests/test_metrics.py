@@ -0,0 +1,18 @@
+"""
+HTTP request metrics keep a bounded set of label values whatever clients send.
+"""
+from fastapi.testclient import TestClient
+
+from main import app
+from metrics import registry
+
+
+def test_unknown_methods_and_paths_share_labels():
+    client = TestClient(app)
+    for method in ("PROPFIND", "BREW", "X-ANYTHING"):
+        client.request(method, "/no-such-route")
+
+    rendered = registry.render()
+    assert 'method="other",route="unmatched"' in rendered
+    for method in ("PROPFIND", "BREW", "X-ANYTHING"):
+        assert f'method="{method}"' not in rendered
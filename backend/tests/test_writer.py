@@ -0,0 +1,109 @@
+"""
+The group commit writer: concurrent writes share one transaction, a failing
+write only rolls back its own SAVEPOINT, and stopping the writer resolves
+every caller.
+"""
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from db import SessionLocal, engine
+from migrations import migrate
+from models import Message, User
+from writer import GroupCommitWriter
+
+WRITES = 10
+
+
+@pytest.fixture(scope="module")
+def user_id() -> int:
+    migrate()
+    with SessionLocal() as db:
+        user = User(username="writer", password_hash="x")
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+def add_message(db, user_id: int, content: str) -> int:
+    message = Message(content=content, user_id=user_id)
+    db.add(message)
+    db.flush()
+    return message.id
+
+
+def add_message_and_fail(db, user_id: int, content: str):
+    add_message(db, user_id, content)
+    raise ValueError("Rejected")
+
+
+def stored_contents(ids: list[int]) -> list[str]:
+    with SessionLocal() as db:
+        return [content for (content,) in db.query(Message.content).filter(Message.id.in_(ids)).order_by(Message.id)]
+
+
+def test_concurrent_writes_commit_once(user_id):
+    commits = []
+
+    def count_commit(connection):
+        commits.append(connection)
+
+    event.listen(engine, "commit", count_commit)
+
+    async def run():
+        writer = GroupCommitWriter(window=0.05)
+        try:
+            return await asyncio.gather(
+                *(writer.submit(add_message, user_id, f"batch {i}") for i in range(WRITES)),
+                writer.submit(add_message_and_fail, user_id, "failed"),
+                return_exceptions=True
+            )
+        finally:
+            await writer.stop()
+
+    try:
+        *ids, error = asyncio.run(run())
+    finally:
+        event.remove(engine, "commit", count_commit)
+
+    assert len(commits) == 1
+    assert isinstance(error, ValueError)
+    assert all(isinstance(message_id, int) for message_id in ids)
+    assert len(set(ids)) == WRITES
+    # Every caller got the id of its own message, the failed one was rolled back
+    assert stored_contents(ids) == [f"batch {i}" for i in range(WRITES)]
+    with SessionLocal() as db:
+        assert db.query(Message).filter(Message.content == "failed").count() == 0
+
+
+def test_stop_finishes_the_batch_and_fails_the_queue(user_id):
+    applying = threading.Event()
+    release = threading.Event()
+
+    def add_message_slowly(db, user_id: int, content: str) -> int:
+        applying.set()
+        release.wait(5)
+        return add_message(db, user_id, content)
+
+    async def run():
+        writer = GroupCommitWriter(window=0, max_size=1)
+        committed = asyncio.ensure_future(writer.submit(add_message_slowly, user_id, "committed on stop"))
+        queued = asyncio.ensure_future(writer.submit(add_message, user_id, "never written"))
+
+        await asyncio.get_running_loop().run_in_executor(None, applying.wait, 5)
+        stopping = asyncio.ensure_future(writer.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await stopping
+
+        # Without the drain both would wait forever
+        return await asyncio.wait_for(asyncio.gather(committed, queued, return_exceptions=True), 5)
+
+    message_id, error = asyncio.run(run())
+
+    assert stored_contents([message_id]) == ["committed on stop"]
+    assert isinstance(error, RuntimeError)
+    with SessionLocal() as db:
+        assert db.query(Message).filter(Message.content == "never written").count() == 0
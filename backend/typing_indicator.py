@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+
+from backplane import TYPING_CHANNEL, USER_DELETED_CHANNEL, backplane
+from constants import PUBLIC_CONVERSATION_ID, TYPING_COALESCE_WINDOW, TYPING_THROTTLE, TYPING_TIMEOUT
+from dependencies import UserSnapshot
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class TypingTracker:
+    """
+    Who is typing, in memory only: typing frames never reach the database
+    or the event log, and they aren't replayed to reconnecting clients.
+
+    A user's typing frames are accepted at most once per `throttle` seconds
+    and conversation, the rest are dropped. Changes collected during `window`
+    go out as one `typing` event per conversation, and a user who stops
+    sending frames stops typing after `timeout`. The event carries the
+    timeout so clients can expire typists themselves if the worker that
+    tracks them goes away.
+    """
+
+    def __init__(self, throttle: float = TYPING_THROTTLE, window: float = TYPING_COALESCE_WINDOW, timeout: float = TYPING_TIMEOUT) -> None:
+        self.throttle = throttle
+        self.window = window
+        self.timeout = timeout
+        # (user id, conversation id) -> (username, when it was last accepted)
+        self._typing: dict[tuple[int, int], tuple[str, float]] = {}
+        # (conversation id, username) -> typing, waiting for the next event
+        self._pending: dict[tuple[int, str], bool] = {}
+        self._task: asyncio.Task | None = None
+
+    def start_typing(self, user: UserSnapshot, conversation_id: int = PUBLIC_CONVERSATION_ID):
+        now = time.monotonic()
+        key = (user.id, conversation_id)
+        typing = self._typing.get(key)
+        if typing and now - typing[1] < self.throttle:
+            return
+
+        # Accepted refreshes are sent too, they restart the clients' timeouts
+        self._typing[key] = (user.username, now)
+        self._change(conversation_id, user.username, True)
+
+    def stop_typing(self, user_id: int, conversation_id: int | None = None):
+        """
+        Stop typing in one conversation, or in all of them.
+        """
+        for key in self._keys(user_id, conversation_id):
+            username, _ = self._typing.pop(key)
+            self._change(key[1], username, False)
+
+    def forget(self, user_id: int):
+        for key in self._keys(user_id):
+            username, _ = self._typing.pop(key)
+            self._pending.pop((key[1], username), None)
+
+    async def flush(self):
+        self._expire()
+
+        pending, self._pending = self._pending, {}
+        by_conversation: dict[int, list[dict]] = {}
+        for (conversation_id, username), typing in pending.items():
+            by_conversation.setdefault(conversation_id, []).append({"username": username, "typing": typing})
+
+        for conversation_id, users in by_conversation.items():
+            await backplane.publish(TYPING_CHANNEL, {
+                "type": "typing",
+                "conversation_id": conversation_id,
+                "data": {"users": users, "timeout": self.timeout}
+            })
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _keys(self, user_id: int, conversation_id: int | None = None) -> list[tuple[int, int]]:
+        if conversation_id is not None:
+            return [(user_id, conversation_id)] if (user_id, conversation_id) in self._typing else []
+        return [key for key in self._typing if key[0] == user_id]
+
+    def _change(self, conversation_id: int, username: str, typing: bool):
+        self._pending[conversation_id, username] = typing
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.timeout
+        for (user_id, conversation_id), (_, accepted_at) in list(self._typing.items()):
+            if accepted_at < cutoff:
+                self.stop_typing(user_id, conversation_id)
+
+    async def _run(self):
+        # Only runs while someone is typing or an event is waiting
+        while self._typing or self._pending:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Typing flush failed")
+
+
+typing_tracker = TypingTracker()
+backplane.subscribe(USER_DELETED_CHANNEL, lambda user: typing_tracker.forget(user["id"]))
@@ -0,0 +1,35 @@
+"""
+uvicorn's WebSocket protocol with permessage-deflate settings of our own.
+uvicorn hardcodes them, select this class to use ours instead:
+
+    uvicorn main:app --ws websocket_protocol:ChatWebSocketProtocol
+"""
+import logging
+
+from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.server import ServerProtocol
+
+from constants import WS_DEFLATE_LEVEL, WS_DEFLATE_MEM_LEVEL, WS_DEFLATE_WINDOW_BITS
+
+
+def deflate_factory() -> ServerPerMessageDeflateFactory:
+    # Context takeover stays on: chat events repeat the same keys and
+    # usernames, so each frame compresses against the previous ones.
+    # Client frames are short requests, a small window is enough for them.
+    return ServerPerMessageDeflateFactory(
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        client_max_window_bits=12,
+        compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL}
+    )
+
+
+class ChatWebSocketProtocol(WebSocketsSansIOProtocol):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.conn = ServerProtocol(
+                extensions=[deflate_factory()],
+                max_size=self.config.ws_max_size,
+                logger=logging.getLogger("uvicorn.error")
+            )
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from typing import Any, Callable
+
+from constants import WRITE_BATCH_MAX_SIZE, WRITE_BATCH_WINDOW_MS
+from db import WriteSessionLocal, db_executor
+from metrics import Gauge, registry
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class GroupCommitWriter:
+    """
+    Single writer task for the database. Writes queued within a short window
+    are applied in one transaction and committed together, so a burst of
+    messages costs one fsync instead of one per message.
+
+    Every write runs in its own SAVEPOINT: one that raises is rolled back on
+    its own and its caller gets the exception, the rest of the batch commits.
+    Writes must not commit themselves, the writer does that.
+    """
+
+    def __init__(self, window: float = WRITE_BATCH_WINDOW_MS / 1000, max_size: int = WRITE_BATCH_MAX_SIZE) -> None:
+        self.window = window
+        self.max_size = max_size
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Queue `fn(db, *args)` for the next group commit and return its result
+        once that commit went through.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._start(loop)
+
+        future = loop.create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def stop(self):
+        """
+        Stop the writer task. The batch it has taken off the queue still
+        commits, writes still queued fail instead of waiting forever.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while self._queue and not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Database writer stopped"))
+
+    def _start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def _collect(self, batch: list):
+        batch.append(await self._queue.get())
+        deadline = self._loop.time() + self.window
+
+        while len(batch) < self.max_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        while True:
+            batch = []
+            committing = None
+            try:
+                await self._collect(batch)
+                committing = self._loop.create_task(self._commit(batch))
+                await asyncio.shield(committing)
+            except asyncio.CancelledError:
+                # Stopped: writes already taken off the queue still commit
+                # and their callers get the results
+                if committing is None and batch:
+                    committing = self._loop.create_task(self._commit(batch))
+                if committing:
+                    await committing
+                raise
+
+    async def _commit(self, batch: list):
+        try:
+            results = await self._loop.run_in_executor(db_executor, self._apply, batch)
+        except Exception as e:
+            results = [(e, None)] * len(batch)
+
+        for (_, _, future), (error, result) in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _apply(self, batch: list) -> list[tuple[Exception | None, Any]]:
+        results = []
+        with WriteSessionLocal() as db:
+            for fn, args, _ in batch:
+                try:
+                    with db.begin_nested():
+                        results.append((None, fn(db, *args)))
+                except Exception as e:
+                    results.append((e, None))
+
+            try:
+                db.commit()
+            except Exception as e:
+                logger.exception("Group commit failed")
+                return [(e, None)] * len(batch)
+
+        return results
+
+
+db_writer = GroupCommitWriter()
+registry.register(Gauge(
+    "fromchat_db_writer_backlog", "Writes queued for the next group commit",
+    lambda: {(): db_writer.backlog}
+))
@@ -14,6 +14,11 @@ import { show as showUserProfileDialog } from "./profileDialog";
 import defaultAvatar from "../resources/images/default-avatar.png";
 import { authToken, currentUser, getAuthHeaders } from "../auth/api";
 
+// Cursor of the oldest loaded message, for loading older history
+let prevCursor: string | null = null;
+let hasOlderMessages = false;
+let loadingOlderMessages = false;
+
 /**
  * Adds a new message to the chat interface
  * @param {Message} message - Message object to display
@@ -21,6 +26,19 @@ import { authToken, currentUser, getAuthHeaders } from "../auth/api";
  */
 export function addMessage(message: Message, isAuthor: boolean): void {
     const messagesContainer = document.querySelector('.chat-messages') as HTMLElement;
+    messagesContainer.appendChild(createMessageElement(message, isAuthor));
+
+    // Прокрутка к новому сообщению
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+/**
+ * Builds the element of a message
+ * @param {Message} message - Message object to display
+ * @param {boolean} isAuthor - Whether the current user is the message author
+ * @returns {HTMLElement} The message element
+ */
+function createMessageElement(message: Message, isAuthor: boolean): HTMLElement {
     const messageDiv = document.createElement('div');
     messageDiv.classList.add("message");
     if (isAuthor) {
@@ -102,15 +120,8 @@ export function addMessage(message: Message, isAuthor: boolean): void {
     }
     timeDiv.textContent = timeText;
 
-    if (isAuthor && message.is_read) {
-        const checkIcon = document.createElement('span');
-        checkIcon.classList.add("material-symbols", "outlined");
-        timeDiv.appendChild(checkIcon);
-    }
-
     messageInner.appendChild(timeDiv);
     messageDiv.appendChild(messageInner);
-    messagesContainer.appendChild(messageDiv);
 
     // Add right-click context menu
     messageDiv.addEventListener('contextmenu', (e) => {
@@ -118,8 +129,7 @@ export function addMessage(message: Message, isAuthor: boolean): void {
         showContextMenu(message, e.clientX, e.clientY);
     });
 
-    // Прокрутка к новому сообщению
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageDiv;
 }
 
 /**
@@ -131,9 +141,14 @@ export function loadMessages(): void {
     })
         .then(response => response.json())
         .then((data: Messages) => {
-            if (data.messages && data.messages.length > 0) {
-                const messagesContainer = document.querySelector('.chat-messages') as HTMLElement;
+            const messagesContainer = document.querySelector('.chat-messages') as HTMLElement;
+            // The first page sets where older history starts
+            if (!messagesContainer.lastElementChild) {
+                prevCursor = data.prev_cursor ?? null;
+                hasOlderMessages = data.has_more ?? false;
+            }
 
+            if (data.messages && data.messages.length > 0) {
                 const lastMessage = messagesContainer.lastElementChild as HTMLElement
                 let lastMessageId: number = 0
                 if (lastMessage) {
@@ -150,6 +165,47 @@ export function loadMessages(): void {
         });
 }
 
+/**
+ * Loads the page of messages before the oldest one shown
+ */
+export function loadOlderMessages(): void {
+    if (!hasOlderMessages || !prevCursor || loadingOlderMessages) {
+        return;
+    }
+    loadingOlderMessages = true;
+
+    fetch(`${API_BASE_URL}/get_messages?before=${encodeURIComponent(prevCursor)}`, {
+        headers: getAuthHeaders()
+    })
+        .then(response => response.json())
+        .then((data: Messages) => {
+            const messagesContainer = document.querySelector('.chat-messages') as HTMLElement;
+            const firstMessage = messagesContainer.firstElementChild as HTMLElement | null;
+            const firstMessageId = firstMessage ? Number(firstMessage.dataset.id) : Infinity;
+
+            // Keep the messages in view where they are
+            const scrollBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop;
+            const fragment = document.createDocumentFragment();
+            data.messages
+                .filter(msg => msg.id < firstMessageId)
+                .forEach(msg => fragment.appendChild(createMessageElement(msg, msg.username == currentUser!.username)));
+            messagesContainer.prepend(fragment);
+            messagesContainer.scrollTop = messagesContainer.scrollHeight - scrollBottom;
+
+            prevCursor = data.prev_cursor ?? prevCursor;
+            hasOlderMessages = data.has_more ?? false;
+        })
+        .finally(() => {
+            loadingOlderMessages = false;
+        });
+}
+
+document.getElementById('chat-messages')!.addEventListener('scroll', (e) => {
+    if ((e.target as HTMLElement).scrollTop < 100) {
+        loadOlderMessages();
+    }
+});
+
 /**
  * Sends a message via WebSocket
  */
@@ -184,12 +240,73 @@ export function sendMessage(): void {
     }
 }
 
+/**
+ * Minimum time between typing frames in milliseconds, the server drops more frequent ones
+ * @type {number}
+ */
+const TYPING_SEND_INTERVAL = 2000;
+let lastTypingSent = 0;
+
+/**
+ * Tells the server that the user is typing, at most once per TYPING_SEND_INTERVAL
+ */
+export function sendTyping(): void {
+    const now = Date.now();
+    if (!authToken || now - lastTypingSent < TYPING_SEND_INTERVAL) return;
+    lastTypingSent = now;
+
+    const payload: WebSocketMessage = {
+        type: "typing",
+        credentials: {
+            scheme: "Bearer",
+            credentials: authToken
+        }
+    }
+    websocket.send(JSON.stringify(payload));
+}
+
 
 document.getElementById('message-form')!.addEventListener('submit', (e) => {
     e.preventDefault();
+    // The server stops the typing indicator when the message arrives
+    lastTypingSent = 0;
     sendMessage();
 });
 
+document.getElementById('message-input')!.addEventListener('input', sendTyping);
+
+/**
+ * Users currently typing, with the timers that hide them if no update comes
+ * @type {Map<string, number>}
+ */
+const typingUsers = new Map<string, number>();
+
+/**
+ * Shows or hides a user in the typing indicator
+ * @param {string} username - User who started or stopped typing
+ * @param {boolean} typing - Whether the user is typing
+ * @param {number} timeout - Seconds after which the server considers them stopped
+ */
+export function setTyping(username: string, typing: boolean, timeout: number): void {
+    if (username === currentUser?.username) return;
+
+    clearTimeout(typingUsers.get(username));
+    typingUsers.delete(username);
+    if (typing) {
+        typingUsers.set(username, window.setTimeout(() => setTyping(username, false, timeout), timeout * 1000));
+    }
+
+    const indicator = document.getElementById('typing-indicator') as HTMLElement;
+    const usernames = [...typingUsers.keys()];
+    if (usernames.length === 0) {
+        indicator.textContent = '';
+    } else if (usernames.length === 1) {
+        indicator.textContent = `${usernames[0]} печатает...`;
+    } else {
+        indicator.textContent = `${usernames.join(', ')} печатают...`;
+    }
+}
+
 /**
  * Updates an existing message in the chat interface
  * @param {Message} message - Updated message object
@@ -241,8 +358,25 @@ export function handleWebSocketMessage(response: WebSocketMessage): void {
                 removeMessage(response.data.message_id);
             }
             break;
+        case 'messagesDeleted':
+            if (response.data && response.data.message_ids) {
+                response.data.message_ids.forEach((messageId: number) => removeMessage(messageId));
+            }
+            break;
+        case 'typing':
+            if (response.data && response.data.users) {
+                response.data.users.forEach((user: { username: string, typing: boolean }) => {
+                    setTyping(user.username, user.typing, response.data.timeout);
+                });
+            }
+            break;
         case 'newMessage':
             if (response.data) {
+                // Replayed events are upserts, a compacted edit arrives as a newMessage
+                if (document.querySelector(`[data-id="${response.data.id}"]`)) {
+                    updateMessage(response.data);
+                    break;
+                }
                 const isAuthor = response.data.username === currentUser?.username;
                 addMessage(response.data, isAuthor);
             }
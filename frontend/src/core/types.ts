@@ -37,9 +37,9 @@ export interface Size2D {
  * Chat message structure
  * @interface Message
  * @property {number} id - Unique message identifier
+ * @property {number} [conversation_id] - Conversation the message belongs to, 1 is the public room
  * @property {string} username - Username of the message sender
  * @property {string} content - Message content
- * @property {boolean} is_read - Whether the message has been read
  * @property {boolean} is_edited - Whether the message has been edited
  * @property {string} timestamp - ISO timestamp of the message
  * @property {string} [profile_picture] - URL to sender's profile picture
@@ -47,9 +47,9 @@ export interface Size2D {
  */
 export interface Message {
     id: number;
+    conversation_id?: number;
     username: string;
     content: string;
-    is_read: boolean;
     is_edited: boolean;
     timestamp: string;
     profile_picture?: string;
@@ -60,9 +60,13 @@ export interface Message {
  * Collection of messages
  * @interface Messages
  * @property {Message[]} messages - Array of message objects
+ * @property {boolean} [has_more] - Whether there are older messages before this page
+ * @property {string} [prev_cursor] - Cursor for the page before this one
  */
 export interface Messages {
     messages: Message[];
+    has_more?: boolean;
+    prev_cursor?: string;
 }
 
 /**
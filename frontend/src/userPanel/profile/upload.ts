@@ -82,7 +82,7 @@ async function saveCroppedImage(): Promise<void> {
     if (result) {
         // Update profile picture display
         const profilePicture = document.getElementById('profile-picture') as HTMLImageElement;
-        profilePicture.src = `${result.profile_picture_url}?t=${Date.now()}`; // Cache bust
+        profilePicture.src = result.profile_picture_url; // A new picture always gets a new URL
         
         // Close cropper
         closeCropper();
@@ -134,7 +134,7 @@ function setupEventListeners(): void {
 export async function loadProfilePicture(): Promise<void> {
     const userData = await loadProfile();
     if (userData?.profile_picture) {
-        const url = `${userData.profile_picture}?t=${Date.now()}`;
+        const url = userData.profile_picture;
 
         const profilePicture = document.getElementById('profile-picture') as HTMLImageElement;
         const profilePicture2 = document.getElementById("preview1") as HTMLImageElement;